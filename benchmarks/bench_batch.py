@@ -0,0 +1,60 @@
+"""
+Throughput of a batch of get_peers lookups: one get_peers call per info_hash all gathered at once, versus
+get_peers_many with its shared query scheduler. Reports lookups per second and packets per lookup on a simulated
+network with DelayedRouter.DELAY latency.
+
+Run with: python -m benchmarks.bench_batch
+"""
+import asyncio
+import logging
+import random
+import time
+
+from tests.local_network import DelayedRouter, create_network, close_network
+
+PORT = 49900
+
+
+class CountingRouter(DelayedRouter):
+    packets = 0
+
+    async def send_query_timed(self, addr, method, args, timeout=None):
+        self.packets += 1
+        return await super().send_query_timed(addr, method, args, timeout)
+
+
+async def gathered(client, info_hashes):
+    await asyncio.gather(*(client.get_peers(info_hash) for info_hash in info_hashes))
+
+
+async def batched(client, info_hashes):
+    async for _ in client.get_peers_many(info_hashes):
+        pass
+
+
+async def main(size=300, lookups=500, seed=0):
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    network = await create_network(size, base_port=PORT + 1, router_class=DelayedRouter)
+    info_hashes = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(lookups)]
+
+    results = []
+    for run in (gathered, batched):
+        client = await CountingRouter.create(port=PORT, bootstrap_nodes=(('127.0.0.1', PORT + 1),))
+        await client.bootstrap()
+        client.packets = 0
+        started = time.perf_counter()
+        await run(client, info_hashes)
+        results.append((lookups / (time.perf_counter() - started), client.packets / lookups))
+        client.transport.close()
+        await asyncio.sleep(0.1)
+
+    close_network(network)
+    print('%i nodes, %i lookups, %.0f ms latency per query' % (size, lookups, DelayedRouter.DELAY * 1000))
+    for name, (throughput, packets) in zip(('get_peers', 'get_peers_many'), results):
+        print('%-15s lookups/s: %6.1f  packets per lookup: %5.1f' % (name, throughput, packets))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
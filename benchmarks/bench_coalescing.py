@@ -0,0 +1,65 @@
+"""
+Packets sent by many concurrent lookups, with and without coalescing of identical queries in Router.query_node.
+Every info_hash is looked up by several crawls at once, started a few milliseconds apart, then once more right after,
+the way independent callers of find_peers would. Runs on a simulated network with DelayedRouter.DELAY latency.
+
+Run with: python -m benchmarks.bench_coalescing
+"""
+import asyncio
+import logging
+import random
+
+from oversimplified_dht.node_id import NodeId
+from tests.local_network import DelayedRouter, create_network, close_network
+
+PORT = 49700
+
+
+class CountingRouter(DelayedRouter):
+    packets = 0
+
+    async def send_query_timed(self, addr, method, args, timeout=None):
+        self.packets += 1
+        return await super().send_query_timed(addr, method, args, timeout)
+
+
+class UncoalescedRouter(CountingRouter):
+    async def query_node(self, node, method, args):
+        return await self.send_query_to_node(node, method, args)
+
+
+async def lookups(client, info_hash, crawls):
+    async def crawl(delay):
+        await asyncio.sleep(delay)
+        await client.find_peers(NodeId.from_bytes(info_hash))
+
+    await asyncio.gather(*(crawl(i * 0.005) for i in range(crawls)))
+    await client.find_peers(NodeId.from_bytes(info_hash))
+
+
+async def main(size=150, info_hashes=30, crawls=3, seed=0):
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    network = await create_network(size, base_port=PORT + 1, router_class=DelayedRouter)
+    targets = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(info_hashes)]
+
+    results = []
+    for router_class in (UncoalescedRouter, CountingRouter):
+        client = await router_class.create(port=PORT, bootstrap_nodes=(('127.0.0.1', PORT + 1),))
+        await client.bootstrap()
+        client.packets = 0
+        started = asyncio.get_event_loop().time()
+        await asyncio.gather(*(lookups(client, info_hash, crawls) for info_hash in targets))
+        results.append((client.packets, asyncio.get_event_loop().time() - started))
+        client.transport.close()
+        await asyncio.sleep(0.1)
+
+    close_network(network)
+    print('%i nodes, %i info_hashes looked up by %i concurrent crawls then once more' % (size, info_hashes, crawls))
+    for name, (packets, elapsed) in zip(('uncoalesced', 'coalesced'), results):
+        print('%-12s packets sent: %5i  in %4.0f ms' % (name, packets, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,48 @@
+"""
+Messages per second through the generic bencode codec and through oversimplified_dht.codec,
+for the message shapes that dominate DHT traffic.
+
+Run with: python -m benchmarks.bench_codec
+"""
+import timeit
+from os import urandom
+
+import bencode as b
+
+from oversimplified_dht import codec
+
+TRANSACTION_ID = b'\x12\x34'
+MESSAGES = {
+    'ping query': {b'a': {b'id': urandom(20)}, b'q': b'ping', b't': TRANSACTION_ID, b'y': b'q'},
+    'find_node query': {b'a': {b'id': urandom(20), b'target': urandom(20)}, b'q': b'find_node',
+                        b't': TRANSACTION_ID, b'y': b'q'},
+    'get_peers query': {b'a': {b'id': urandom(20), b'info_hash': urandom(20)}, b'q': b'get_peers',
+                        b't': TRANSACTION_ID, b'y': b'q'},
+    'ping response': {b'r': {b'id': urandom(20)}, b't': TRANSACTION_ID, b'y': b'r'},
+    'find_node response': {b'r': {b'id': urandom(20), b'nodes': urandom(26 * 8)}, b't': TRANSACTION_ID,
+                           b'y': b'r'},
+    'get_peers response': {b'r': {b'id': urandom(20), b'token': urandom(8),
+                                  b'values': [urandom(6) for _ in range(20)]}, b't': TRANSACTION_ID, b'y': b'r'},
+}
+
+
+def fast_encode(message):
+    if message[b'y'] == b'q':
+        return codec.encode_query(message[b't'], message[b'q'], message[b'a'])
+    return codec.encode_response(message[b't'], message[b'r'])
+
+
+def rate(function, argument, number=20000):
+    return number / timeit.timeit(lambda: function(argument), number=number)
+
+
+def main():
+    print('%-20s %14s %14s %14s %14s' % ('message', 'bencode enc/s', 'codec enc/s', 'bencode dec/s', 'codec dec/s'))
+    for name, message in MESSAGES.items():
+        data = b.encode(message)
+        print('%-20s %14.0f %14.0f %14.0f %14.0f' % (name, rate(b.encode, message), rate(fast_encode, message),
+                                                     rate(b.decode, data), rate(codec.decode, data)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Parsing compact node lists eagerly with parse_compact_nodes against the lazy CompactNodeList, for the ways the
+crawler uses them: keeping the 8 closest entries, and keeping the entries it hasn't seen yet.
+Reports peak memory allocated during a call (tracemalloc) and parse throughput.
+
+Run with: python -m benchmarks.bench_compact_nodes
+"""
+import os
+import random
+import timeit
+import tracemalloc
+
+from oversimplified_dht.node import CompactNodeList, parse_compact_nodes
+from oversimplified_dht.node_id import NodeId
+
+
+def eager_closest(data, target):
+    return sorted(parse_compact_nodes(data), key=lambda info: target ^ info.id)[:8]
+
+
+def lazy_closest(data, target):
+    return CompactNodeList(data).closest(target, 8)
+
+
+def eager_unseen(data, seen):
+    return [info for info in parse_compact_nodes(data) if bytes(info.id) not in seen]
+
+
+def lazy_unseen(data, seen):
+    return CompactNodeList(data).node_infos(skip=seen)
+
+
+def peak(function, *args):
+    tracemalloc.start()
+    function(*args)
+    _, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_size
+
+
+def main():
+    rng = random.Random(0)
+    target = NodeId.from_int(rng.getrandbits(160))
+    print('%6s %-8s %16s %16s %12s %12s' % ('nodes', 'keeps', 'eager peak bytes', 'lazy peak bytes',
+                                             'eager us', 'lazy us'))
+    for size in (8, 100, 1000):
+        data = os.urandom(26 * size)
+        # the crawler has usually seen most of the nodes it is told about
+        seen = {data[i:i + 20] for i in range(0, len(data), 26) if rng.random() < 0.75}
+        number = max(10, 100000 // size)
+        for keeps, eager, lazy, argument in (('closest', eager_closest, lazy_closest, target),
+                                             ('unseen', eager_unseen, lazy_unseen, seen)):
+            assert eager(data, argument) == lazy(data, argument)
+            eager_time = timeit.timeit(lambda: eager(data, argument), number=number) / number
+            lazy_time = timeit.timeit(lambda: lazy(data, argument), number=number) / number
+            print('%6i %-8s %16i %16i %12.1f %12.1f' % (
+                size, keeps, peak(eager, data, argument), peak(lazy, data, argument),
+                eager_time * 1e6, lazy_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
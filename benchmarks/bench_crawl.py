@@ -0,0 +1,80 @@
+"""
+Compares lookup latency and query count of NodeCrawler against the lock-step rounds it replaced,
+on a simulated network where a few peers are slow or never answer.
+
+Run with: python -m benchmarks.bench_crawl
+"""
+import asyncio
+import logging
+import time
+from math import inf
+
+from oversimplified_dht.crawl import NodeCrawler
+from oversimplified_dht.node import Node, NodeId
+from tests.test_crawl import SimulatedNetwork
+
+TIMEOUT = 1
+
+
+class LockStepCrawler:
+    """NodeCrawler.run as it used to be: a full round with asyncio.gather, then the next one"""
+
+    def __init__(self, rpc_find, nodes, target):
+        self.rpc_find = rpc_find
+        self.nodes = nodes
+        self.target = target
+        self._best = inf
+
+    async def run(self):
+        while True:
+            node_infos = []
+            results = await asyncio.gather(*(self.rpc_find(node, self.target) for node in self.nodes),
+                                           return_exceptions=True)
+            for r in results:
+                if not isinstance(r, Exception):
+                    node_infos += r[0]
+            node_infos = sorted(node_infos, key=lambda x: x.id ^ self.target)[:8]
+            if not node_infos:
+                return
+            distance = self.target ^ node_infos[0].id
+            if distance >= self._best:
+                return
+            self._best = distance
+            self.nodes = [Node(info) for info in node_infos]
+
+
+def with_timeout(network):
+    async def rpc_find(node, target):
+        return await asyncio.wait_for(network.rpc_find(node, target), TIMEOUT)
+
+    return rpc_find
+
+
+async def measure(make_crawler, lookups=20):
+    network = SimulatedNetwork(size=2000, seed=1)
+    for info in network.infos:
+        network.delays[info.id] = network.rng.lognormvariate(-3.5, 0.8)  # median ~30ms
+    for info in network.rng.sample(network.infos, len(network.infos) // 20):
+        network.delays[info.id] = 5  # never answers in time
+    rpc_find = with_timeout(network)
+
+    started = time.perf_counter()
+    for _ in range(lookups):
+        target = NodeId.from_int(network.rng.getrandbits(160))
+        await make_crawler(rpc_find, network.seeds(8), target).run()
+    return (time.perf_counter() - started) / lookups, network.queries / lookups
+
+
+def main():
+    logging.getLogger('oversimplified_dht.crawl').setLevel(logging.WARNING)
+    loop = asyncio.get_event_loop()
+    print('%-12s %14s %16s' % ('crawler', 'ms per lookup', 'queries/lookup'))
+    for name, make_crawler in (('lock-step', LockStepCrawler),
+                               ('alpha=3', lambda r, n, t: NodeCrawler(r, n, t, lambda _: None, alpha=3)),
+                               ('alpha=8', lambda r, n, t: NodeCrawler(r, n, t, lambda _: None, alpha=8))):
+        latency, queries = loop.run_until_complete(measure(make_crawler))
+        print('%-12s %14.1f %16.1f' % (name, latency * 1000, queries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Ranks batches of nodes by XOR distance to a target: the per-object path (sort on Python ints through NodeId) against
+oversimplified_dht.distance.closest, and against ranking alone on ids already held in an array.
+
+Run with: python -m benchmarks.bench_distance
+"""
+import random
+import timeit
+from operator import attrgetter
+
+from oversimplified_dht import distance
+from oversimplified_dht.node import Node, NodeInfo, NodeId
+
+
+def per_object(target, nodes, k):
+    return sorted(nodes, key=lambda node: node.id ^ target)[:k]
+
+
+def main():
+    rng = random.Random(0)
+    key = attrgetter('id')
+    print('%8s %6s %14s %14s %14s' % ('nodes', 'k', 'per object us', 'closest us', 'array only us'))
+    for size in (16, 32, 64, 128, 1000, 10000, 100000):
+        nodes = [Node(NodeInfo('127.0.0.1', 6881, NodeId.from_int(rng.getrandbits(160)))) for _ in range(size)]
+        target = NodeId.from_int(rng.getrandbits(160))
+        ids = distance.id_array(b''.join(bytes(node.id) for node in nodes))
+        number = max(1, 100000 // size)
+        for k in (8, size):
+            assert per_object(target, nodes, k) == distance.closest(target, nodes, k, key)
+            slow = timeit.timeit(lambda: per_object(target, nodes, k), number=number) / number
+            fast = timeit.timeit(lambda: distance.closest(target, nodes, k, key), number=number) / number
+            array = timeit.timeit(lambda: distance.top_k(distance.xor_distances(bytes(target), ids), k),
+                                  number=number) / number
+            print('%8i %6i %14.1f %14.1f %14.1f' % (size, k, slow * 1e6, fast * 1e6, array * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Queries per second a node answers for a legitimate peer while another IP floods it with get_peers queries,
+with and without inbound query limits. The flood comes from 127.0.0.2, the legitimate peer from 127.0.0.1.
+
+Run with: python -m benchmarks.bench_flood
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from oversimplified_dht import Router
+from oversimplified_dht.codec import encode_query
+
+PORT = 50000
+DURATION = 2  # seconds per scenario
+CONCURRENCY = 20  # queries the legitimate peer keeps in flight
+FLOOD_BURST = 500  # datagrams the flood sends every event loop iteration
+
+
+class LimitedRouter(Router):
+    QUERIES_PER_SOURCE = 200
+    QUERY_CPU_BUDGET = 0.5
+
+
+async def legitimate(client, server_address):
+    answered = 0
+    deadline = time.perf_counter() + DURATION
+
+    async def worker():
+        nonlocal answered
+        while time.perf_counter() < deadline:
+            try:
+                await client.send_query(server_address, b'find_node',
+                                        {b'id': bytes(client.node_id), b'target': os.urandom(20)}, timeout=0.5)
+                answered += 1
+            except asyncio.TimeoutError:
+                pass
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return answered / DURATION
+
+
+async def flood(server_address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.2', 0))
+    sock.setblocking(False)
+    queries = [encode_query(i.to_bytes(2, 'big'), b'get_peers', {b'id': os.urandom(20), b'info_hash': os.urandom(20)})
+               for i in range(FLOOD_BURST)]
+    try:
+        while True:
+            for query in queries:
+                try:
+                    sock.sendto(query, server_address)
+                except BlockingIOError:
+                    break
+            await asyncio.sleep(0)
+    finally:
+        sock.close()
+
+
+async def main():
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl', 'oversimplified_dht.krpc'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    server_address = ('127.0.0.1', PORT + 1)
+    client = await Router.create(port=PORT)
+
+    for name, router_class, flooded in (('no flood', Router, False), ('flood', Router, True),
+                                        ('flood, limited', LimitedRouter, True)):
+        server = await router_class.create(port=PORT + 1)
+        flooder = asyncio.ensure_future(flood(server_address)) if flooded else None
+        answered = await legitimate(client, server_address)
+        if flooder is not None:
+            flooder.cancel()
+        print('%-15s legitimate queries answered: %6.0f/s  dropped: %i' % (
+            name, answered, server.query_limiter.dropped + server.query_limiter.dropped_cpu))
+        server.transport.close()
+        await asyncio.sleep(0.1)
+
+    client.transport.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
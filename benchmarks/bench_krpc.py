@@ -0,0 +1,47 @@
+"""
+Queries per second over loopback with a per-query asyncio.wait_for, as Router used to send them,
+against the deadlines KRPCProtocol keeps itself.
+
+Run with: python -m benchmarks.bench_krpc
+"""
+import asyncio
+import time
+
+from oversimplified_dht.krpc import KRPCProtocol
+
+
+class PingServer(KRPCProtocol):
+    def krpc_handle_ping(self, request, address):
+        return self.response(request, {b'id': b'\x00' * 20})
+
+
+async def run(client, address, queries, concurrency, use_wait_for):
+    async def query():
+        if use_wait_for:
+            await asyncio.wait_for(client.send_query(address, b'ping', {b'id': b'\x01' * 20}), 2)
+        else:
+            await client.send_query(address, b'ping', {b'id': b'\x01' * 20}, timeout=2)
+
+    answered = 0
+    started = time.perf_counter()
+    for _ in range(queries // concurrency):
+        results = await asyncio.gather(*(query() for _ in range(concurrency)), return_exceptions=True)
+        answered += sum(not isinstance(r, asyncio.TimeoutError) for r in results)
+    return answered / (time.perf_counter() - started)
+
+
+async def main(queries=10000):
+    loop = asyncio.get_running_loop()
+    _, server = await loop.create_datagram_endpoint(PingServer, local_addr=('127.0.0.1', 49101))
+    _, client = await loop.create_datagram_endpoint(KRPCProtocol, local_addr=('127.0.0.1', 49102))
+    address = ('127.0.0.1', 49101)
+
+    print('%12s %16s %16s' % ('concurrency', 'wait_for q/s', 'deadline q/s'))
+    for concurrency in (10, 50, 200):
+        wait_for = await run(client, address, queries, concurrency, use_wait_for=True)
+        deadline = await run(client, address, queries, concurrency, use_wait_for=False)
+        print('%12i %16.0f %16.0f' % (concurrency, wait_for, deadline))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
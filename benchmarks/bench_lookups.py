@@ -0,0 +1,73 @@
+"""
+Waves of concurrent get_peers lookups over a small region of the keyspace, some of them for the same info_hash,
+with and without the node cache and lookup sharing. Reports queries sent and mean lookup latency on a simulated
+network with DelayedRouter.DELAY latency per query.
+
+Run with: python -m benchmarks.bench_lookups
+"""
+import asyncio
+import logging
+import random
+import time
+
+from oversimplified_dht.node_cache import NodeCache
+from tests.local_network import DelayedRouter, create_network, close_network
+
+PORT = 49600
+
+
+class CountingRouter(DelayedRouter):
+    queries = 0
+
+    async def send_query_to_node(self, node, method, args):
+        self.queries += 1
+        return await super().send_query_to_node(node, method, args)
+
+
+async def run(client, info_hashes, lookup):
+    client.queries = 0
+    latencies = []
+
+    async def timed(info_hash):
+        started = time.perf_counter()
+        await lookup(info_hash)
+        latencies.append(time.perf_counter() - started)
+
+    for wave in info_hashes:
+        await asyncio.gather(*(timed(info_hash) for info_hash in wave))
+    return client.queries, sum(latencies) / len(latencies)
+
+
+async def main(size=400, waves=5, per_wave=20, seed=0):
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    network = await create_network(size, base_port=PORT + 1, router_class=DelayedRouter)
+    prefix = rng.getrandbits(12) << 148
+    info_hashes = []
+    for _ in range(waves):
+        wave = [(prefix | rng.getrandbits(148)).to_bytes(20, 'big') for _ in range(per_wave // 2)]
+        info_hashes.append(wave + wave)  # every info_hash is looked up twice at the same time
+
+    results = []
+    for cached in (False, True):
+        client = await CountingRouter.create(port=PORT, bootstrap_nodes=(('127.0.0.1', PORT + 1),))
+        await client.bootstrap()
+        if cached:
+            lookup = client.get_peers
+        else:
+            client.node_cache = NodeCache(max_nodes=0)
+            lookup = lambda info_hash: client.find_peers(client.node_id.from_bytes(info_hash))
+        results.append(await run(client, info_hashes, lookup))
+        client.transport.close()
+        await asyncio.sleep(0.1)
+
+    close_network(network)
+    print('%i nodes, %i waves of %i lookups, %.0f ms latency per query' % (
+        size, waves, per_wave, DelayedRouter.DELAY * 1000))
+    for name, (queries, latency) in zip(('uncached', 'cached'), results):
+        print('%-9s queries: %5i  mean lookup: %4.0f ms' % (name, queries, latency * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
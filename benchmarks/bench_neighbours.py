@@ -0,0 +1,84 @@
+"""
+Compares RoutingTable.get_neighbours against the bucket traversal it replaced and a brute force sort.
+
+Run with: python -m benchmarks.bench_neighbours
+"""
+import heapq
+import operator
+import random
+import timeit
+
+from oversimplified_dht.node import Node, NodeInfo
+from oversimplified_dht.node_id import NodeId
+from oversimplified_dht.routing_table.table import RoutingTable
+
+
+class TableTraverser:
+    """The traversal get_neighbours used to do, kept here for comparison"""
+
+    def __init__(self, table, node_id):
+        index, bucket = table.get_bucket_for(node_id)
+        self.currentNodes = table.buckets[index].get_nodes_list()
+        self.leftBuckets = table.buckets[:index]
+        self.rightBuckets = table.buckets[(index + 1):]
+        self.left = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if len(self.currentNodes) > 0:
+            return self.currentNodes.pop()
+        if self.left and len(self.leftBuckets) > 0:
+            self.currentNodes = self.leftBuckets.pop().get_nodes_list()
+            self.left = False
+            return next(self)
+        if len(self.rightBuckets) > 0:
+            self.currentNodes = self.rightBuckets.pop(0).get_nodes_list()
+            self.left = True
+            return next(self)
+        raise StopIteration
+
+
+def traverser_neighbours(table, node_id, k=8):
+    nodes = []
+    for node in TableTraverser(table, node_id):
+        heapq.heappush(nodes, (node_id ^ node.id, id(node), node))
+        if len(nodes) == k:
+            break
+    return list(map(operator.itemgetter(2), heapq.nsmallest(k, nodes)))
+
+
+def brute_force_neighbours(table, node_id, k=8):
+    return sorted((n for b in table.buckets for n in b), key=lambda n: node_id ^ n.id)[:k]
+
+
+def build_table(candidates: int, seed=0) -> RoutingTable:
+    rng = random.Random(seed)
+    table = RoutingTable(NodeId.from_int(rng.getrandbits(160)))
+    for _ in range(candidates):
+        node_id = NodeId.from_int(int(table.node_id) ^ rng.getrandbits(rng.randint(1, 160)))
+        node = Node(NodeInfo('127.0.0.1', 6881, node_id))
+        node.record_responded()
+        table.add_node(node)
+    return table
+
+
+def main(queries=2000):
+    rng = random.Random(1)
+    print('%6s %6s %16s %16s %16s %10s' % ('nodes', 'bucket', 'traverser us/op', 'brute us/op', 'new us/op',
+                                          'traverser exact'))
+    for candidates in (50, 200, 1000, 10000):
+        table = build_table(candidates)
+        targets = [NodeId.from_int(rng.getrandbits(160)) for _ in range(queries)]
+        exact = sum(
+            [n.id for n in traverser_neighbours(table, t)] == [n.id for n in brute_force_neighbours(table, t)]
+            for t in targets)
+        results = [timeit.timeit(lambda: [f(table, t) for t in targets], number=1) / queries * 1e6
+                   for f in (traverser_neighbours, brute_force_neighbours, RoutingTable.get_neighbours)]
+        print('%6i %6i %16.2f %16.2f %16.2f %9i%%' % ((sum(map(len, table.buckets)), len(table.buckets)) +
+                                                    tuple(results) + (100 * exact // queries,)))
+
+
+if __name__ == '__main__':
+    main()
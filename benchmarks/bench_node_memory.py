@@ -0,0 +1,80 @@
+"""
+Memory taken per node, as measured by tracemalloc, for crawler shortlists (node infos parsed from compact node
+lists) and for routing table style Node records, compared with the dataclass and datetime representation they replaced.
+
+Run with: python -m benchmarks.bench_node_memory
+"""
+import datetime
+import os
+import tracemalloc
+from dataclasses import dataclass
+
+from bencode.misc import unpack_compact_peer
+
+from oversimplified_dht.node import Node, parse_compact_nodes
+from oversimplified_dht.node_id import NodeId
+
+
+@dataclass
+class OldNodeInfo:
+    host: str
+    port: int
+    id: NodeId
+
+
+class OldNode:
+    def __init__(self, node_info):
+        self.info = node_info
+        self.last_interaction = None
+        self.queries_not_responded = 0
+        self.last_response = None
+        self.srtt = None
+        self.rttvar = None
+
+
+def old_parse_compact_nodes(data):
+    node_infos = []
+    for position in range(0, len(data), 26):
+        ip, port = unpack_compact_peer(data[position + 20:position + 26])
+        node_infos.append(OldNodeInfo(ip, port, NodeId(data[position:position + 20],
+                                                       int.from_bytes(data[position:position + 20], 'big'))))
+    return node_infos
+
+
+def old_nodes(data):
+    nodes = [OldNode(info) for info in old_parse_compact_nodes(data)]
+    for node in nodes:
+        node.last_response = node.last_interaction = datetime.datetime.now()
+    return nodes
+
+
+def new_nodes(data):
+    nodes = [Node(info) for info in parse_compact_nodes(data)]
+    for node in nodes:
+        node.record_responded()
+    return nodes
+
+
+def measure(function, data, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function(data)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(result) == count
+    return (after - before) / count
+
+
+def main(count=100000):
+    data = os.urandom(26 * count)
+    print('%i nodes, bytes per node' % count)
+    for name, old, new in (('node infos', old_parse_compact_nodes, parse_compact_nodes),
+                           ('nodes', old_nodes, new_nodes)):
+        old_size = measure(old, data, count)
+        new_size = measure(new, data, count)
+        print('%-10s  before: %5.0f  after: %5.0f  (%.0f%% less)' % (
+            name, old_size, new_size, 100 * (1 - new_size / old_size)))
+
+
+if __name__ == '__main__':
+    main()
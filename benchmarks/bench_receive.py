@@ -0,0 +1,83 @@
+"""
+Loopback flood of ping queries at a Router, received through asyncio's datagram transport and through
+batch.BatchDatagramTransport, each also on uvloop when it's installed. The flood comes from FLOODERS processes of
+its own; the Router runs on a single core, so queries answered per second are per core.
+
+Run with: python -m benchmarks.bench_receive
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+
+from oversimplified_dht import Router
+from oversimplified_dht import batch
+from oversimplified_dht.codec import encode_query
+
+PORT = 50300
+FLOODERS = 2
+DURATION = 3  # seconds per run
+
+
+class BatchedRouter(Router):
+    BATCHED = True
+
+
+def flood(port: int, stop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    queries = [encode_query(i.to_bytes(2, 'big'), b'ping', {b'id': os.urandom(20)}) for i in range(256)]
+    while not stop.is_set():
+        for query in queries:
+            sock.sendto(query, ('127.0.0.1', port))
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(2048)  # throw the responses away
+        except BlockingIOError:
+            pass
+        sock.setblocking(True)
+
+
+def run(router_class, port: int, uvloop: bool) -> float:
+    if uvloop:
+        batch.install_uvloop()
+    else:
+        asyncio.set_event_loop_policy(None)
+
+    async def main():
+        logging.getLogger('oversimplified_dht.dht').setLevel(logging.WARNING)
+        logging.getLogger('oversimplified_dht.krpc').setLevel(logging.WARNING)
+        router = await router_class.create(port=port)
+        router.add_node = lambda node: None  # the flood's made-up ids would only keep the routing table busy
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        flooders = [context.Process(target=flood, args=(port, stop), daemon=True) for _ in range(FLOODERS)]
+        for process in flooders:
+            process.start()
+        await asyncio.sleep(0.5)  # let them get going
+        before = router.packets_received.get(b'q', b'ping')
+        await asyncio.sleep(DURATION)
+        answered = router.packets_received.get(b'q', b'ping') - before
+        stop.set()
+        for process in flooders:
+            process.join()
+        router.transport.close()
+        return answered / DURATION
+
+    return asyncio.run(main())
+
+
+def main():
+    runs = [('asyncio', Router, False), ('batched', BatchedRouter, False)]
+    if batch.uvloop is not None:
+        runs += [('uvloop', Router, True), ('uvloop batched', BatchedRouter, True)]
+    else:
+        print('uvloop is not installed, skipping it')
+    for i, (name, router_class, uvloop) in enumerate(runs):
+        rate = run(router_class, PORT + i, uvloop)
+        print('%-15s queries answered per second per core: %8.0f' % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Compares the indexed bucket lookup of RoutingTable.get_bucket_for against the linear scan it replaced.
+
+Run with: python -m benchmarks.bench_routing_table
+"""
+import random
+import timeit
+
+from oversimplified_dht.node import Node, NodeInfo
+from oversimplified_dht.node_id import NodeId
+from oversimplified_dht.routing_table.table import RoutingTable
+
+
+def build_table(splits: int, seed=0) -> RoutingTable:
+    rng = random.Random(seed)
+    table = RoutingTable(NodeId.from_int(rng.getrandbits(160)))
+    for _ in range(splits):
+        index, bucket = table.get_bucket_for(table.node_id)
+        node_id = NodeId.from_int(rng.randrange(bucket.min, bucket.max))
+        table.split_bucket(index, Node(NodeInfo('127.0.0.1', 6881, node_id)))
+    return table
+
+
+def linear_get_bucket_for(table: RoutingTable, node_id: NodeId):
+    for index, bucket in enumerate(table.buckets):
+        if bucket.has_id_in_range(node_id):
+            return index, bucket
+    raise ValueError
+
+
+def main(lookups=20000):
+    rng = random.Random(1)
+    print('%8s %14s %14s' % ('buckets', 'linear us/op', 'bisect us/op'))
+    for splits in (10, 40, 80, 159):
+        table = build_table(splits)
+        # Lookups close to our own id land in the deepest buckets, which is what a busy node mostly sees
+        ids = [NodeId.from_int(int(table.node_id) ^ rng.getrandbits(rng.randint(1, 160))) for _ in range(lookups)]
+        linear = timeit.timeit(lambda: [linear_get_bucket_for(table, i) for i in ids], number=1)
+        bisect = timeit.timeit(lambda: [table.get_bucket_for(i) for i in ids], number=1)
+        print('%8i %14.3f %14.3f' % (len(table.buckets), linear / lookups * 1e6, bisect / lookups * 1e6))
+
+
+if __name__ == '__main__':
+    main()
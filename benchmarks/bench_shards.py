@@ -0,0 +1,79 @@
+"""
+Aggregate get_peers throughput of a ShardedRouter as workers are added. The simulated swarm runs in processes of
+its own, SWARM_PROCESSES of them, so that it doesn't share a core with the workers it answers.
+
+Run with: python -m benchmarks.bench_shards
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import time
+
+from oversimplified_dht.shard import ShardedRouter
+from tests.local_network import DelayedRouter, create_network
+
+PORT = 50100
+SWARM_PORT = 50200
+SWARM_PROCESSES = 4
+SWARM_SIZE = 100  # routers per swarm process
+CONCURRENCY = 50  # lookups in flight per worker
+
+
+def run_swarm(index: int, ready):
+    async def main():
+        logging.getLogger('oversimplified_dht.dht').setLevel(logging.WARNING)
+        await create_network(SWARM_SIZE, base_port=SWARM_PORT + index * SWARM_SIZE, router_class=DelayedRouter)
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def start_swarm():
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(SWARM_PROCESSES):
+        ready = context.Event()
+        process = context.Process(target=run_swarm, args=(index, ready), daemon=True)
+        process.start()
+        ready.wait()  # the others bootstrap from the first one
+        processes.append(process)
+    return processes
+
+
+async def throughput(workers: int, lookups: int, rng: random.Random) -> float:
+    router = await ShardedRouter.create(workers, base_port=PORT, bootstrap_nodes=(('127.0.0.1', SWARM_PORT),))
+    await router.bootstrap()
+    info_hashes = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(lookups)]
+    semaphore = asyncio.Semaphore(CONCURRENCY * workers)
+
+    async def lookup(info_hash):
+        async with semaphore:
+            await router.get_peers(info_hash)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(lookup(info_hash) for info_hash in info_hashes))
+    elapsed = time.perf_counter() - started
+    router.close()
+    await router.wait_closed()
+    return lookups / elapsed
+
+
+async def main(lookups_per_worker=200, seed=0):
+    rng = random.Random(seed)
+    swarm = start_swarm()
+    workers = 1
+    print('%i swarm nodes in %i processes, %.0f ms latency per query' % (
+        SWARM_SIZE * SWARM_PROCESSES, SWARM_PROCESSES, DelayedRouter.DELAY * 1000))
+    while workers <= max(1, (os.cpu_count() or 1) - SWARM_PROCESSES):
+        rate = await throughput(workers, lookups_per_worker * workers, rng)
+        print('%3i workers  lookups/s: %7.1f' % (workers, rate))
+        workers *= 2
+    for process in swarm:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Time to the first peer and to the whole answer of get_peers lookups, waiting for the lookup to finish with get_peers
+versus taking peers as they arrive with iter_peers. Some of the nodes close to each info_hash store peers for it.
+Runs on a simulated network with DelayedRouter.DELAY latency.
+
+Run with: python -m benchmarks.bench_streaming
+"""
+import asyncio
+import logging
+import random
+import time
+
+from oversimplified_dht.node_id import NodeId
+from tests.local_network import DelayedRouter, create_network, close_network
+
+PORT = 49800
+
+
+async def time_get_peers(client, info_hash):
+    started = time.perf_counter()
+    await client.get_peers(info_hash)
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+async def time_iter_peers(client, info_hash):
+    started = time.perf_counter()
+    first = None
+    async for _ in client.iter_peers(info_hash):
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+async def main(size=200, info_hashes=20, storing=4, seed=0):
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    rng = random.Random(seed)
+    network = await create_network(size, base_port=PORT + 1, router_class=DelayedRouter)
+    targets = [rng.getrandbits(160).to_bytes(20, 'big') for _ in range(info_hashes)]
+    for info_hash in targets:
+        target = NodeId.from_bytes(info_hash)
+        for router in sorted(network, key=lambda r: target ^ r.node_id)[:storing]:
+            router.peer_storage.store_peer(info_hash, '10.0.0.1', rng.randrange(1024, 65536))
+
+    results = []
+    for lookup in (time_get_peers, time_iter_peers):
+        client = await DelayedRouter.create(port=PORT, bootstrap_nodes=(('127.0.0.1', PORT + 1),))
+        await client.bootstrap()
+        times = [await lookup(client, info_hash) for info_hash in targets]
+        results.append([sum(column) / len(column) for column in zip(*times)])
+        client.transport.close()
+        await asyncio.sleep(0.1)
+
+    close_network(network)
+    print('%i nodes, %i info_hashes stored by the %i closest nodes, %.0f ms latency per query' % (
+        size, info_hashes, storing, DelayedRouter.DELAY * 1000))
+    for name, (first, whole) in zip(('get_peers', 'iter_peers'), results):
+        print('%-10s first peer: %4.0f ms  lookup: %4.0f ms' % (name, first * 1000, whole * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,101 @@
+"""
+Routing table inserts under a heavy crawl: a task per candidate node, the way Router.add_node used to do it, against
+the single task of TableMaintainer. Candidates come in bursts, as they do from find_node responses, a lot of them
+seen more than once, and the questionable nodes of full buckets take PING_DELAY to answer pings, or don't.
+Reports the most tasks alive at once and the candidates handled per second.
+
+Run with: python -m benchmarks.bench_table_maintenance
+"""
+import asyncio
+import random
+import time
+
+from oversimplified_dht.node import Node, NodeInfo
+from oversimplified_dht.node_id import NodeId
+from oversimplified_dht.routing_table.maintenance import TableMaintainer
+from oversimplified_dht.routing_table.table import RoutingTable
+
+PING_DELAY = 0.02
+
+
+def make_candidates(table: RoutingTable, count: int, rng: random.Random):
+    ids = [NodeId.from_int(int(table.node_id) ^ rng.getrandbits(rng.randint(1, 160))) for _ in range(count // 4)]
+    candidates = []
+    for _ in range(count):
+        node = Node(NodeInfo('127.0.0.1', 6881, rng.choice(ids)))
+        node.record_responded()
+        node.last_interaction -= rng.choice((0, 3600))  # half of them questionable by the time buckets are full
+        candidates.append(node)
+    return candidates
+
+
+async def ping(node):
+    await asyncio.sleep(PING_DELAY)
+    if random.random() < 0.5:
+        raise asyncio.TimeoutError()
+
+
+class TaskPerNode:
+    """
+    The insert Router.add_node used to spawn for each candidate: waits for every ping it needs before it's done.
+    """
+
+    def __init__(self, table: RoutingTable):
+        self.table = table
+        self.inserted = 0
+
+    def add(self, node: Node):
+        asyncio.ensure_future(self.insert(node))
+
+    async def insert(self, node: Node):
+        if self.table.add_node(node):
+            self.inserted += 1
+            return
+        for questionable in self.table.nodes_to_ping(node.id):
+            try:
+                await ping(questionable)
+            except asyncio.TimeoutError:
+                self.table.record_ping(questionable, responded=False)
+            else:
+                self.table.record_ping(questionable, responded=True)
+
+
+def busy(inserter, tasks: int) -> bool:
+    if isinstance(inserter, TableMaintainer):
+        return bool(inserter.pending or inserter.pinging)
+    return tasks > 0
+
+
+async def run(make_inserter, candidates: int, burst: int, seed=0):
+    table = RoutingTable(NodeId.from_int(random.Random(seed).getrandbits(160)))
+    nodes = make_candidates(table, candidates, random.Random(seed))
+    inserter = make_inserter(table)
+    baseline = len(asyncio.all_tasks())
+    peak_tasks = 0
+
+    started = time.perf_counter()
+    for i in range(0, len(nodes), burst):
+        for node in nodes[i:i + burst]:
+            inserter.add(node)
+        peak_tasks = max(peak_tasks, len(asyncio.all_tasks()) - baseline)
+        await asyncio.sleep(0)
+    while busy(inserter, len(asyncio.all_tasks()) - baseline):
+        peak_tasks = max(peak_tasks, len(asyncio.all_tasks()) - baseline)
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    if isinstance(inserter, TableMaintainer):
+        inserter.close()
+    return peak_tasks, candidates / elapsed, sum(map(len, table.buckets))
+
+
+async def main():
+    print('%10s %16s %10s %16s %8s' % ('candidates', 'inserter', 'peak tasks', 'candidates/s', 'nodes'))
+    for candidates in (10000, 100000):
+        for name, make_inserter in (('task per node', TaskPerNode),
+                                    ('maintainer', lambda table: TableMaintainer(lambda: table, ping))):
+            peak_tasks, rate, nodes = await run(make_inserter, candidates, burst=8 * 100)
+            print('%10i %16s %10i %16.0f %8i' % (candidates, name, peak_tasks, rate, nodes))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
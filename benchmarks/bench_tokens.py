@@ -0,0 +1,52 @@
+"""
+Token issue/verify rate and memory of TokenManager against the per-node token dict it replaced.
+
+Run with: python -m benchmarks.bench_tokens
+"""
+import timeit
+import tracemalloc
+from os import urandom
+
+from oversimplified_dht.token_manager import TokenManager
+
+
+class DictTokenManager:
+    """TokenManager as it used to be: a random token stored per node id, forever"""
+
+    def __init__(self):
+        self.issued_tokens = {}
+
+    def issue_token(self, node_id):
+        token = urandom(20)
+        self.issued_tokens[node_id] = token
+        return token
+
+    def verify_token(self, node_id, token):
+        return self.issued_tokens[node_id] == token
+
+
+def measure(manager, requesters):
+    tracemalloc.start()
+    started = timeit.default_timer()
+    tokens = [manager.issue_token(requester) for requester in requesters]
+    assert all(manager.verify_token(requester, token) for requester, token in zip(requesters, tokens))
+    elapsed = timeit.default_timer() - started
+    del tokens
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return 2 * len(requesters) / elapsed, memory
+
+
+def main():
+    print('%10s %18s %14s %18s %14s' % ('requesters', 'dict ops/s', 'dict bytes', 'stateless ops/s',
+                                       'stateless bytes'))
+    for number in (1000, 10000, 100000):
+        ips = ['10.%i.%i.%i' % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(number)]
+        node_ids = [urandom(20) for _ in range(number)]
+        dict_rate, dict_memory = measure(DictTokenManager(), node_ids)
+        rate, memory = measure(TokenManager(), ips)
+        print('%10i %18.0f %14i %18.0f %14i' % (number, dict_rate, dict_memory, rate, memory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Time until a restarted router has finished bootstrapping and its first lookup, starting cold from the bootstrap node
+or warm from a routing table snapshot, on a simulated network with DelayedRouter.DELAY latency per query.
+
+Run with: python -m benchmarks.bench_warm_start
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from tests.local_network import DelayedRouter, create_network, close_network
+
+PORT = 49500
+
+
+async def start(path=None):
+    started = time.perf_counter()
+    router = await DelayedRouter.create(port=PORT, bootstrap_nodes=(('127.0.0.1', PORT + 1),),
+                                        routing_table_path=path)
+    await router.bootstrap()
+    await router.get_peers(os.urandom(20))
+    elapsed = time.perf_counter() - started
+    return router, elapsed
+
+
+async def main(size=100, runs=5):
+    logging.getLogger('oversimplified_dht').setLevel(logging.WARNING)
+    for name in ('oversimplified_dht.dht', 'oversimplified_dht.crawl'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    network = await create_network(size, base_port=PORT + 1, router_class=DelayedRouter)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'table')
+        router, _ = await start(path)
+        router.transport.close()
+        await asyncio.sleep(0)
+
+        cold, warm = [], []
+        for _ in range(runs):
+            router, elapsed = await start()
+            cold.append(elapsed)
+            router.transport.close()
+            await asyncio.sleep(0)
+
+            router, elapsed = await start(path)
+            warm.append(elapsed)
+            router.transport.close()
+            await asyncio.sleep(0)
+
+    close_network(network)
+    print('%d nodes, %.0f ms latency per query' % (size, DelayedRouter.DELAY * 1000))
+    print('cold start: %6.0f ms' % (sum(cold) / runs * 1000))
+    print('warm start: %6.0f ms' % (sum(warm) / runs * 1000))
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
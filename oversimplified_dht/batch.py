@@ -0,0 +1,157 @@
+"""
+A datagram transport that reads many datagrams per event loop wakeup and hands them to the protocol in one call,
+for KRPCProtocols that see a lot of traffic.
+
+asyncio's own datagram transport makes one recvfrom and one datagram_received call per readiness event. This one
+keeps calling recvfrom on its non-blocking socket until the socket is drained or BATCH datagrams were read, and
+passes them all to protocol.datagrams_received. Python has no recvmmsg or sendmmsg, so there is still one syscall
+per datagram, but the wakeups and the callback overhead are paid once per batch. Datagrams the protocol sends while
+it handles a batch are held and sent together once it's done.
+
+uvloop is optional: install_uvloop makes it the event loop when it's installed, and this transport works on it too.
+"""
+import asyncio
+import socket
+from collections import deque
+from typing import Callable, List, Tuple
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+BATCH = 256  # datagrams read per wakeup at most, so that other callbacks get their turn under a flood
+MAX_DATAGRAM = 65535
+
+
+def install_uvloop() -> bool:
+    """
+    :return: whether uvloop is installed and now the event loop policy
+    """
+    if uvloop is None:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+class BatchDatagramTransport(asyncio.DatagramTransport):
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket, protocol, batch: int = BATCH):
+        super().__init__()
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.batch = batch
+        self.closing = False
+        self.in_batch = False
+        self.held = []  # datagrams sent while handling a batch, (data, addr)
+        self.backlog = deque()  # datagrams the socket buffer had no room for, (data, addr)
+        self.extra = {'socket': sock, 'sockname': sock.getsockname()}
+        loop.add_reader(sock.fileno(), self.read_ready)
+
+    def get_extra_info(self, name, default=None):
+        return self.extra.get(name, default)
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def read_ready(self):
+        recvfrom = self.sock.recvfrom
+        datagrams: List[Tuple[bytes, Tuple[str, int]]] = []
+        for _ in range(self.batch):
+            try:
+                datagrams.append(recvfrom(MAX_DATAGRAM))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.protocol.error_received(e)
+                break
+        if not datagrams:
+            return
+
+        self.in_batch = True
+        try:
+            self.protocol.datagrams_received(datagrams)
+        finally:
+            self.in_batch = False
+            if self.held:
+                held, self.held = self.held, []
+                self.send_all(held)
+
+    def sendto(self, data: bytes, addr=None):
+        if self.closing:
+            return
+        if self.in_batch:
+            self.held.append((data, addr))
+        else:
+            self.send_all([(data, addr)])
+
+    def send_all(self, datagrams):
+        if self.backlog:
+            self.backlog.extend(datagrams)
+            return
+        sendto = self.sock.sendto
+        for i, (data, addr) in enumerate(datagrams):
+            try:
+                sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                # The socket buffer is full: send the rest once there's room, in order
+                self.backlog.extend(datagrams[i:])
+                self.loop.add_writer(self.sock.fileno(), self.write_ready)
+                return
+            except OSError as e:
+                self.protocol.error_received(e)
+
+    def write_ready(self):
+        sendto = self.sock.sendto
+        while self.backlog:
+            data, addr = self.backlog[0]
+            try:
+                sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.protocol.error_received(e)
+            self.backlog.popleft()
+        self.loop.remove_writer(self.sock.fileno())
+
+    def get_write_buffer_size(self) -> int:
+        return sum(len(data) for data, _ in self.backlog)
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.loop.remove_reader(self.sock.fileno())
+        if self.backlog:
+            self.loop.remove_writer(self.sock.fileno())
+            self.backlog.clear()
+        self.loop.call_soon(self.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def connection_lost(self, exc):
+        try:
+            self.protocol.connection_lost(exc)
+        finally:
+            self.sock.close()
+
+
+async def create_batch_endpoint(protocol_factory: Callable[[], asyncio.DatagramProtocol], local_addr,
+                                batch: int = BATCH):
+    """
+    Like loop.create_datagram_endpoint(protocol_factory, local_addr=local_addr), with a BatchDatagramTransport.
+    The protocol needs a datagrams_received method taking a list of (data, addr).
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.bind(local_addr)
+    except OSError:
+        sock.close()
+        raise
+    protocol = protocol_factory()
+    transport = BatchDatagramTransport(loop, sock, protocol, batch)
+    protocol.connection_made(transport)
+    return transport, protocol
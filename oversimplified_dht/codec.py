@@ -0,0 +1,191 @@
+"""
+Fast paths for encoding and decoding the few KRPC message shapes that make up nearly all traffic.
+Anything that doesn't fit them goes through the generic bencode codec, so results are always the same as
+bencode's, only cheaper to get.
+"""
+import re
+
+import bencode as b
+
+# method: (template, argument names in template order); %-formatted with the arguments, then the transaction id
+QUERY_TEMPLATES = {
+    b'ping': (b'd1:ad2:id20:%be1:q4:ping1:t%i:%b1:y1:qe', (b'id',)),
+    b'find_node': (b'd1:ad2:id20:%b6:target20:%be1:q9:find_node1:t%i:%b1:y1:qe', (b'id', b'target')),
+    b'get_peers': (b'd1:ad2:id20:%b9:info_hash20:%be1:q9:get_peers1:t%i:%b1:y1:qe', (b'id', b'info_hash')),
+}
+
+
+# Queries as sent by the common clients: sorted keys, optionally with a client version
+QUERY_PATTERN = re.compile(
+    rb'd1:ad2:id20:(.{20})(?:(6:target|9:info_hash)20:(.{20}))?e1:q(4:ping|9:find_node|9:get_peers)'
+    rb'1:t([1-9]):(.+?)(?:1:v4:(.{4}))?1:y1:qe', re.DOTALL)
+
+
+def encode_query(transaction_id: bytes, method: bytes, args: dict) -> bytes:
+    """
+    >>> encode_query(b'aa', b'ping', {b'id': b'abcdefghij0123456789'})
+    b'd1:ad2:id20:abcdefghij0123456789e1:q4:ping1:t2:aa1:y1:qe'
+    >>> encode_query(b'aa', b'ping', {b'id': b'abcdefghij0123456789', b'extra': 1})
+    b'd1:ad5:extrai1e2:id20:abcdefghij0123456789e1:q4:ping1:t2:aa1:y1:qe'
+
+    :param transaction_id:
+    :param method: e.g. b'find_node'
+    :param args: e.g. {b'id': <querying node's id>, b'target': <id of target node>}
+    :return: bencoded query
+    """
+    try:
+        template, names = QUERY_TEMPLATES[method]
+    except KeyError:
+        pass
+    else:
+        if len(args) == len(names):
+            try:
+                values = tuple(args[name] for name in names)
+            except KeyError:
+                pass
+            else:
+                if all(type(value) is bytes and len(value) == 20 for value in values):
+                    return template % (values + (len(transaction_id), transaction_id))
+
+    return b'd1:a%b1:q%b1:t%b1:y1:qe' % (encode_dict(args), b.encode(method), b.encode(transaction_id))
+
+
+def encode_response(transaction_id: bytes, args: dict) -> bytes:
+    """
+    >>> encode_response(b'aa', {b'id': b'abcdefghij0123456789'})
+    b'd1:rd2:id20:abcdefghij0123456789e1:t2:aa1:y1:re'
+
+    :param transaction_id: transaction id of the query being answered
+    :param args: response args
+    :return: bencoded response
+    """
+    return b'd1:r%b1:t%b1:y1:re' % (encode_dict(args), b.encode(transaction_id))
+
+
+def encode_dict(value: dict) -> bytes:
+    if not all(type(key) is bytes for key in value):
+        return b.encode(value)
+    return b'd%be' % encode_items(value)
+
+
+def encode_items(value: dict) -> bytes:
+    """
+    Encodes the items of a dict with byte string keys, sorted as bencode requires.
+    Byte strings and lists of byte strings, which is what responses are made of, are encoded inline.
+
+    >>> encode_items({b'values': [b'abcdef', b'ghijkl'], b'id': b'x'})
+    b'2:id1:x6:valuesl6:abcdef6:ghijkle'
+
+    :param value:
+    :return:
+    """
+    parts = []
+    for key in sorted(value):
+        item = value[key]
+        if type(item) is bytes:
+            parts.append(b'%i:%b%i:%b' % (len(key), key, len(item), item))
+        elif type(item) is list and all(type(element) is bytes for element in item):
+            parts.append(b'%i:%bl%be' % (len(key), key, b''.join(b'%i:%b' % (len(e), e) for e in item)))
+        else:
+            parts.append(b.encode(key) + b.encode(item))
+    return b''.join(parts)
+
+
+class Unusual(Exception):
+    """Raised by the fast decoder for input it doesn't handle, which then goes to the generic decoder"""
+
+
+def decode(data: bytes):
+    """
+    Decodes like bencode.decode, but raises bencode.InvalidBencode for any malformed input.
+
+    >>> decode(b'd1:rd2:id20:abcdefghij0123456789e1:t2:aa1:y1:re')
+    {b'r': {b'id': b'abcdefghij0123456789'}, b't': b'aa', b'y': b'r'}
+    >>> decode(b'i-1e')
+    Traceback (most recent call last):
+    ...
+    bencode.InvalidBencode: Expected int, got b'-' at position 2
+
+    :param data:
+    :return:
+    """
+    match = QUERY_PATTERN.fullmatch(data)
+    if match is not None:
+        node_id, key, value, method, length, transaction_id, version = match.groups()
+        if len(transaction_id) == int(length):
+            args = {b'id': node_id}
+            if key is not None:
+                args[key[2:]] = value
+            decoded = {b'a': args, b'q': method[2:], b't': transaction_id, b'y': b'q'}
+            if version is not None:
+                decoded[b'v'] = version
+            return decoded
+
+    try:
+        value, end = decode_at(data, 0)
+        if end != len(data):
+            raise Unusual
+        return value
+    except (Unusual, ValueError, IndexError, TypeError, RecursionError):
+        pass
+
+    try:
+        return b.decode(data)
+    except (ValueError, TypeError, RecursionError) as e:
+        raise b.InvalidBencode(str(e))
+
+
+def decode_at(data: bytes, position: int):
+    """
+    Decodes the value starting at position in well formed bencode.
+    String lengths go through int() exactly as bencode.decode does, so both accept the same lengths.
+    :return: (value, position after the value)
+    """
+    char = data[position]
+    if 48 <= char <= 57:  # string length digit
+        colon = data.index(b':', position)
+        end = colon + 1 + int(data[position:colon])
+        if end > len(data):
+            raise Unusual
+        return data[colon + 1:end], end
+
+    if char == 100:  # d
+        value = {}
+        position += 1
+        while True:
+            char = data[position]
+            if char == 101:  # e
+                return value, position + 1
+            if not 48 <= char <= 57:
+                raise Unusual
+            colon = data.index(b':', position)
+            position = colon + 1 + int(data[position:colon])
+            key = data[colon + 1:position]
+            # Most values are strings: decode them inline rather than through a call
+            char = data[position]
+            if 48 <= char <= 57:
+                colon = data.index(b':', position)
+                end = colon + 1 + int(data[position:colon])
+                if end > len(data):
+                    raise Unusual
+                value[key] = data[colon + 1:end]
+                position = end
+            else:
+                value[key], position = decode_at(data, position)
+
+    if char == 108:  # l
+        value = []
+        position += 1
+        while data[position] != 101:
+            item, position = decode_at(data, position)
+            value.append(item)
+        return value, position + 1
+
+    if char == 105:  # i
+        end = data.index(b'e', position)
+        digits = data[position + 1:end]
+        if not digits.isdigit():
+            raise Unusual
+        return int(digits), end + 1
+
+    raise Unusual
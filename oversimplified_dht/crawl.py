@@ -1,22 +1,49 @@
 import asyncio
+import heapq
 import logging
-from math import inf
-from typing import Callable, List, Tuple, Any
+from bisect import insort
+from operator import attrgetter
+from typing import Callable, List, Tuple, Any, Optional
 
-from oversimplified_dht.node import Node, NodeId
+from oversimplified_dht import distance, metrics
+from oversimplified_dht.node import Node, NodeId, CompactNodeList
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-logging.basicConfig()
+
+
+class InvalidResponse(Exception):
+    """Raised by rpc_find functions for responses that aren't what the query asked for, e.g. errors"""
 
 
 class NodeCrawler:
-    def __init__(self, rpc_find, nodes: List[Node], target: NodeId, add_node: Callable[[Node], None]):
+    """
+    Iterative Kademlia lookup.
+    Keeps a shortlist of candidates ordered by distance to the target and keeps up to alpha queries in flight,
+    sending the next one as soon as any outstanding query completes. The lookup is over once the k closest
+    candidates that haven't failed have all responded.
+    """
+    ALPHA = 3
+    K = 8
+
+    def __init__(self, rpc_find, nodes: List[Node], target: NodeId, add_node: Callable[[Node], None],
+                 alpha: int = ALPHA, k: int = K, own_id: NodeId = None):
+        """
+        :param own_id: our node id, which other nodes return like any other and we mustn't query
+        """
         self.rpc_find = rpc_find
-        self.nodes = nodes
         self.target = target
         self.add_node = add_node
-        self._best = inf
+        self.alpha = alpha
+        self.k = k
+        self.shortlist: List[Tuple[int, Node]] = []  # (distance, node), closest first
+        self.seen = set()  # ids as bytes, so CompactNodeLists can be checked against it without making NodeIds
+        self.queried = set()
+        self.responded = set()
+        self.failed = set()
+        self.rounds = 0  # times run waited for responses
+        if own_id is not None:
+            self.seen.add(bytes(own_id))  # as though already a candidate, so never one
+        self._add_candidates(nodes)
 
     def found_peers(self, peer_infos: List[Tuple[Any]]):
         """
@@ -26,47 +53,125 @@ class NodeCrawler:
         """
 
     async def run(self):
-        while True:
-            node_infos = []
-            results = await asyncio.gather(*(
-                self.rpc_find(node, self.target) for node in self.nodes
-            ), return_exceptions=True)
+        pending = {}
+        try:
+            while True:
+                while len(pending) < self.alpha:
+                    node = self._next_candidate()
+                    if node is None:
+                        break
+                    self.queried.add(node.id)
+                    pending[asyncio.ensure_future(self.rpc_find(node, self.target))] = node
 
-            for r, node in zip(results, self.nodes):
-                if isinstance(r, Exception):
-                    if isinstance(r, (asyncio.TimeoutError, KeyError)):
-                        continue
-                    raise r
+                if not pending or self.finished():
+                    return
 
-                self.add_node(node)
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                self.rounds += 1
+                for task in done:
+                    self._handle_result(pending.pop(task), task)
+        finally:
+            for task in pending:
+                task.cancel()
 
-                new_node_infos, peer_infos = r
-                if peer_infos:
-                    self.found_peers(peer_infos)
+    def closest(self) -> List[Node]:
+        """
+        :return: the k closest nodes that responded, closest first
+        """
+        return [node for _, node in self.shortlist if node.id in self.responded][:self.k]
 
-                node_infos += new_node_infos
+    def finished(self) -> bool:
+        """
+        :return: True once the k closest candidates that haven't failed have all responded
+        """
+        for node in self._live_candidates():
+            if node.id not in self.responded:
+                return False
+        return True
 
-            log.debug('Got new node infos: %s' % node_infos)
-            node_infos = sorted(node_infos, key=lambda x: x.id ^ self.target)[:8]
-            if not node_infos:
-                return
-            if not self._better(node_infos[0].id):
+    def _live_candidates(self):
+        """
+        :return: the k closest candidates that haven't failed
+        """
+        live = []
+        for _, node in self.shortlist:
+            if node.id not in self.failed:
+                live.append(node)
+                if len(live) == self.k:
+                    break
+        return live
+
+    def _next_candidate(self) -> Optional[Node]:
+        """
+        :return: the closest node not queried yet among the k closest that haven't failed, None if there is none
+        """
+        for node in self._live_candidates():
+            if node.id not in self.queried:
+                return node
+        return None
+
+    def _handle_result(self, node: Node, task: asyncio.Future):
+        exception = task.exception()
+        if exception is not None:
+            if isinstance(exception, (asyncio.TimeoutError, KeyError, InvalidResponse)):
+                self.failed.add(node.id)
                 return
-            self.nodes = [Node(info) for info in node_infos]
+            raise exception
+
+        self.responded.add(node.id)
+        self.add_node(node)
+
+        new_node_infos, peer_infos = task.result()
+        if peer_infos:
+            self.found_peers(peer_infos)
+
+        if metrics.HOT_PATH_LOGGING:
+            log.debug('Got new node infos: %s', new_node_infos)
+        if isinstance(new_node_infos, CompactNodeList):
+            # Only make NodeInfos for the entries that are new to us
+            new_node_infos = new_node_infos.node_infos(skip=self.seen)
+        self._add_candidates([Node(info) for info in new_node_infos])
 
-    def _better(self, value: NodeId):
-        distance = self.target ^ value
-        if distance < self._best:
-            self._best = distance
-            return True
+    def _add_candidates(self, nodes: List[Node]):
+        new = []
+        for node in nodes:
+            id_bytes = bytes(node.id)
+            if id_bytes not in self.seen:
+                self.seen.add(id_bytes)
+                new.append(node)
+
+        if len(new) < distance.BATCH_THRESHOLD:
+            for node in new:
+                insort(self.shortlist, (self.target ^ node.id, node))
         else:
-            return False
+            # Rank large batches at once and merge them in, rather than inserting nodes one by one
+            new = distance.closest(self.target, new, key=attrgetter('id'))
+            self.shortlist = list(heapq.merge(self.shortlist, [(self.target ^ node.id, node) for node in new]))
 
 
 class ValueCrawler(NodeCrawler):
-    def __init__(self, rpc_find, nodes: List[Node], target: NodeId, add_node: Callable[[Node], None]):
-        super().__init__(rpc_find, nodes, target, add_node)
+    def __init__(self, rpc_find, nodes: List[Node], target: NodeId, add_node: Callable[[Node], None],
+                 alpha: int = NodeCrawler.ALPHA, k: int = NodeCrawler.K, own_id: NodeId = None):
+        super().__init__(rpc_find, nodes, target, add_node, alpha, k, own_id)
         self.peers = []
 
     def found_peers(self, peer_infos: List[Tuple]):
         self.peers.append(peer_infos)
+
+
+class StreamingValueCrawler(NodeCrawler):
+    """
+    Puts peers on a queue as soon as responses bring them, each (host, port) once.
+    """
+
+    def __init__(self, rpc_find, nodes: List[Node], target: NodeId, add_node: Callable[[Node], None],
+                 alpha: int = NodeCrawler.ALPHA, k: int = NodeCrawler.K, own_id: NodeId = None):
+        super().__init__(rpc_find, nodes, target, add_node, alpha, k, own_id)
+        self.peers = asyncio.Queue()
+        self.found = set()
+
+    def found_peers(self, peer_infos: List[Tuple]):
+        for peer in peer_infos:
+            if peer not in self.found:
+                self.found.add(peer)
+                self.peers.put_nowait(peer)
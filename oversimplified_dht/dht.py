@@ -1,23 +1,30 @@
 import asyncio
+import functools
+import itertools
 import logging
 import os
+import time
 import typing
-from typing import Sequence
+from collections import OrderedDict
+from typing import Iterable, Sequence
 
 from bencode.misc import unpack_compact_peer
 
 from oversimplified_dht.bep42 import Bep42SecureIDManager
-from oversimplified_dht.crawl import NodeCrawler, ValueCrawler
+from oversimplified_dht.crawl import InvalidResponse, NodeCrawler, ValueCrawler, StreamingValueCrawler
+from oversimplified_dht.node_cache import NodeCache
 from oversimplified_dht.peer_storage import LocalPeerStorage
+from oversimplified_dht.routing_table import snapshot
+from oversimplified_dht.routing_table.maintenance import TableMaintainer
 from oversimplified_dht.routing_table.table import RoutingTable
+from oversimplified_dht.rtt import RTTEstimator
+from oversimplified_dht.scheduler import QueryScheduler
 from oversimplified_dht.token_manager import TokenManager
 from .krpc import KRPCProtocol
-from .node import Node, parse_compact_nodes
+from .node import Node, NodeInfo, CompactNodeList, pack_compact_nodes
 from .node_id import NodeId
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-logging.basicConfig()
 
 
 class BootStrapError(Exception):
@@ -31,6 +38,17 @@ class NodeIdChanged(Exception):
 class Router(KRPCProtocol):
     DEFAULT_BOOTSTRAP_NODES = (('router.utorrent.com', 6881),)
     TIMEOUT = 1
+    SNAPSHOT_INTERVAL = 5 * 60  # seconds between routing table snapshots
+    REFRESH_INTERVAL = 60  # seconds between checks for stale buckets
+    MAX_REFRESHES = 4  # stale buckets refreshed per check at most, the least recently changed ones
+    # Queries that coalesce, with the argument that together with the node and method identifies them
+    COALESCED_METHODS = {b'find_node': b'target', b'get_peers': b'info_hash'}
+    RESULT_TTL = 2  # seconds a response also answers identical queries
+    MAX_RESULTS = 2 ** 12
+    BATCH_QUERIES = 64  # queries in flight across all the lookups of a get_peers_many call
+    BATCH_LOOKUPS = 128  # lookups running at once in a get_peers_many call
+    RTT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+    LOOKUP_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
 
     def requests_as_completed(self, nodes: Sequence[Node], method: bytes, args, timeout=TIMEOUT):
         return asyncio.as_completed(
@@ -39,12 +57,14 @@ class Router(KRPCProtocol):
             timeout=timeout
         )
 
-    async def initial_bootstrap(self, target, bootstrap_nodes=DEFAULT_BOOTSTRAP_NODES) -> typing.List[Node]:
+    async def initial_bootstrap(self, target, bootstrap_nodes=None) -> typing.List[Node]:
         """
         Returns a few nodes from bootstrap nodes. Ideally should only be called when we know of no other nodes at all
-        :param bootstrap_nodes:
+        :param bootstrap_nodes: (host, port) pairs, self.bootstrap_nodes by default
         :return:
         """
+        if bootstrap_nodes is None:
+            bootstrap_nodes = self.bootstrap_nodes
         request_args = {
             b'id': bytes(self.node_id),
             b'target': bytes(target)
@@ -52,18 +72,21 @@ class Router(KRPCProtocol):
         for bootstrap_node_address in bootstrap_nodes:
             try:
                 response = await self.send_query(bootstrap_node_address,
-                                                 b'find_node', request_args)
-                node_infos = parse_compact_nodes(response[b'r'][b'nodes'])
-                return [Node(info) for info in node_infos]
+                                                 b'find_node', request_args, self.TIMEOUT)
+                return [Node(info) for info in CompactNodeList(response[b'r'][b'nodes'])]
             except asyncio.TimeoutError:
                 log.warning("Bootstrap node %s not responding" % bootstrap_node_address[0])
         else:
             raise BootStrapError("No given boostrap nodes responded")
 
     async def get_neighbours(self, target: NodeId) -> typing.List[Node]:
-        nodes = self.routing_table.get_neighbours(target)
+        """
+        :return: the closest nodes to target from the routing table and from nodes recent lookups came across
+        """
+        nodes = {node.id: node for node in self.node_cache.closest(target)}
+        nodes.update((node.id, node) for node in self.routing_table.get_neighbours(target))
         if nodes:
-            return nodes
+            return list(nodes.values())
         return await self.initial_bootstrap(target)
 
     # noinspection PyTypeChecker
@@ -71,66 +94,399 @@ class Router(KRPCProtocol):
         log.debug('Begin bootstrap')
         c = NodeCrawler(self.call_find_node, nodes=await self.get_neighbours(self.node_id),
                         target=self.node_id,
-                        add_node=self.add_node)
-        await c.run()
-        log.debug('Bootstrap done. %s' % self.routing_table)
+                        add_node=self.add_node, own_id=self.node_id)
+        try:
+            await c.run()
+        finally:
+            self.record_lookup(c)
+        log.debug('Bootstrap done. %s', self.routing_table)
 
     async def get_peers(self, info_hash: bytes):  # -> typing.Generator[Tuple[str, int], None, None]:
-        target = NodeId.from_bytes(info_hash)
-        c = ValueCrawler(self.call_find_peers, nodes=await self.get_neighbours(target),
+        """
+        Concurrent calls for the same info_hash share a single lookup.
+        """
+        lookup = self.lookups.get(info_hash)
+        if lookup is None:
+            lookup = self.lookups[info_hash] = asyncio.ensure_future(self.find_peers(NodeId.from_bytes(info_hash)))
+            lookup.add_done_callback(lambda _: self.lookups.pop(info_hash, None))
+        # Shielded, so that one caller giving up doesn't cancel the lookup for the others
+        return list(await asyncio.shield(lookup))
+
+    async def get_peers_many(self, info_hashes: Iterable[bytes], max_in_flight: int = BATCH_QUERIES,
+                             max_lookups: int = BATCH_LOOKUPS):
+        """
+        Looks up many info_hashes at once, yielding (info_hash, peers) as each lookup finishes, peers as get_peers
+        returns them. The lookups share max_in_flight query slots, which they take turns at, and start as earlier
+        ones finish so that no more than max_lookups run at a time. A lookup that fails is logged and yields no peers,
+        the others go on. Closing the generator early cancels the lookups still running.
+        """
+        scheduler = QueryScheduler(max_in_flight)
+        info_hashes = iter(info_hashes)
+        running = {}
+        try:
+            while True:
+                for info_hash in itertools.islice(info_hashes, max_lookups - len(running)):
+                    lookup = self.find_peers(NodeId.from_bytes(info_hash), scheduler.share(self.call_find_peers))
+                    running[asyncio.ensure_future(lookup)] = info_hash
+                if not running:
+                    return
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for lookup in done:
+                    info_hash = running.pop(lookup)
+                    if lookup.exception() is not None:
+                        log.warning("Lookup of %s failed: %r", info_hash.hex(), lookup.exception())
+                        yield info_hash, []
+                    else:
+                        yield info_hash, lookup.result()
+        finally:
+            for lookup in running:
+                lookup.cancel()
+
+    async def find_peers(self, target: NodeId, rpc_find=None):
+        """
+        :param rpc_find: call_find_peers by default
+        """
+        if rpc_find is None:
+            rpc_find = self.call_find_peers
+        c = ValueCrawler(rpc_find, nodes=await self.get_neighbours(target),
                          target=target,
-                         add_node=self.add_node)
-        await c.run()
+                         add_node=self.add_node, own_id=self.node_id)
+        try:
+            await c.run()
+        finally:
+            self.record_lookup(c)
         return c.peers
 
+    async def iter_peers(self, info_hash: bytes, max_peers: int = None):
+        """
+        Like get_peers, but yields (host, port) pairs, each once, as soon as responses bring them.
+        Closing the generator early, e.g. by breaking out of async for, cancels the lookup and its queries in flight.
+        Unlike get_peers, every call runs a lookup of its own.
+        :param max_peers: stop after this many peers, None to go on until the lookup is over
+        """
+        target = NodeId.from_bytes(info_hash)
+        c = StreamingValueCrawler(self.call_find_peers, nodes=await self.get_neighbours(target),
+                                  target=target,
+                                  add_node=self.add_node, own_id=self.node_id)
+
+        def lookup_done(_):
+            self.record_lookup(c)
+            c.peers.put_nowait(None)
+
+        lookup = asyncio.ensure_future(c.run())
+        lookup.add_done_callback(lookup_done)
+        try:
+            yielded = 0
+            while max_peers is None or yielded < max_peers:
+                peer = await c.peers.get()
+                if peer is None:
+                    lookup.result()  # raises whatever ended the lookup
+                    return
+                yield peer
+                yielded += 1
+        finally:
+            lookup.cancel()
+
+    def record_lookup(self, crawler: NodeCrawler):
+        self.lookup_queries.observe(len(crawler.queried))
+        self.lookup_rounds.observe(crawler.rounds)
+
     def add_node(self, new_node):
-        asyncio.create_task(self.routing_table.add_node(new_node, ping_function=self.ping))
+        self.table_maintainer.add(new_node)
 
     async def ping(self, node):
         return await self.send_query_to_node(node, b'ping', args={b'id': bytes(self.node_id)})
 
     # noinspection PyMethodOverriding
     @classmethod
-    async def create(cls, node_id=None, port=49001) -> 'Router':
-        _, protocol = await asyncio.get_running_loop().create_datagram_endpoint(lambda: cls(node_id),
-                                                                                local_addr=('0.0.0.0', port))
+    async def create(cls, node_id=None, port=49001, bootstrap_nodes=DEFAULT_BOOTSTRAP_NODES,
+                     routing_table_path=None) -> 'Router':
+        """
+        :param node_id: random if None, or the one saved at routing_table_path if there is a snapshot
+        :param port:
+        :param bootstrap_nodes: (host, port) pairs to bootstrap from when the routing table is empty
+        :param routing_table_path: where to keep routing table snapshots. If one exists the table is restored
+                                   from it, and its nodes are pinged in the background to check they're still up.
+        :return:
+        """
+        table = None if routing_table_path is None else snapshot.read(routing_table_path)
+        if table is not None and node_id is None:
+            node_id = table.node_id
+        _, protocol = await cls.create_endpoint(lambda: cls(node_id, bootstrap_nodes), port)
+        if table is not None:
+            protocol.restore_routing_table(table)
+        if routing_table_path is not None:
+            protocol.routing_table_path = routing_table_path
+            protocol.background_tasks.append(asyncio.ensure_future(protocol.save_routing_table_periodically()))
+        protocol.background_tasks.append(asyncio.ensure_future(protocol.refresh_buckets_periodically()))
         # noinspection PyTypeChecker
         return protocol
 
+    def restore_routing_table(self, table: RoutingTable):
+        """
+        Takes over the nodes of a saved table and checks in the background which of them are still up.
+        """
+        nodes = [node for bucket in table.buckets for node in bucket]
+        if table.node_id == self.node_id:
+            self.routing_table = table
+        else:
+            for node in nodes:
+                self.add_node(node)
+        self.background_tasks.append(asyncio.ensure_future(self.check_liveness(nodes)))
+
+    async def check_liveness(self, nodes: typing.List[Node]):
+        """
+        Pings all nodes at once; send_query_to_node records who answered.
+        """
+        await asyncio.gather(*(self.ping(node) for node in nodes), return_exceptions=True)
+
+    async def save_routing_table_periodically(self):
+        while True:
+            await asyncio.sleep(self.SNAPSHOT_INTERVAL)
+            try:
+                snapshot.save(self.routing_table, self.routing_table_path)
+            except OSError as e:
+                log.warning("Couldn't save routing table: %s" % e)
+
+    async def refresh_buckets_periodically(self):
+        while True:
+            await asyncio.sleep(self.REFRESH_INTERVAL)
+            try:
+                await self.refresh_stale_buckets()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Couldn't refresh buckets")
+
+    async def refresh_stale_buckets(self):
+        """
+        Looks up a random id in each stale bucket, up to MAX_REFRESHES of them, one after the other.
+        The nodes the lookups come across fill the buckets or their replacement caches.
+        """
+        for bucket in self.routing_table.stale_buckets()[:self.MAX_REFRESHES]:
+            # Whatever the lookup finds, the bucket isn't due again for another Node.INACTIVE_TIMEOUT
+            bucket.update_last_changed()
+            target = bucket.random_id()
+            try:
+                nodes = await self.get_neighbours(target)
+            except BootStrapError as e:
+                log.warning("Couldn't refresh buckets: %s", e)
+                return
+            c = NodeCrawler(self.call_find_node, nodes=nodes, target=target, add_node=self.add_node,
+                            own_id=self.node_id)
+            try:
+                await c.run()
+            finally:
+                self.record_lookup(c)
+            self.bucket_refreshes.inc()
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.table_maintainer.close()
+        for task in self.background_tasks:
+            task.cancel()
+        if self.routing_table_path is not None:
+            try:
+                snapshot.save(self.routing_table, self.routing_table_path)
+            except OSError as e:
+                log.warning("Couldn't save routing table: %s" % e)
+
+    def register_metrics(self):
+        super().register_metrics()
+        m = self.metrics
+        self.rtt_histogram = m.histogram('dht_rtt_seconds', 'Round trip times of queries to nodes', self.RTT_BUCKETS)
+        self.lookup_queries = m.histogram('dht_lookup_queries', 'Nodes queried per lookup', self.LOOKUP_BUCKETS)
+        self.lookup_rounds = m.histogram('dht_lookup_rounds', 'Times a lookup waited for responses',
+                                         self.LOOKUP_BUCKETS)
+        self.queries_coalesced = m.counter('dht_queries_coalesced_total',
+                                           'Queries answered by an identical one, in flight or cached', ('source',))
+        m.gauge('dht_routing_table_bucket_nodes', 'Nodes in each routing table bucket, in id order',
+                lambda: {(i,): len(bucket) for i, bucket in enumerate(self.routing_table.buckets)}, ('bucket',))
+        m.gauge('dht_routing_table_pending', 'Nodes waiting to be inserted into the routing table',
+                lambda: len(self.table_maintainer.pending))
+        m.counter('dht_routing_table_inserted_total', 'Nodes inserted into the routing table',
+                  function=lambda: self.table_maintainer.inserted)
+        m.counter('dht_routing_table_dropped_total', 'Candidates dropped for lack of room in the insert queue',
+                  function=lambda: self.table_maintainer.dropped)
+        m.gauge('dht_routing_table_replacements', 'Candidates in the replacement caches of routing table buckets',
+                lambda: sum(len(bucket.replacements) for bucket in self.routing_table.buckets))
+        self.bucket_refreshes = m.counter('dht_bucket_refreshes_total', 'Lookups run to refresh stale buckets')
+        m.gauge('dht_node_cache_nodes', 'Nodes in the cross-lookup node cache', lambda: len(self.node_cache))
+        m.gauge('dht_get_peers_lookups', 'Shared get_peers lookups in progress', lambda: len(self.lookups))
+
+    def handle_query(self, decoded, address):
+        node_id = id_argument(decoded, b'id')
+        if node_id is not None:
+            # Nodes that query us are candidates for the routing table, as BEP5 suggests
+            self.add_node(Node(NodeInfo(address[0], address[1], node_id)))
+        super().handle_query(decoded, address)
+
     # noinspection PyUnusedLocal
     def krpc_handle_ping(self, request, address):
         return self.response(request, {b'id': bytes(self.node_id), })
 
-    def __init__(self, node_id: NodeId = None):
+    # noinspection PyUnusedLocal
+    def krpc_handle_find_node(self, request, address):
+        target = id_argument(request, b'target')
+        if target is None:
+            return self.error_invalid_arguments(request)
+        return self.response(request, {b'id': bytes(self.node_id), b'nodes': self.compact_neighbours(target)})
+
+    def krpc_handle_get_peers(self, request, address):
+        info_hash = id_argument(request, b'info_hash')
+        node_id = id_argument(request, b'id')
+        if info_hash is None or node_id is None:
+            return self.error_invalid_arguments(request)
+
+        args = {b'id': bytes(self.node_id), b'token': self.token_manager.issue_token(address[0])}
+        peers = self.peer_storage.get_peers(bytes(info_hash))
+        if peers:
+            args[b'values'] = peers
+        else:
+            args[b'nodes'] = self.compact_neighbours(info_hash)
+        return self.response(request, args)
+
+    def krpc_handle_announce_peer(self, request, address):
+        info_hash = id_argument(request, b'info_hash')
+        node_id = id_argument(request, b'id')
+        try:
+            args = request[b'a']
+            token = args[b'token']
+            port = address[1] if args.get(b'implied_port') else args[b'port']
+        except (KeyError, TypeError, AttributeError):
+            return self.error_invalid_arguments(request)
+        if info_hash is None or node_id is None or not isinstance(port, int) or not 0 < port < 2 ** 16:
+            return self.error_invalid_arguments(request)
+
+        if not self.token_manager.verify_token(address[0], token):
+            return self.error(request, 203, b'Invalid token')
+
+        self.peer_storage.store_peer(bytes(info_hash), address[0], port)
+        return self.response(request, {b'id': bytes(self.node_id)})
+
+    def compact_neighbours(self, target: NodeId) -> bytes:
+        return pack_compact_nodes([node.info for node in self.routing_table.get_neighbours(target)])
+
+    def __init__(self, node_id: NodeId = None, bootstrap_nodes=DEFAULT_BOOTSTRAP_NODES):
         super().__init__()
         self.node_id = NodeId.from_bytes(os.urandom(20)) if node_id is None else node_id
+        self.bootstrap_nodes = bootstrap_nodes
+        self.routing_table_path = None
+        self.background_tasks = []
         self.secure_id_manager = Bep42SecureIDManager()
         self.peer_storage = LocalPeerStorage()
         self.routing_table = RoutingTable(self.node_id)
+        self.table_maintainer = TableMaintainer(lambda: self.routing_table, self.ping)
         self.token_manager = TokenManager()
+        self.rtt_estimator = RTTEstimator(initial_timeout=self.TIMEOUT)
+        self.node_cache = NodeCache()
+        self.lookups: typing.Dict[bytes, asyncio.Future] = {}  # info_hash -> get_peers lookup in progress
+        # (node address, method, target) -> [query in flight, number of callers waiting for it, Node it was sent to]
+        self.queries_in_flight: typing.Dict[tuple, list] = {}
+        # (node address, method, target) -> (expiry time, response), soonest to expire first
+        self.query_results: typing.Dict[tuple, tuple] = OrderedDict()
 
     async def send_query_to_node(self, node: Node, method: bytes, args: dict):
         """
-        Sends query to node. Raises TimeoutError if the node fails to respond in time defined by TIMEOUT.
+        Sends query to node. Raises TimeoutError if the node fails to respond in time.
+        The timeout is derived from the node's round trip times, or from those of all nodes if it has none yet.
         :param node:
         :param method: e.g. b'ping'
         :param args:  e.g. {b'id':self.node_id.to_bytes()}
         :return:
         """
+        response, _ = await self.timed_query_to_node(node, method, args)
+        return response
+
+    async def timed_query_to_node(self, node: Node, method: bytes, args: dict):
+        """
+        Like send_query_to_node.
+        :return: (response, round trip time)
+        """
+        timeout = node.timeout()
+        if timeout is None:
+            timeout = self.rtt_estimator.timeout
         try:
-            response = await asyncio.wait_for(self.send_query((node.info.host, node.info.port), method, args),
-                                              self.TIMEOUT)
+            # Timed from when the query goes out, waiting for a transaction slot or for the pacer isn't network time
+            response, rtt = await self.send_query_timed((node.info.host, node.info.port), method, args, timeout)
         except asyncio.TimeoutError:
-            node.record_not_responding()
+            self.record_timeout(node)
             raise
+        self.rtt_histogram.observe(rtt)
+        self.rtt_estimator.record(rtt)
+        self.record_response(node, rtt)
+        if b'ip' in response:
+            node_id = self.secure_id_manager.record_ip(unpack_compact_peer(response[b'ip'])[0])
+            if node_id is not None:
+                self.change_id(node_id)
+
+        return response, rtt
+
+    def record_response(self, node: Node, rtt: float = None):
+        node.record_responded(rtt=rtt)
+        self.node_cache.add(node)
+
+    def record_timeout(self, node: Node):
+        node.record_not_responding()
+        self.node_cache.discard(node.id)
+        self.routing_table.replace_bad_node(node)
+
+    async def query_node(self, node: Node, method: bytes, args: dict):
+        """
+        Like send_query_to_node, except that identical find_node and get_peers queries to a node are coalesced:
+        while one is in flight, the others wait for its response instead of being sent, and for RESULT_TTL seconds
+        after it came its response answers them as well. Whichever Node object each caller passes gets the response
+        or the timeout recorded, as though its own query had been sent.
+        """
+        try:
+            key = (node.info.address, method, args[self.COALESCED_METHODS[method]])
+        except KeyError:
+            return await self.send_query_to_node(node, method, args)
+
+        now = time.monotonic()
+        while self.query_results:
+            oldest = next(iter(self.query_results))
+            if self.query_results[oldest][0] > now:
+                break
+            del self.query_results[oldest]
+        result = self.query_results.get(key)
+        if result is not None:
+            self.queries_coalesced.inc('cached')
+            self.record_response(node)  # no round trip time, the response came a while ago
+            return result[1]
+
+        entry = self.queries_in_flight.get(key)
+        if entry is None:
+            query = asyncio.ensure_future(self.timed_query_to_node(node, method, args))
+            query.add_done_callback(functools.partial(self.query_done, key))
+            entry = self.queries_in_flight[key] = [query, 0, node]
         else:
-            node.record_responded()
-            if b'ip' in response:
-                node_id = self.secure_id_manager.record_ip(unpack_compact_peer(response[b'ip'])[0])
-                if node_id is not None:
-                    self.change_id(node_id)
+            self.queries_coalesced.inc('in_flight')
+        query, _, sender = entry
+        entry[1] += 1
+        try:
+            response, rtt = await asyncio.shield(query)
+        except asyncio.TimeoutError:
+            if node is not sender:
+                self.record_timeout(node)
+            raise
+        finally:
+            entry[1] -= 1
+            if not entry[1] and not query.done():
+                # Nobody wants the response anymore
+                del self.queries_in_flight[key]
+                query.cancel()
+        if node is not sender:
+            self.record_response(node, rtt)
+        return response
 
-            return response
+    def query_done(self, key: tuple, query: asyncio.Future):
+        if self.queries_in_flight.get(key, [None])[0] is query:
+            del self.queries_in_flight[key]
+            if not query.cancelled() and query.exception() is None:
+                self.query_results[key] = (time.monotonic() + self.RESULT_TTL, query.result()[0])
+                if len(self.query_results) > self.MAX_RESULTS:
+                    self.query_results.popitem(last=False)
 
     def change_id(self, node_id: NodeId):
         """
@@ -141,28 +497,41 @@ class Router(KRPCProtocol):
         self.routing_table = RoutingTable(node_id)
 
     async def call_find_node(self, node, target):
-        response = await self.send_query_to_node(node, b'find_node',
-                                                 {b'id': bytes(self.node_id), b'target': bytes(target)})
+        response = await self.query_node(node, b'find_node', {b'id': bytes(self.node_id), b'target': bytes(target)})
         try:
-            infos = parse_compact_nodes(response[b'r'][b'nodes'])
-        except KeyError:
-            log.debug('Invalid response: %s' % response)
-            raise
+            infos = CompactNodeList(response[b'r'][b'nodes'])
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug('Invalid response: %s', response)
+            raise InvalidResponse(response) from e
         return infos, None
 
     async def call_find_peers(self, node, target):
-        response = await self.send_query_to_node(node, b'get_peers',
-                                                 {b'id': bytes(self.node_id), b'info_hash': bytes(target)})
+        response = await self.query_node(node, b'get_peers',
+                                         {b'id': bytes(self.node_id), b'info_hash': bytes(target)})
         try:
             r = response[b'r']
-        except KeyError:
-            log.debug('Invalid response: %s' % response)
-            raise
-
-        infos = parse_compact_nodes(r[b'nodes']) if b'nodes' in r else []
-        if b'values' in r:
-            peers = [unpack_compact_peer(p) for p in r[b'values']]
-        else:
-            peers = None
+            infos = CompactNodeList(r[b'nodes']) if b'nodes' in r else []
+            if b'values' in r:
+                peers = [unpack_compact_peer(p) for p in r[b'values']]
+            else:
+                peers = None
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug('Invalid response: %s', response)
+            raise InvalidResponse(response) from e
 
         return infos, peers
+
+
+def id_argument(request, name: bytes) -> typing.Optional[NodeId]:
+    """
+    :param request: decoded query
+    :param name: argument name, e.g. b'target'
+    :return: the argument as a NodeId, None if it's missing or isn't a valid id
+    """
+    try:
+        value = request[b'a'][name]
+    except (KeyError, TypeError):
+        return None
+    if not isinstance(value, bytes) or len(value) != 20:
+        return None
+    return NodeId.from_bytes(value)
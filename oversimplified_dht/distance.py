@@ -0,0 +1,77 @@
+"""
+XOR distance over batches of node ids.
+
+Ids are held as a (n, 20) NumPy array of uint8, one big-endian id per row, so comparing rows as byte strings
+compares them as the 160 bit integers they stand for. NumPy is optional: without it, and for batches smaller than
+BATCH_THRESHOLD where the per-object path is faster anyway, ids are compared as Python ints.
+
+>>> ids = [NodeId.from_int(i) for i in (5, 1, 2 ** 159, 7)]
+>>> closest(NodeId.from_int(4), ids, 3)
+[NodeId(5), NodeId(7), NodeId(1)]
+"""
+import typing
+
+from .node_id import NodeId
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BATCH_THRESHOLD = 64  # batches at least that large are ranked with NumPy; see benchmarks/bench_distance.py
+ID_SIZE = 20
+
+
+def id_array(ids: bytes, stride: int = ID_SIZE) -> 'numpy.ndarray':
+    """
+    :param ids: 20 byte ids, each at the start of a stride bytes long record, e.g. a bytes object or a memoryview
+    :param stride: e.g. 26 for compact node infos
+    :return: (n, ID_SIZE) array of uint8, sharing memory with ids
+    """
+    return numpy.frombuffer(ids, dtype=numpy.uint8).reshape(-1, stride)[:, :ID_SIZE]
+
+
+def xor_distances(target: bytes, ids: 'numpy.ndarray') -> 'numpy.ndarray':
+    """
+    :param target: 20 byte id
+    :param ids: as returned by id_array
+    :return: distances from target, one big-endian 20 byte row each
+    """
+    return ids ^ numpy.frombuffer(target, dtype=numpy.uint8)
+
+
+def top_k(distances: 'numpy.ndarray', k: int) -> 'numpy.ndarray':
+    """
+    :param distances: as returned by xor_distances
+    :param k:
+    :return: indices of the k smallest distances, smallest first
+    """
+    distances = numpy.ascontiguousarray(distances)
+    if k < len(distances):
+        # Only rows whose first 4 bytes are within the k smallest can be among the k smallest rows
+        first = distances.view('>u4')[:, 0]
+        candidates = numpy.flatnonzero(first <= numpy.partition(first, k - 1)[k - 1])
+        distances = distances[candidates]
+    else:
+        candidates = numpy.arange(len(distances))
+    # Sorting rows as fixed size byte strings sorts them as big-endian integers
+    order = numpy.argsort(distances.view('S%i' % ID_SIZE).ravel(), kind='stable')
+    return candidates[order[:k]]
+
+
+def closest(target: NodeId, items: typing.Sequence, k: int = None, key=lambda item: item) -> list:
+    """
+    :param target:
+    :param items: e.g. nodes, ranked by the NodeId key returns for them
+    :param k: how many to return, all of them if None
+    :param key:
+    :return: the k items closest to target, closest first
+    """
+    if k is None:
+        k = len(items)
+    if numpy is None or len(items) < BATCH_THRESHOLD:
+        target = int(target)
+        return sorted(items, key=lambda item: target ^ int(key(item)))[:k]
+
+    ids = id_array(b''.join([bytes(key(item)) for item in items]))
+    return [items[index] for index in top_k(xor_distances(bytes(target), ids), k).tolist()]
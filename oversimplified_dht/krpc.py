@@ -1,19 +1,50 @@
 import asyncio
+import heapq
 import logging
+import time
+from collections import deque
 from functools import partialmethod
+from itertools import count
 
 import bencode as b
 
+from . import batch, codec, metrics
+from .ratelimit import QueryLimiter, SendPacer
+
 log = logging.getLogger(__name__)
 
 
 class KRPCProtocol(asyncio.DatagramProtocol):
+    TIMER_RESOLUTION = 0.05  # seconds between checks for expired transactions
+    MAX_TRANSACTIONS = 1024  # outstanding queries; send_query waits for a free slot beyond that
+    TRANSACTION_IDS = 2 ** 16  # transaction ids are 2 bytes long
+    # Limits on outgoing datagrams, None for no limit. Datagrams over the limits are queued, not dropped.
+    PACKETS_PER_SECOND = None
+    BYTES_PER_SECOND = None
+    DESTINATION_PACKETS_PER_SECOND = None  # to each (host, port)
+    DESTINATION_BYTES_PER_SECOND = None
+    # Limits on incoming queries, None for no limit. Queries over the limits are dropped before they're decoded.
+    QUERIES_PER_SOURCE = None  # per second from each IP
+    QUERY_BURST = None  # QUERIES_PER_SOURCE by default
+    QUERY_CPU_BUDGET = None  # fraction of a core that handling queries may take, e.g. 0.5
+    QUERY_MARKER = b'1:y1:q'  # bencoded dicts have sorted keys, so it's in every query and in little else
+    BATCHED = False  # whether to receive through a batch.BatchDatagramTransport, for high packet rates
+
     @classmethod
     async def create(cls, port=49001) -> 'KRPCProtocol':
-        _, protocol = await asyncio.get_running_loop().create_datagram_endpoint(cls, local_addr=('0.0.0.0', port))
+        _, protocol = await cls.create_endpoint(cls, port)
         # noinspection PyTypeChecker
         return protocol
 
+    @classmethod
+    async def create_endpoint(cls, protocol_factory, port):
+        """
+        :return: (transport, protocol) listening on port, on the transport BATCHED asks for
+        """
+        if cls.BATCHED:
+            return await batch.create_batch_endpoint(protocol_factory, local_addr=('0.0.0.0', port))
+        return await asyncio.get_running_loop().create_datagram_endpoint(protocol_factory, local_addr=('0.0.0.0', port))
+
     @staticmethod
     def response(request, args):
         """
@@ -22,7 +53,7 @@ class KRPCProtocol(asyncio.DatagramProtocol):
         :param args: response args
         :return: ready-to-send response body
         """
-        return b.encode({b'y': b'r', b't': request[b't'], b'r': args})
+        return codec.encode_response(request[b't'], args)
 
     @staticmethod
     def error(request, code, description):
@@ -41,71 +72,167 @@ class KRPCProtocol(asyncio.DatagramProtocol):
     error_method_unknown = partialmethod(error, code=204, description=b'Method Unknown')
     error_invalid_arguments = partialmethod(error, code=203, description=b'Invalid arguments')
 
-    async def send_query(self, addr, method: bytes, args: dict):
+    async def send_query(self, addr, method: bytes, args: dict, timeout: float = None):
         """
         :param addr: (ip,port) as passed to transport send_to
         :param method: method name byte string, e.g. b'get_peers'
         :param args: arguments to the query, e.g.  {"id": "<querying nodes id>", "info_hash": "<info hash of target torrent>"}
+        :param timeout: seconds to wait for the response before raising TimeoutError, None to wait forever.
+                        Expiry is checked every TIMER_RESOLUTION seconds, and the time spent waiting for a free
+                        transaction slot or for the send pacer to let the query out doesn't count.
         :return: whole node's response like {"t":"aa", "y":"r", "r": {"id":"<queried nodes id>", "values":["<value1>",]}}
                  Response may also be error like {"t":"aa", "y":"e", "e":[201, "A Generic Error Occurred"]}
         """
+        response, _ = await self.send_query_timed(addr, method, args, timeout)
+        return response
+
+    async def send_query_timed(self, addr, method: bytes, args: dict, timeout: float = None):
+        """
+        Like send_query.
+        :return: (response, round trip time), the time counted from when the query actually went out
+        """
+        await self.acquire_transaction_slot()
+        transaction_id = self.allocate_transaction_id()
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.transactions[transaction_id] = future
         try:
-            transaction_id = self.last_transaction_id.to_bytes(length=2, byteorder='big')
-        except OverflowError:
-            self.last_transaction_id = 0
-            transaction_id = self.last_transaction_id.to_bytes(length=2, byteorder='big')
+            await self.pacer.send(addr, codec.encode_query(transaction_id, method, args))
+            sent = loop.time()
+            self.packets_sent.inc(b'q', method)
+            if timeout is not None:
+                self.add_deadline(loop, sent + timeout, future)
+            response = await future
+            return response, loop.time() - sent
+        finally:
+            self.transactions.pop(transaction_id)
+            self.release_transaction_slot()
 
-        self.last_transaction_id += 1
-        request = {
-            b't': transaction_id,
-            b'y': b'q',
-            b'q': method,
-            b'a': args
-        }
+    def allocate_transaction_id(self) -> bytes:
+        """
+        :return: the next transaction id that isn't in flight
+        """
+        while True:
+            transaction_id = self.last_transaction_id.to_bytes(length=2, byteorder='big')
+            self.last_transaction_id = (self.last_transaction_id + 1) % self.TRANSACTION_IDS
+            if transaction_id not in self.transactions:
+                return transaction_id
 
-        self.transport.sendto(addr=addr, data=b.encode(request))
+    async def acquire_transaction_slot(self):
+        if self.slots_taken < self.max_transactions and not self.slot_waiters:
+            self.slots_taken += 1
+            return
 
-        future = asyncio.get_event_loop().create_future()
-        self.transactions[transaction_id] = future
+        waiter = asyncio.get_event_loop().create_future()
+        self.slot_waiters.append(waiter)
         try:
-            return await future
+            await waiter  # release_transaction_slot hands its slot over
         except asyncio.CancelledError:
-            pass
-        finally:
-            self.transactions.pop(transaction_id)
+            if waiter.done() and not waiter.cancelled():
+                self.release_transaction_slot()
+            elif waiter in self.slot_waiters:
+                self.slot_waiters.remove(waiter)
+            raise
+
+    def release_transaction_slot(self):
+        while self.slot_waiters:
+            waiter = self.slot_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.slots_taken -= 1
+
+    def add_deadline(self, loop, deadline, future):
+        heapq.heappush(self.deadlines, (deadline, next(self.deadline_counter), future))
+        if self.deadline_timer is None:
+            self.deadline_timer = loop.call_later(self.TIMER_RESOLUTION, self.expire_transactions, loop)
+
+    def expire_transactions(self, loop):
+        """
+        Fails every transaction whose deadline has passed with TimeoutError.
+        Runs every TIMER_RESOLUTION seconds for as long as there are deadlines pending.
+        """
+        now = loop.time()
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            future = heapq.heappop(deadlines)[2]
+            if not future.done():
+                future.set_exception(asyncio.TimeoutError())
+                self.timeouts.inc()
+
+        if deadlines:
+            self.deadline_timer = loop.call_later(self.TIMER_RESOLUTION, self.expire_transactions, loop)
+        else:
+            self.deadline_timer = None
 
     def handle_query(self, decoded, address):
         try:
-            method = decoded[b'q'].decode()
+            method_name = decoded[b'q']
+            method = getattr(self, "krpc_handle_%s" % method_name.decode())
         except KeyError:
             return
-        try:
-            method = getattr(self, "krpc_handle_%s" % method)
-        except AttributeError:
-            log.debug("Got query with unknown method %s" % method)
+        except (AttributeError, UnicodeDecodeError):
+            self.packets_received.inc(b'q', b'unknown')  # not labelled by name, anyone can make up methods
+            log.debug("Got query with unknown method %s", decoded[b'q'])
             return
+        self.packets_received.inc(b'q', method_name)
 
         response = method(decoded, address)
         if response is not None:
-            self.transport.sendto(addr=address, data=response)
+            self.pacer.send_nowait(address, response)
+            self.packets_sent.inc(response[-2:-1], method_name)  # messages end with 1:y1:re or 1:y1:ee
 
     def datagram_received(self, datagram, address):
+        if not self.query_limiter.limited or self.QUERY_MARKER not in datagram:
+            self.handle_datagram(datagram, address)
+            return
+
+        if not self.query_limiter.allow(address[0]):
+            return
+        started = time.perf_counter()
+        try:
+            self.handle_datagram(datagram, address, limited=True)
+        finally:
+            self.query_limiter.charge(time.perf_counter() - started)
+
+    def datagrams_received(self, datagrams):
+        """
+        Batch of (datagram, address) from a BatchDatagramTransport.
+        """
+        # Looked up once per batch, and without the query limiter's checks when there are no limits
+        receive = self.datagram_received if self.query_limiter.limited else self.handle_datagram
+        for datagram, address in datagrams:
+            receive(datagram, address)
+
+    def handle_datagram(self, datagram, address, limited=False):
+        """
+        :param limited: whether the datagram went through the query limiter
+        """
         try:
-            decoded = b.decode(datagram)
+            decoded = codec.decode(datagram)
         except b.InvalidBencode:
-            log.debug("Discarded invalid datagram (failed to decode)")
+            self.decode_failures.inc()
+            if metrics.HOT_PATH_LOGGING:
+                log.debug("Discarded invalid datagram (failed to decode)")
             return
         try:
             message_type = decoded[b'y']
             # noinspection PyUnusedLocal
             tid = decoded[b't']
-        except KeyError:
-            log.debug("Discarded invalid datagram: %s" % decoded)
+        except (KeyError, TypeError):
+            self.decode_failures.inc()
+            if metrics.HOT_PATH_LOGGING:
+                log.debug("Discarded invalid datagram: %s", decoded)
             return
 
         if message_type == b'r' or message_type == b'e':
+            self.packets_received.inc(message_type, b'')
             self.handle_response(decoded)
         elif message_type == b'q':
+            if not limited and self.query_limiter.limited:
+                # A query without QUERY_MARKER, e.g. with a non-canonical 1:y01:q, mustn't get around the limits
+                self.query_limiter.dropped += 1
+                return
             self.handle_query(decoded, address)
 
     def handle_response(self, response):
@@ -113,12 +240,58 @@ class KRPCProtocol(asyncio.DatagramProtocol):
         try:
             self.transactions[transaction_id].set_result(response)
         except (KeyError, asyncio.InvalidStateError):
-            log.debug("Got response to non-existing or canceled transaction: %s" % response)
+            self.unmatched_responses.inc()
+            if metrics.HOT_PATH_LOGGING:
+                log.debug("Got response to non-existing or canceled transaction: %s", response)
 
-    def __init__(self):
+    def __init__(self, max_transactions: int = MAX_TRANSACTIONS):
+        assert max_transactions < self.TRANSACTION_IDS
         self.transactions = {}
         self.last_transaction_id = 0
+        self.max_transactions = max_transactions
+        self.slots_taken = 0
+        self.slot_waiters = deque()
+        self.deadlines = []  # heap of (deadline, counter, future)
+        self.deadline_counter = count()
+        self.deadline_timer = None
+        self.pacer = SendPacer(self.sendto, self.PACKETS_PER_SECOND, self.BYTES_PER_SECOND,
+                               self.DESTINATION_PACKETS_PER_SECOND, self.DESTINATION_BYTES_PER_SECOND)
+        self.query_limiter = QueryLimiter(self.QUERIES_PER_SOURCE, self.QUERY_BURST, self.QUERY_CPU_BUDGET)
+        self.metrics = metrics.Registry()
+        self.register_metrics()
+
+    def register_metrics(self):
+        """
+        Sets up the metrics of self.metrics. Subclasses add theirs.
+        """
+        m = self.metrics
+        self.packets_received = m.counter('krpc_packets_received_total',
+                                          'Messages received by type (q, r, e), queries by method', ('type', 'method'))
+        self.packets_sent = m.counter('krpc_packets_sent_total',
+                                      'Messages sent by type (q, r, e) and method queried', ('type', 'method'))
+        self.decode_failures = m.counter('krpc_decode_failures_total', 'Datagrams that were not KRPC messages')
+        self.unmatched_responses = m.counter('krpc_unmatched_responses_total',
+                                             'Responses to no query in flight, e.g. late ones')
+        self.timeouts = m.counter('krpc_timeouts_total', 'Queries that timed out')
+        m.gauge('krpc_transactions', 'Queries in flight', lambda: len(self.transactions))
+        m.gauge('krpc_transaction_slot_waiters', 'Queries waiting for a transaction slot',
+                lambda: len(self.slot_waiters))
+        m.gauge('krpc_send_queue_depth', 'Datagrams held back by the send pacer', lambda: self.pacer.queue_depth)
+        m.counter('krpc_send_throttled_total', 'Datagrams the send pacer held back',
+                  function=lambda: self.pacer.throttled)
+        m.counter('krpc_send_throttled_seconds_total', 'Time datagrams spent held back by the send pacer',
+                  function=lambda: self.pacer.throttled_time)
+        m.counter('krpc_send_dropped_total', 'Responses the send pacer dropped, its queue full or them too old',
+                  function=lambda: self.pacer.dropped)
+        m.counter('krpc_queries_dropped_total', 'Incoming queries dropped by the query limiter', ('reason',),
+                  function=lambda: {('rate',): self.query_limiter.dropped, ('cpu',): self.query_limiter.dropped_cpu})
+
+    def sendto(self, addr, data: bytes):
+        self.transport.sendto(addr=addr, data=data)
 
     def connection_made(self, transport: asyncio.DatagramTransport):
         # noinspection PyAttributeOutsideInit
         self.transport = transport
+
+    def connection_lost(self, exc):
+        self.pacer.close()
@@ -0,0 +1,231 @@
+"""
+Counters, gauges and histograms, cheap enough to update on every datagram, and their Prometheus text exposition.
+
+>>> registry = Registry()
+>>> sent = registry.counter('packets_sent_total', 'Datagrams sent', ('method',))
+>>> sent.inc('ping')
+>>> sent.inc('ping')
+>>> rtt = registry.histogram('rtt_seconds', 'Round trip times', buckets=(0.1, 1))
+>>> rtt.observe(0.05)
+>>> rtt.observe(0.5)
+>>> print(registry.expose(), end='')
+# HELP packets_sent_total Datagrams sent
+# TYPE packets_sent_total counter
+packets_sent_total{method="ping"} 2
+# HELP rtt_seconds Round trip times
+# TYPE rtt_seconds histogram
+rtt_seconds_bucket{le="0.1"} 1
+rtt_seconds_bucket{le="1"} 2
+rtt_seconds_bucket{le="+Inf"} 2
+rtt_seconds_sum 0.55
+rtt_seconds_count 2
+"""
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Dict, Sequence, Union
+
+# Whether the hot paths (KRPCProtocol.datagram_received and handle_response, NodeCrawler.run) log at debug level,
+# which they only do if the application sets the loggers to DEBUG. False skips those calls altogether.
+HOT_PATH_LOGGING = True
+
+
+def format_label_value(value) -> str:
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')  # e.g. method names, kept as they come on the hot path
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, format_label_value(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    __slots__ = ['name', 'help', 'label_names', 'values']
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        :param labels: values of the labels, in the order of label_names
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, format_labels(self.label_names, labels), value
+
+
+class Gauge:
+    """
+    Either set, or read from a function when exposed: a function returning a number, or a dict from label value
+    tuples to numbers if the gauge has labels.
+    """
+    __slots__ = ['name', 'help', 'label_names', 'value', 'function']
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Callable[[], Union[float, Dict[tuple, float]]] = None,
+                 label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.value = 0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        value = self.value if self.function is None else self.function()
+        if self.label_names:
+            for labels, v in value.items():
+                yield self.name, format_labels(self.label_names, labels), v
+        else:
+            yield self.name, '', value
+
+
+class CallbackCounter(Gauge):
+    """
+    Counter kept elsewhere, e.g. by SendPacer, and read from a function when exposed.
+    """
+    __slots__ = []
+    type = 'counter'
+
+
+class Histogram:
+    __slots__ = ['name', 'help', 'buckets', 'counts', 'sum', 'count']
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        """
+        :param buckets: upper bounds, ascending. +Inf is implied.
+        """
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield self.name + '_bucket', format_labels((), (), 'le="%s"' % format_value(bound)), cumulative
+        yield self.name + '_sum', '', round(self.sum, 9)
+        yield self.name + '_count', '', self.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError('Metric %s already registered' % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = (), function=None) -> Counter:
+        """
+        :param function: reads a counter kept elsewhere, as for Gauge
+        """
+        if function is not None:
+            return self.register(CallbackCounter(name, help, function, label_names))
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, function=None, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, function, label_names))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float]) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def __getitem__(self, name: str):
+        return self.metrics[name]
+
+    def expose(self) -> str:
+        """
+        :return: every metric in the Prometheus text exposition format
+        """
+        return format_dump(self.dump())
+
+    def dump(self) -> list:
+        """
+        :return: the current values as plain data, e.g. to send them to another process:
+                 [(name, help, type, [(sample name, labels, value), ...]), ...]
+        """
+        return [(metric.name, metric.help, metric.type, list(metric.samples())) for metric in self.metrics.values()]
+
+
+def combine(dumps: Sequence[list]) -> list:
+    """
+    Adds up samples of the same name and labels across dumps, e.g. those of several Routers.
+
+    >>> registry = Registry()
+    >>> registry.counter('sent_total', 'Sent').inc()
+    >>> print(format_dump(combine([registry.dump(), registry.dump()])), end='')
+    # HELP sent_total Sent
+    # TYPE sent_total counter
+    sent_total 2
+    """
+    combined = {}
+    for dump in dumps:
+        for name, help, type_, samples in dump:
+            values = combined.setdefault(name, (help, type_, {}))[2]
+            for sample_name, labels, value in samples:
+                values[sample_name, labels] = values.get((sample_name, labels), 0) + value
+    return [(name, help, type_, [(sample_name, labels, value) for (sample_name, labels), value in values.items()])
+            for name, (help, type_, values) in combined.items()]
+
+
+def format_dump(dump: list) -> str:
+    lines = []
+    for name, help, type_, samples in dump:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, type_))
+        for sample_name, labels, value in samples:
+            lines.append('%s%s %s' % (sample_name, labels, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+async def serve(registry: Registry, port: int = 9100, host: str = '127.0.0.1') -> asyncio.AbstractServer:
+    """
+    Serves registry.expose() over HTTP, for Prometheus to scrape. Every request gets the metrics, whatever its path.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = registry.expose().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %i\r\n\r\n'
+                         % len(body) + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,10 +1,14 @@
-import datetime
 import typing
 from dataclasses import dataclass
 from enum import Enum
+from operator import attrgetter
+from socket import inet_ntoa
+from time import monotonic
 
-from bencode.misc import pack_compact_peer, unpack_compact_peer, group
+from bencode.misc import pack_compact_peer
 
+from . import distance
+from . import rtt as rtt_estimation
 from .node_id import NodeId
 
 
@@ -14,18 +18,61 @@ class NodeAddress:
     port: int
 
 
-@dataclass
 class NodeInfo:
-    host: str
-    port: int
-    id: NodeId
+    """
+    Node's id and address. The address is kept packed as in compact node info, host and port are only decoded when
+    they are asked for: most nodes we hear about are never queried.
+
+    >>> info = NodeInfo('127.0.0.1', 6881, NodeId.from_int(1))
+    >>> info.host, info.port, info.address
+    ('127.0.0.1', 6881, b'\\x7f\\x00\\x00\\x01\\x1a\\xe1')
+    >>> NodeInfo.from_compact(bytes(info.id) + info.address) == info
+    True
+    """
+    __slots__ = ('id', 'address')
+
+    def __init__(self, host: str, port: int, id: NodeId):
+        self.id = id
+        self.address = pack_compact_peer(host, port)  # 4 bytes of ip, 2 of port
+
+    @classmethod
+    def from_compact(cls, data: bytes, position: int = 0):
+        """
+        :param data: compact node infos
+        :param position: where the 26 bytes of this node's info start in data
+        :return:
+        """
+        info = cls.__new__(cls)
+        info.id = NodeId.from_bytes(data[position:position + 20])
+        info.address = data[position + 20:position + 26]
+        return info
+
+    @property
+    def host(self) -> str:
+        return inet_ntoa(self.address[:4])
+
+    @property
+    def port(self) -> int:
+        return int.from_bytes(self.address[4:], 'big')
+
+    def __eq__(self, other):
+        if not isinstance(other, NodeInfo):
+            return NotImplemented
+        return self.id == other.id and self.address == other.address
+
+    def __hash__(self):
+        return hash((self.id, self.address))
+
+    def __repr__(self):
+        return "NodeInfo(host=%r, port=%i, id=%r)" % (self.host, self.port, self.id)
 
 
 class Node:
     """
     Keeps node's info as well as its 'reputation'.
     To keep track of the latter:
-    record_responded must be called whenever we receive as a valid response from the node
+    record_responded must be called whenever we receive as a valid response from the node, with the round trip time
+    if it is known
     record_not_responding - whenever our query times out
     record_queried - whenever we receive a query from the node
 
@@ -36,39 +83,59 @@ class Node:
     >>> n.get_status()
     <NodeState.GOOD: 1>
     >>> n= Node(NodeInfo('127.0.0.1', 666, NodeId.from_int(1)))
-    >>> n.record_responded(datetime.datetime.now()-datetime.timedelta(minutes=16))
+    >>> n.record_responded(monotonic() - 16 * 60)
     >>> n.get_status()
     <NodeState.QUESTIONABLE: 3>
+    >>> n.record_responded(rtt=0.25)
+    >>> n.srtt, n.rttvar, n.timeout()
+    (0.25, 0.125, 0.75)
+    >>> n.record_not_responding()
+    >>> n.timeout()
+    1.5
 
     """
     # noinspection PyArgumentList
     State = Enum('NodeState', 'GOOD BAD QUESTIONABLE')
     MAX_QUERIES_WITHOUT_RESPONSE = 2  # once reached, Node becomes BAD
-    INACTIVE_TIMEOUT = datetime.timedelta(minutes=15)
+    INACTIVE_TIMEOUT = 15 * 60  # seconds
+    __slots__ = ('info', 'last_interaction', 'queries_not_responded', 'last_response', 'srtt', 'rttvar')
 
     def __init__(self, node_info: NodeInfo):
         self.info = node_info
+        # time.monotonic() timestamps
         self.last_interaction = None  # None until we receive a response from the node
         self.queries_not_responded = 0  # queries not responded in a row
         self.last_response = None
+        self.srtt = None  # smoothed round trip time, seconds; None until a response is timed
+        self.rttvar = None
 
-    def record_responded(self, time=None):
-        self.last_response = self.last_interaction = datetime.datetime.now() if time is None else time
+    def record_responded(self, time=None, rtt=None):
+        self.last_response = self.last_interaction = monotonic() if time is None else time
         self.queries_not_responded = 0
+        if rtt is not None:
+            self.srtt, self.rttvar = rtt_estimation.update(self.srtt, self.rttvar, rtt)
 
     def record_queried(self, time=None):
         if self.last_interaction is not None:
-            self.last_interaction = datetime.datetime.now() if time is None else time
+            self.last_interaction = monotonic() if time is None else time
 
     def record_not_responding(self):
         self.queries_not_responded += 1
 
+    def timeout(self):
+        """
+        :return: how long to wait for this node's response, None if we have no rtt samples for it
+        """
+        if self.srtt is None:
+            return None
+        return rtt_estimation.timeout(self.srtt, self.rttvar, self.queries_not_responded)
+
     def get_status(self):
         if self.last_interaction is None:
             return Node.State.BAD
         if self.queries_not_responded > self.MAX_QUERIES_WITHOUT_RESPONSE:
             return Node.State.BAD
-        if datetime.datetime.now() - self.last_interaction > self.INACTIVE_TIMEOUT:
+        if monotonic() - self.last_interaction > self.INACTIVE_TIMEOUT:
             return Node.State.QUESTIONABLE
 
         return Node.State.GOOD
@@ -82,14 +149,86 @@ class Node:
             self.get_status().name, self.info.host, self.info.port, int(self.info.id))
 
 
+class CompactNodeList(typing.Sequence):
+    """
+    The node infos in a compact node list, read in place from a memoryview of it. Entries are only made into
+    NodeInfos when they are indexed, ids can be read and ranked without building anything per entry.
+
+    >>> nodes = CompactNodeList(pack_compact_nodes([NodeInfo('127.0.0.1', port, NodeId.from_int(port))
+    ...                                             for port in (1, 2, 3)]))
+    >>> len(nodes), nodes[-1]
+    (3, NodeInfo(host='127.0.0.1', port=3, id=NodeId(3)))
+    >>> nodes.id(0) == bytes(NodeId.from_int(1))
+    True
+    >>> [info.port for info in nodes.closest(NodeId.from_int(2), 2)]
+    [2, 3]
+    >>> [info.port for info in nodes.node_infos(skip={bytes(NodeId.from_int(1))})]
+    [2, 3]
+    """
+    NODE_SIZE = 26
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes):
+        """
+        :param data: compact node infos; trailing bytes that don't make a whole node info are ignored
+        """
+        data = memoryview(data)
+        self.data = data[:len(data) - len(data) % self.NODE_SIZE]
+
+    def __len__(self):
+        return len(self.data) // self.NODE_SIZE
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        position = range(0, len(self.data), self.NODE_SIZE)[index]
+        return NodeInfo.from_compact(bytes(self.data[position:position + self.NODE_SIZE]))
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __repr__(self):
+        return "CompactNodeList(%i nodes)" % len(self)
+
+    def id(self, index: int) -> bytes:
+        position = range(0, len(self.data), self.NODE_SIZE)[index]
+        return bytes(self.data[position:position + 20])
+
+    def node_infos(self, skip=frozenset()) -> typing.List[NodeInfo]:
+        """
+        :param skip: ids, as bytes, of the entries to leave out
+        :return: NodeInfos of the other entries
+        """
+        data = self.data
+        infos = []
+        for position in range(0, len(data), self.NODE_SIZE):
+            entry = bytes(data[position:position + self.NODE_SIZE])
+            if entry[:20] not in skip:
+                infos.append(NodeInfo.from_compact(entry))
+        return infos
+
+    def closest(self, target: NodeId, k: int = None) -> typing.List[NodeInfo]:
+        """
+        :param target:
+        :param k: how many to return, all of them if None
+        :return: NodeInfos of the k entries closest to target, closest first
+        """
+        if k is None:
+            k = len(self)
+        if distance.numpy is None or len(self) < distance.BATCH_THRESHOLD:
+            # Making every NodeInfo costs less than ranking entries in place one by one
+            return distance.closest(target, self.node_infos(), k, key=attrgetter('id'))
+        ids = distance.id_array(self.data, self.NODE_SIZE)
+        return [self[i] for i in distance.top_k(distance.xor_distances(bytes(target), ids), k).tolist()]
+
+
 def parse_compact_nodes(data: bytes) -> typing.List[NodeInfo]:
-    node_infos = []
-    for data in group(data, 26):
-        ip, port = unpack_compact_peer(data[20:])
-        node_id = NodeId.from_bytes(data[:20])
-        node_infos.append(NodeInfo(ip, port, node_id))
-    return node_infos
+    """
+    :param data: compact node infos, 26 bytes each; trailing bytes that don't make a whole node info are ignored
+    :return:
+    """
+    return [NodeInfo.from_compact(data, position) for position in range(0, len(data) - 25, 26)]
 
 
 def pack_compact_nodes(nodes_list: typing.List[NodeInfo]) -> bytes:
-    return b''.join(bytes(node_info.id) + pack_compact_peer(node_info.host, node_info.port) for node_info in nodes_list)
+    return b''.join(bytes(node_info.id) + node_info.address for node_info in nodes_list)
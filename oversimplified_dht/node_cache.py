@@ -0,0 +1,110 @@
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from operator import attrgetter
+from typing import Dict, List, Tuple
+
+from . import distance
+from .node import Node
+from .node_id import NodeId
+
+
+class NodeCache:
+    """
+    Nodes that responded recently, shared by all lookups so that what one lookup learns can seed the next ones.
+    Entries expire ttl seconds after the node's last response; past max_nodes, the least recently responsive go first.
+
+    Ids are also kept sorted: the nodes within XOR distance 2**b of a target are those sharing all but the low b bits
+    of its id, which sit next to each other in id order. So the closest nodes to a target are found by bisecting for
+    the smallest such range holding enough of them.
+
+    >>> from oversimplified_dht.node import NodeInfo
+    >>> cache = NodeCache()
+    >>> for i in (1, 2, 8, 9, 12):
+    ...     cache.add(Node(NodeInfo('127.0.0.1', i, NodeId.from_int(i))))
+    >>> [int(node.id) for node in cache.closest(NodeId.from_int(10), 3)]
+    [8, 9, 12]
+    >>> cache.discard(NodeId.from_int(8))
+    >>> [int(node.id) for node in cache.closest(NodeId.from_int(10), 3)]
+    [9, 12, 2]
+    """
+    TTL = 10 * 60  # nodes become questionable after 15 minutes without a response
+    MAX_NODES = 2 ** 14
+
+    def __init__(self, ttl: float = TTL, max_nodes: int = MAX_NODES):
+        self.ttl = ttl
+        self.max_nodes = max_nodes
+        self.ids: List[int] = []  # sorted
+        # id -> (time of last response, node), least recently responsive first
+        self.nodes: Dict[int, Tuple[float, Node]] = OrderedDict()
+
+    def add(self, node: Node):
+        """
+        Records that node just responded. Its srtt is what lookups seeded from the cache will time out with.
+        """
+        node_id = int(node.id)
+        if self.nodes.pop(node_id, None) is None:
+            insort(self.ids, node_id)
+        self.nodes[node_id] = (time.monotonic(), node)
+        while len(self.nodes) > self.max_nodes:
+            self._remove(next(iter(self.nodes)))
+
+    def discard(self, node_id: NodeId):
+        """
+        Forgets about a node, e.g. because a query to it timed out.
+        """
+        node_id = int(node_id)
+        if node_id in self.nodes:
+            self._remove(node_id)
+
+    def closest(self, target: NodeId, k: int = 8) -> List[Node]:
+        """
+        :param target:
+        :param k:
+        :return: up to k nodes, closest first
+        """
+        self.expire()
+        if len(self.ids) <= k:
+            return distance.closest(target, [node for _, node in self.nodes.values()], k, key=attrgetter('id'))
+
+        # Smallest b such that the ids sharing all but the low b bits with target are at least k
+        target = int(target)
+        low, high = 0, 160
+        while low < high:
+            bits = (low + high) // 2
+            if self._count_in_block(target, bits) >= k:
+                high = bits
+            else:
+                low = bits + 1
+        start, end = self._block(target, low)
+        return distance.closest(NodeId.from_int(target), [self.nodes[i][1] for i in self.ids[start:end]], k,
+                                key=attrgetter('id'))
+
+    def expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self.nodes:
+            node_id, (responded, _) = next(iter(self.nodes.items()))
+            if responded > deadline:
+                break
+            self._remove(node_id)
+
+    def _block(self, target: int, bits: int) -> Tuple[int, int]:
+        """
+        :return: the range of self.ids sharing all but the low bits bits with target
+        """
+        start = target >> bits << bits
+        return bisect_left(self.ids, start), bisect_left(self.ids, start + (1 << bits))
+
+    def _count_in_block(self, target: int, bits: int) -> int:
+        start, end = self._block(target, bits)
+        return end - start
+
+    def _remove(self, node_id: int):
+        del self.nodes[node_id]
+        del self.ids[bisect_left(self.ids, node_id)]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id: NodeId):
+        return int(node_id) in self.nodes
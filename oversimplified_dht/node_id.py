@@ -39,7 +39,7 @@ class NodeId:
 
     @staticmethod
     def bytes_to_int(data: bytes) -> int:
-        return int(data.hex(), 16)
+        return int.from_bytes(data, 'big')
 
     @staticmethod
     def int_to_bytes(data: int) -> bytes:
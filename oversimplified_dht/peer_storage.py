@@ -1,15 +1,96 @@
-from collections import defaultdict
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from bencode.misc import pack_compact_peer
 
 
 class LocalPeerStorage:
-    def __init__(self):
-        self.info_hashes = defaultdict(list)
+    """
+    Peers announced to us, kept as 6 byte compact peer infos so get_peers replies can use them as they are.
+    Peers expire PEER_TTL seconds after their last announce. Once more than max_peers are stored, whole info_hashes
+    are evicted, least recently used first.
+
+    >>> s = LocalPeerStorage()
+    >>> s.store_peer(b'hash', '127.0.0.1', 6881)
+    >>> s.store_peer(b'hash', '127.0.0.1', 6881)
+    >>> s.get_peers(b'hash')
+    [b'\\x7f\\x00\\x00\\x01\\x1a\\xe1']
+    >>> b'other hash' in s, s.get_peers(b'other hash'), b'other hash' in s
+    (False, [], False)
+    """
+    PEER_TTL = 30 * 60  # BEP5 clients re-announce every 30 minutes
+    MAX_PEERS = 2 ** 17  # a stored peer costs about 100 bytes with dict overhead
+    MAX_VALUES = 50  # peers per get_peers reply, keeps it well within a single datagram
+
+    def __init__(self, peer_ttl: float = PEER_TTL, max_peers: int = MAX_PEERS):
+        self.peer_ttl = peer_ttl
+        self.max_peers = max_peers
+        # info_hash -> {compact peer: expiry time}, least recently used info_hash first.
+        # Peers are reinserted on every announce, so each dict is ordered by expiry time as well.
+        self.info_hashes: Dict[bytes, Dict[bytes, float]] = OrderedDict()
+        self.size = 0
+
+    def store_peer(self, info_hash: bytes, host: str, port: int):
+        peers = self.info_hashes.get(info_hash)
+        if peers is None:
+            peers = self.info_hashes[info_hash] = {}
+        else:
+            self.info_hashes.move_to_end(info_hash)
+
+        compact = pack_compact_peer(host, port)
+        if peers.pop(compact, None) is None:
+            self.size += 1
+        peers[compact] = time.monotonic() + self.peer_ttl
+
+        while self.size > self.max_peers:
+            _, evicted = self.info_hashes.popitem(last=False)
+            self.size -= len(evicted)
+
+    def get_peers(self, info_hash: bytes, number: int = MAX_VALUES) -> List[bytes]:
+        """
+        :param info_hash:
+        :param number: at most that many peers are returned, picked at random
+        :return: compact peer infos
+        """
+        peers = self._live_peers(info_hash)
+        if peers is None:
+            return []
+        self.info_hashes.move_to_end(info_hash)
+        if len(peers) <= number:
+            return list(peers)
+        return random.sample(list(peers), number)
+
+    def expire(self):
+        """
+        Drops every expired peer. Expired peers are also dropped lazily when their info_hash is looked up.
+        """
+        for info_hash in list(self.info_hashes):
+            self._live_peers(info_hash)
+
+    def _live_peers(self, info_hash: bytes):
+        peers = self.info_hashes.get(info_hash)
+        if peers is None:
+            return None
+
+        now = time.monotonic()
+        expired = []
+        for compact, expiry in peers.items():
+            if expiry > now:
+                break
+            expired.append(compact)
+        for compact in expired:
+            del peers[compact]
+        self.size -= len(expired)
 
-    def store_peer(self, info_hash, host, port):
-        self.info_hashes[info_hash].append((host, port))
+        if not peers:
+            del self.info_hashes[info_hash]
+            return None
+        return peers
 
-    def get_peers(self, info_hash):
-        return self.info_hashes[info_hash]
+    def __contains__(self, info_hash: bytes):
+        return self._live_peers(info_hash) is not None
 
-    def __contains__(self, info_hash):
-        return info_hash in self.info_hashes
+    def __len__(self):
+        return self.size
@@ -0,0 +1,305 @@
+"""
+Token buckets, pacing of outgoing datagrams with them so that bursts don't overflow the socket buffer, and limits
+on incoming queries so that no single source can take up the event loop.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, refilled at rate tokens per second.
+
+    >>> bucket = TokenBucket(rate=10, capacity=2, now=0)
+    >>> bucket.delay(1, now=0)
+    0
+    >>> bucket.take(2, now=0)
+    >>> bucket.delay(1, now=0)
+    0.1
+    >>> bucket.delay(1, now=0.1)
+    0
+    """
+    __slots__ = ['rate', 'capacity', 'tokens', 'updated']
+
+    def __init__(self, rate: float, capacity: float = None, now: float = None):
+        """
+        :param rate: tokens per second
+        :param capacity: largest burst, one second worth of tokens by default
+        :param now: time.monotonic() by default
+        """
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """
+        :return: seconds until amount tokens are available, 0 if they are now.
+                 Amounts over capacity are available once the bucket is full.
+        """
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0
+        return missing / self.rate
+
+    def take(self, amount: float, now: float):
+        self.refill(now)
+        self.tokens -= amount
+
+
+def buckets_delay(buckets, size: int, now: float) -> float:
+    """
+    :param buckets: (packets bucket, bytes bucket), either one may be None
+    :return: seconds until a datagram of size bytes may go through both
+    """
+    return max((bucket.delay(amount, now) for bucket, amount in zip(buckets, (1, size)) if bucket is not None),
+               default=0)
+
+
+def buckets_take(buckets, size: int, now: float):
+    for bucket, amount in zip(buckets, (1, size)):
+        if bucket is not None:
+            bucket.take(amount, now)
+
+
+class SendPacer:
+    """
+    Sends datagrams no faster than a global and a per-destination limit allow, each in packets and in bytes per
+    second. Datagrams that can't go out right away wait in a queue rather than being dropped, and go out in order
+    as soon as tokens allow, except that one throttled destination doesn't hold up datagrams to the others.
+    A limit of None means no limit. Datagrams from send_nowait, e.g. responses, are dropped instead once the queue
+    holds max_queued datagrams, or when they've waited max_age seconds, by which time nobody expects them anymore.
+    """
+    MAX_DESTINATIONS = 2 ** 14  # per-destination buckets kept, least recently used are forgotten first
+    MAX_QUEUED = 2 ** 12
+    MAX_AGE = 2  # seconds
+
+    def __init__(self, sendto: Callable[[Tuple[str, int], bytes], None],
+                 packets_per_second: float = None, bytes_per_second: float = None,
+                 destination_packets_per_second: float = None, destination_bytes_per_second: float = None,
+                 max_destinations: int = MAX_DESTINATIONS, max_queued: int = MAX_QUEUED, max_age: float = MAX_AGE):
+        """
+        :param sendto: sends a datagram right away, called as sendto(addr, data)
+        """
+        self.sendto = sendto
+        now = time.monotonic()
+        self.buckets = [TokenBucket(rate, now=now) if rate is not None else None
+                        for rate in (packets_per_second, bytes_per_second)]
+        self.destination_rates = (destination_packets_per_second, destination_bytes_per_second)
+        self.limited = any(rate is not None for rate in (packets_per_second, bytes_per_second,
+                                                         destination_packets_per_second, destination_bytes_per_second))
+        self.max_destinations = max_destinations
+        self.max_queued = max_queued
+        self.max_age = max_age
+        self.destinations = OrderedDict()  # addr -> [packets bucket, bytes bucket], least recently used first
+        self.queue = deque()  # (addr, data, queued at, future or None)
+        self.queued = {}  # addr -> number of datagrams to it in the queue
+        self.timer = None
+        # Counters
+        self.sent = 0
+        self.throttled = 0  # datagrams that had to wait
+        self.throttled_time = 0.  # seconds they waited, in total
+        self.dropped = 0  # datagrams from send_nowait that the queue had no room or time for
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    async def send(self, addr: Tuple[str, int], data: bytes):
+        """
+        Returns once the datagram is sent, which is how callers feel the backpressure.
+        """
+        if self.try_send(addr, data):
+            return
+        future = asyncio.get_event_loop().create_future()
+        self.enqueue(addr, data, future)
+        await future
+
+    def send_nowait(self, addr: Tuple[str, int], data: bytes):
+        """
+        Sends the datagram now, or queues it to be sent as soon as the limits allow, or drops it if the queue is full.
+        """
+        if self.try_send(addr, data):
+            return
+        if len(self.queue) >= self.max_queued:
+            self.dropped += 1
+            return
+        self.enqueue(addr, data, None)
+
+    def try_send(self, addr, data) -> bool:
+        if not self.limited:
+            self.sendto(addr, data)
+            self.sent += 1
+            return True
+        if self.queue and (self.buckets != [None, None] or addr in self.queued):
+            return False  # would overtake queued datagrams
+        now = time.monotonic()
+        if self.delay(addr, len(data), now):
+            return False
+        self.take(addr, len(data), now)
+        self.sendto(addr, data)
+        self.sent += 1
+        return True
+
+    def enqueue(self, addr, data, future: Optional[asyncio.Future]):
+        self.queue.append((addr, data, time.monotonic(), future))
+        self.queued[addr] = self.queued.get(addr, 0) + 1
+        self.throttled += 1
+        if self.timer is None:
+            self.drain()
+
+    def drain(self):
+        """
+        Sends what the limits allow from the queue, and schedules itself to go on when tokens are back.
+        """
+        self.timer = None
+        now = time.monotonic()
+        global_delay = 0
+        destination_delay = None
+        blocked = set()
+        remaining = deque()
+        for item in self.queue:
+            addr, data, queued_at, future = item
+            if future is not None and future.done():
+                self.dequeued(addr)
+                continue  # the caller gave up
+            if future is None and now - queued_at > self.max_age:
+                self.dequeued(addr)
+                self.dropped += 1
+                continue
+            if global_delay or addr in blocked:
+                remaining.append(item)
+                continue
+            delay = self.global_delay(len(data), now)
+            if delay:
+                global_delay = delay
+                remaining.append(item)
+                continue
+            delay = self.destination_delay(addr, len(data), now)
+            if delay:
+                destination_delay = delay if destination_delay is None else min(destination_delay, delay)
+                blocked.add(addr)
+                remaining.append(item)
+                continue
+
+            self.dequeued(addr)
+            self.take(addr, len(data), now)
+            self.sendto(addr, data)
+            self.sent += 1
+            self.throttled_time += now - queued_at
+            if future is not None:
+                future.set_result(None)
+        self.queue = remaining
+
+        if self.queue:
+            delays = [delay for delay in (global_delay, destination_delay) if delay]
+            self.timer = asyncio.get_event_loop().call_later(min(delays), self.drain)
+
+    def dequeued(self, addr):
+        if self.queued[addr] == 1:
+            del self.queued[addr]
+        else:
+            self.queued[addr] -= 1
+
+    def delay(self, addr, size: int, now: float) -> float:
+        return self.global_delay(size, now) or self.destination_delay(addr, size, now)
+
+    def global_delay(self, size: int, now: float) -> float:
+        return buckets_delay(self.buckets, size, now)
+
+    def destination_delay(self, addr, size: int, now: float) -> float:
+        buckets = self.destinations.get(addr)
+        return 0 if buckets is None else buckets_delay(buckets, size, now)
+
+    def take(self, addr, size: int, now: float):
+        buckets_take(self.buckets, size, now)
+        if self.destination_rates == (None, None):
+            return
+        buckets = self.destinations.get(addr)
+        if buckets is None:
+            buckets = self.destinations[addr] = [TokenBucket(rate, now=now) if rate is not None else None
+                                                 for rate in self.destination_rates]
+            while len(self.destinations) > self.max_destinations:
+                self.destinations.popitem(last=False)
+        else:
+            self.destinations.move_to_end(addr)
+        buckets_take(buckets, size, now)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for _, _, _, future in self.queue:
+            if future is not None and not future.done():
+                future.cancel()
+        self.queue.clear()
+        self.queued.clear()
+
+
+class QueryLimiter:
+    """
+    Decides which incoming queries get handled at all. Each source IP may send queries_per_second with bursts of
+    burst, and handling queries from everyone together may take up to cpu_budget seconds per second. A limit of
+    None means no limit. Buckets are kept for at most max_sources IPs, least recently seen are forgotten first,
+    which only ever lets a forgotten source start over with a full bucket.
+
+    >>> limiter = QueryLimiter(queries_per_second=1, burst=2)
+    >>> [limiter.allow('10.0.0.1', now=0) for _ in range(3)]
+    [True, True, False]
+    >>> limiter.allow('10.0.0.2', now=0), limiter.allow('10.0.0.1', now=1)
+    (True, True)
+    """
+    MAX_SOURCES = 2 ** 14
+
+    def __init__(self, queries_per_second: float = None, burst: float = None, cpu_budget: float = None,
+                 max_sources: int = MAX_SOURCES):
+        """
+        :param burst: queries_per_second by default
+        :param cpu_budget: fraction of a core, e.g. 0.5
+        """
+        self.queries_per_second = queries_per_second
+        self.burst = burst
+        self.cpu = None if cpu_budget is None else TokenBucket(cpu_budget)
+        self.limited = queries_per_second is not None or cpu_budget is not None
+        self.max_sources = max_sources
+        self.sources = OrderedDict()  # host -> TokenBucket, least recently seen first
+        # Counters
+        self.dropped = 0  # queries over their source's rate
+        self.dropped_cpu = 0  # queries dropped because the CPU budget was spent
+
+    def allow(self, host: str, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        if self.cpu is not None and self.cpu.delay(0, now):
+            # Handling queries has used more than the budget, let it recover
+            self.dropped_cpu += 1
+            return False
+        if self.queries_per_second is None:
+            return True
+
+        bucket = self.sources.get(host)
+        if bucket is None:
+            bucket = self.sources[host] = TokenBucket(self.queries_per_second, self.burst, now=now)
+            while len(self.sources) > self.max_sources:
+                self.sources.popitem(last=False)
+        else:
+            self.sources.move_to_end(host)
+        if bucket.delay(1, now):
+            self.dropped += 1
+            return False
+        bucket.take(1, now)
+        return True
+
+    def charge(self, seconds: float, now: float = None):
+        """
+        Accounts for seconds spent handling a query.
+        """
+        if self.cpu is not None:
+            self.cpu.take(seconds, time.monotonic() if now is None else now)
@@ -1,7 +1,10 @@
-import datetime
+import random
+import time
+from collections import OrderedDict
 from itertools import chain
 from typing import Dict
 from typing import List
+from typing import Optional
 
 from ..node import Node
 from ..node_id import NodeId
@@ -9,12 +12,15 @@ from ..node_id import NodeId
 
 class Bucket:
     MAX_NODES_NUMBER = 8
+    MAX_REPLACEMENTS = 8  # candidates kept for when a node of the bucket goes bad
 
     def __init__(self, min_: int = 0, max_: int = 2 ** 160, nodes=None):
         self.min = min_
         self.max = max_
         self._nodes: Dict[NodeId, Node] = {}
-        self.last_changed = datetime.datetime.now()
+        # Candidates that found the bucket full, most recently seen last
+        self.replacements: Dict[NodeId, Node] = OrderedDict()
+        self.last_changed = time.monotonic()
         if nodes is not None:
             for node in nodes:
                 self._nodes[node.id] = node
@@ -46,19 +52,47 @@ class Bucket:
         """
         return self.min <= int(node_id) < self.max
 
-    def fresh(self):
-        now = datetime.datetime.now()
-        if now - self.last_changed > datetime.timedelta(minutes=15):
-            for node in self._nodes.values():
-                if now - node.last_response > datetime.timedelta(minutes=15):
-                    return True
-        return False
+    def stale(self, now: float = None) -> bool:
+        """
+        Whether the bucket needs a refresh: it hasn't changed in Node.INACTIVE_TIMEOUT, and it's empty or some of
+        its nodes haven't responded in that time either, if ever.
+        """
+        if now is None:
+            now = time.monotonic()
+        if now - self.last_changed <= Node.INACTIVE_TIMEOUT:
+            return False
+        return not self._nodes or any(node.last_response is None or now - node.last_response > Node.INACTIVE_TIMEOUT
+                                      for node in self._nodes.values())
+
+    def random_id(self) -> NodeId:
+        """
+        :return: a random id in the bucket's range, the target of a lookup that refreshes it
+        """
+        return NodeId.from_int(random.randrange(self.min, self.max))
+
+    def get(self, node_id: NodeId) -> Optional[Node]:
+        return self._nodes.get(node_id)
 
     def add_node(self, node: Node):
         self._nodes[node.id] = node
+        self.replacements.pop(node.id, None)
         assert len(self._nodes) <= self.MAX_NODES_NUMBER
         self.update_last_changed()
 
+    def add_replacement(self, node: Node):
+        self.replacements.pop(node.id, None)
+        self.replacements[node.id] = node
+        if len(self.replacements) > self.MAX_REPLACEMENTS:
+            self.replacements.popitem(last=False)
+
+    def pop_replacement(self) -> Optional[Node]:
+        """
+        :return: the most recently seen replacement, None if there is none
+        """
+        if not self.replacements:
+            return None
+        return self.replacements.popitem()[1]
+
     def pop_node(self, node_id: NodeId):
         return self._nodes.pop(node_id)
 
@@ -67,7 +101,7 @@ class Bucket:
         self.add_node(node)
 
     def update_last_changed(self):
-        self.last_changed = datetime.datetime.now()
+        self.last_changed = time.monotonic()
 
     def split(self):
         middle_point = (self.max + self.min) // 2
@@ -0,0 +1,104 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+from .table import RoutingTable
+from ..node import Node
+from ..node_id import NodeId
+
+
+class TableMaintainer:
+    """
+    A single task that inserts the nodes we come across into the routing table, instead of a task per node.
+    Candidates wait in a bounded queue that holds each id once; when it overflows, the candidates seen longest
+    ago are dropped. Candidates that find their bucket full wait in its replacement cache, and the questionable
+    nodes standing in their way are pinged, up to PING_BATCH at a time while inserts go on, to be replaced if they
+    don't respond.
+    """
+    MAX_PENDING = 4096
+    INSERT_BATCH = 256  # candidates inserted between yields to the event loop
+    PING_BATCH = 16
+
+    def __init__(self, get_table: Callable[[], RoutingTable], ping: Callable[[Node], Awaitable],
+                 max_pending: int = MAX_PENDING, ping_batch: int = PING_BATCH):
+        """
+        :param get_table: returns the routing table to maintain, which may change, e.g. with our id
+        :param ping: raises if node doesn't respond, e.g. asyncio.TimeoutError
+        """
+        self.get_table = get_table
+        self.ping = ping
+        self.max_pending = max_pending
+        self.ping_batch = ping_batch
+        self.pending: Dict[NodeId, Node] = OrderedDict()  # least recently seen first
+        self.to_ping: Dict[NodeId, Node] = OrderedDict()
+        self.pinging: Dict[NodeId, asyncio.Task] = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        # Counters
+        self.inserted = 0
+        self.dropped = 0  # candidates the queue had no room for
+        self.pings = 0
+
+    def add(self, node: Node):
+        """
+        Queues node for insertion, replacing what's queued under its id. Doesn't wait.
+        """
+        self.pending.pop(node.id, None)
+        self.pending[node.id] = node
+        if len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                self.insert_batch()
+                self.start_pings()
+                await asyncio.sleep(0)
+
+    def insert_batch(self):
+        """
+        Inserts up to INSERT_BATCH pending candidates, and queues pings to make room for those that didn't fit.
+        """
+        table = self.get_table()
+        for _ in range(min(self.INSERT_BATCH, len(self.pending))):
+            _, node = self.pending.popitem(last=False)
+            if table.add_node(node):
+                self.inserted += 1
+                continue
+            for questionable in table.nodes_to_ping(node.id):
+                if questionable.id not in self.pinging:
+                    self.to_ping[questionable.id] = questionable
+
+    def start_pings(self):
+        while self.to_ping and len(self.pinging) < self.ping_batch:
+            node_id, node = self.to_ping.popitem(last=False)
+            self.pinging[node_id] = asyncio.ensure_future(self.ping_node(node))
+
+    async def ping_node(self, node: Node):
+        try:
+            await self.ping(node)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            responded = False
+        else:
+            responded = True
+        finally:
+            del self.pinging[node.id]
+        self.pings += 1
+        self.get_table().record_ping(node, responded)
+        self.start_pings()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in list(self.pinging.values()):
+            task.cancel()
+        self.to_ping.clear()
@@ -0,0 +1,135 @@
+"""
+On-disk snapshots of a routing table, so a restarted node can skip bootstrapping.
+
+Layout, all integers big-endian:
+    MAGIC
+    our node id, 20 bytes
+    number of buckets, 2 bytes
+    wall-clock time of the dump, seconds since the epoch, 8-byte double
+    for every bucket:
+        lower bound of its range, 20 bytes
+        number of nodes, 1 byte
+        for every node:
+            compact node info, 26 bytes
+            queries not responded in a row, 1 byte
+            seconds since its last response as of the dump, 4 bytes, NEVER if it never responded
+
+The time since the dump is added to every age on load: a node that was fresh before a day of downtime isn't.
+"""
+import os
+import struct
+import time
+import typing
+
+from .bucket import Bucket
+from .table import RoutingTable
+from ..node import Node, NodeInfo, pack_compact_nodes
+from ..node_id import NodeId
+
+MAGIC = b'OSDHT\x02'
+NEVER = 2 ** 32 - 1
+HEADER = struct.Struct('!20sHd')
+BUCKET = struct.Struct('!20sB')
+LIVENESS = struct.Struct('!BI')
+NODE_SIZE = 26 + LIVENESS.size
+
+
+def dump(table: RoutingTable) -> bytes:
+    now = time.monotonic()
+    parts = [MAGIC, HEADER.pack(bytes(table.node_id), len(table.buckets), time.time())]
+    for bucket in table.buckets:
+        nodes = bucket.get_nodes_list()
+        parts.append(BUCKET.pack(NodeId.int_to_bytes(bucket.min), len(nodes)))
+        for node in nodes:
+            if node.last_response is None:
+                age = NEVER
+            else:
+                age = min(int(now - node.last_response), NEVER - 1)
+            parts.append(pack_compact_nodes([node.info]))
+            parts.append(LIVENESS.pack(min(node.queries_not_responded, 255), age))
+    return b''.join(parts)
+
+
+def load(data: bytes) -> RoutingTable:
+    """
+    Raises ValueError if data isn't a valid snapshot.
+    :param data:
+    :return: the table, with nodes' liveness as it was when it was dumped, aged by the time since
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a routing table snapshot')
+    now = time.monotonic()
+    try:
+        node_id, bucket_count, dumped = HEADER.unpack_from(data, len(MAGIC))
+        downtime = max(time.time() - dumped, 0)
+        position = len(MAGIC) + HEADER.size
+        table = RoutingTable(NodeId.from_bytes(node_id))
+        buckets = []
+        for _ in range(bucket_count):
+            min_, node_count = BUCKET.unpack_from(data, position)
+            position += BUCKET.size
+            nodes = []
+            for _ in range(node_count):
+                failures, age = LIVENESS.unpack_from(data, position + 26)
+                info = NodeInfo.from_compact(data, position)
+                position += NODE_SIZE
+                node = Node(info)
+                if age != NEVER:
+                    node.record_responded(now - age - downtime)
+                node.queries_not_responded = failures
+                nodes.append(node)
+            buckets.append((NodeId.bytes_to_int(min_), nodes))
+    except struct.error as e:
+        raise ValueError('Truncated routing table snapshot') from e
+    if position != len(data):
+        raise ValueError('Trailing data after routing table snapshot')
+
+    bounds = [min_ for min_, _ in buckets]
+    if not bounds or bounds[0] != table.MINIMUM or bounds != sorted(set(bounds)) or not all(
+            is_split_range(min_, max_) for min_, max_ in zip(bounds, bounds[1:] + [table.MAXIMUM])):
+        raise ValueError('Invalid bucket ranges in routing table snapshot')
+    table.bounds = bounds
+    table.buckets = [Bucket(min_, max_, nodes)
+                     for (min_, nodes), max_ in zip(buckets, bounds[1:] + [table.MAXIMUM])]
+    for bucket in table.buckets:
+        if len(bucket) > Bucket.MAX_NODES_NUMBER or not all(bucket.has_id_in_range(node.id) for node in bucket):
+            raise ValueError('Invalid bucket contents in routing table snapshot')
+    return table
+
+
+def is_split_range(min_: int, max_: int) -> bool:
+    """
+    Whether [min_, max_) is a range that halving [0, 2^160) again and again gives, as bucket splits do:
+    its size a power of two and min_ a multiple of it. get_neighbours relies on buckets being such ranges.
+
+    >>> is_split_range(0, 2 ** 159), is_split_range(2 ** 159, 2 ** 159 + 2 ** 158), is_split_range(1, 2)
+    (True, True, True)
+    >>> is_split_range(0, 3), is_split_range(2, 6)
+    (False, False)
+    """
+    size = max_ - min_
+    return size > 0 and not size & (size - 1) and not min_ % size
+
+
+def save(table: RoutingTable, path: str):
+    """
+    Writes a snapshot atomically: readers see either the previous snapshot or the new one, never a partial file.
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(dump(table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read(path: str) -> typing.Optional[RoutingTable]:
+    """
+    :param path:
+    :return: the table saved at path, None if there is no usable snapshot there
+    """
+    try:
+        with open(path, 'rb') as f:
+            return load(f.read())
+    except (OSError, ValueError):
+        return None
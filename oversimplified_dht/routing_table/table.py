@@ -1,64 +1,62 @@
-import asyncio
-import heapq
-import operator
+from bisect import bisect_left, bisect_right
 from itertools import chain
-from typing import Tuple, List
+from operator import attrgetter
+from typing import Iterator, List, Tuple
 
 from .bucket import Bucket
+from .. import distance
 from ..node import Node
 from ..node_id import NodeId
 
 
-class TableTraverser:
-    def __init__(self, table, node_id):
-        index, bucket = table.get_bucket_for(node_id)
-        # table.buckets[index].touchLastUpdated()
-        self.currentNodes = table.buckets[index].get_nodes_list()
-        self.leftBuckets = table.buckets[:index]
-        self.rightBuckets = table.buckets[(index + 1):]
-        self.left = True
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        """
-        Pop an item from the left subtree, then right, then left, etc.
-        """
-        if len(self.currentNodes) > 0:
-            return self.currentNodes.pop()
-
-        if self.left and len(self.leftBuckets) > 0:
-            self.currentNodes = self.leftBuckets.pop().get_nodes_list()
-            self.left = False
-            return next(self)
-
-        if len(self.rightBuckets) > 0:
-            self.currentNodes = self.rightBuckets.pop(0).get_nodes_list()
-            self.left = True
-            return next(self)
-
-        raise StopIteration
-
-
 class RoutingTable:
     MINIMUM = 0
     MAXIMUM = 2 ** 160
 
     def __init__(self, node_id):
         self.buckets = [Bucket(min_=self.MINIMUM, max_=self.MAXIMUM)]
+        # Lower bounds of self.buckets, kept sorted and in step with it so get_bucket_for can bisect
+        self.bounds = [self.MINIMUM]
         self.node_id = node_id
-        self.lock = asyncio.Lock()
 
     def get_neighbours(self, node_id: NodeId, k=8) -> List[Node]:
+        """
+        Returns the k nodes closest to node_id by XOR distance.
+        :param node_id: target
+        :param k:
+        :return: up to k nodes, closest first
+        """
         nodes = []
-        for node in TableTraverser(self, node_id):
-            heapq.heappush(nodes, (node_id ^ node.id, node))
-            # nodes.append(node)
-            if len(nodes) == k:
+        for bucket in self.buckets_by_distance(int(node_id)):
+            if len(nodes) >= k:
                 break
+            nodes.extend(bucket)
 
-        return list(map(operator.itemgetter(1), heapq.nsmallest(k, nodes)))
+        return distance.closest(node_id, nodes, k, key=attrgetter('id'))
+
+    def buckets_by_distance(self, target: int) -> Iterator[Bucket]:
+        """
+        Yields buckets in order of increasing XOR distance from target.
+        Buckets are the leaves of a binary trie over the id space, so each subtree's ids are either all closer
+        to target than its sibling's or all further away. Descending into the half target falls in first
+        therefore gives an exact order, and callers that stop early never look at the remaining buckets.
+        :param target:
+        :return:
+        """
+        stack = [(0, len(self.buckets), self.MINIMUM, self.MAXIMUM)]
+        while stack:
+            low, high, min_, max_ = stack.pop()
+            if high - low == 1:
+                yield self.buckets[low]
+                continue
+            middle_point = (min_ + max_) // 2
+            middle = bisect_left(self.bounds, middle_point, low, high)
+            lower, upper = (low, middle, min_, middle_point), (middle, high, middle_point, max_)
+            # The closer half is the one whose bit at this depth matches target's, wherever target itself lies
+            if not target & (middle_point - min_):
+                stack += upper, lower
+            else:
+                stack += lower, upper
 
     def split_bucket(self, index, add_node: Node):
         b = self.buckets[index]
@@ -70,27 +68,38 @@ class RoutingTable:
             bucket = first if int(node.id) < middle_point else second
             if not bucket.full():
                 bucket.add_node(node)
+            else:
+                bucket.add_replacement(node)
+        for node in b.replacements.values():
+            (first if int(node.id) < middle_point else second).add_replacement(node)
         self.buckets[index] = first
         self.buckets.insert(index + 1, second)
+        self.bounds.insert(index + 1, middle_point)
         return first, second
 
     def get_bucket_for(self, node_id: NodeId) -> Tuple[int, Bucket]:
-        for index, bucket in enumerate(self.buckets):
-            if bucket.has_id_in_range(node_id):
-                return index, bucket
-
-        raise ValueError("No bucket has node id %i in range " % node_id)
+        """
+        Finds the bucket covering node_id by bisecting bucket lower bounds, O(log n) in the number of buckets.
+        :param node_id:
+        :return: (index, bucket)
+        """
+        value = int(node_id)
+        if not self.MINIMUM <= value < self.MAXIMUM:
+            raise ValueError("No bucket has node id %i in range " % value)
+        index = bisect_right(self.bounds, value) - 1
+        return index, self.buckets[index]
 
-    async def add_node(self, node: Node, ping_function) -> bool:
+    def add_node(self, node: Node) -> bool:
         """
+        Inserts node as BEP5 describes, without waiting for anything: into a bucket with room, splitting the bucket
+        if it's full and covers our id, or in place of a BAD node. Failing that, node goes to the bucket's
+        replacement cache, and nodes_to_ping tells which questionable nodes to ping to make room for it.
         :param node: node to add
-        :param ping_function: returns True if node responds, otherwise False.
-        :return: True if node was added, False if it was discarded
+        :return: True if node was added, False if it wasn't
         """
-        questionable_nodes = []
         bucket_index, bucket = self.get_bucket_for(node.id)
 
-        if node.id in bucket:
+        if node.id in bucket or node.id == self.node_id:
             return False
 
         if not bucket.full():
@@ -98,27 +107,65 @@ class RoutingTable:
             return True
 
         if bucket.has_id_in_range(self.node_id):
-            self.split_bucket(bucket_index, node)
-            return True
+            first, second = self.split_bucket(bucket_index, node)
+            return node.id in first or node.id in second  # both halves may be full, if all went the same way
 
         for current_node in bucket:
             if current_node.get_status() == Node.State.BAD:
                 bucket.replace_node(current_node.id, node)
                 return True
-            if current_node.get_status() == Node.State.QUESTIONABLE:
-                questionable_nodes.append(current_node)
-
-        questionable_nodes.sort(key=lambda n: n.last_interaction)
 
-        # If any nodes are questionable, they are pinged beginning from the least recently pinged one
-        for questionable_node in questionable_nodes:
-            node_responds = await ping_function()
-            if node_responds:
-                bucket.update_last_changed()
-            else:
-                bucket.replace_node(questionable_node.id, node)
-                return True
+        bucket.add_replacement(node)
         return False
 
+    def nodes_to_ping(self, node_id: NodeId) -> List[Node]:
+        """
+        :return: questionable nodes of the bucket covering node_id, least recently seen first, as many as there are
+                 replacements waiting to take their place should they not respond
+        """
+        _, bucket = self.get_bucket_for(node_id)
+        if not bucket.replacements:
+            return []
+        questionable = [node for node in bucket if node.get_status() == Node.State.QUESTIONABLE]
+        questionable.sort(key=lambda n: n.last_interaction or 0)
+        return questionable[:len(bucket.replacements)]
+
+    def record_ping(self, node: Node, responded: bool):
+        """
+        Replaces node with the most recently seen replacement of its bucket if it didn't respond to a ping.
+        """
+        _, bucket = self.get_bucket_for(node.id)
+        if bucket.get(node.id) is not node:
+            return
+        if responded:
+            bucket.update_last_changed()
+            return
+        self.replace(bucket, node)
+
+    def replace_bad_node(self, node: Node) -> bool:
+        """
+        Puts the most recently seen replacement of its bucket in place of node if node is in the table and BAD,
+        e.g. right after a query to it timed out, without waiting for a candidate to come along.
+        :return: True if node was replaced
+        """
+        _, bucket = self.get_bucket_for(node.id)
+        if bucket.get(node.id) is not node or node.get_status() != Node.State.BAD:
+            return False
+        return self.replace(bucket, node)
+
+    @staticmethod
+    def replace(bucket: Bucket, node: Node) -> bool:
+        replacement = bucket.pop_replacement()
+        if replacement is None:
+            return False
+        bucket.replace_node(node.id, replacement)
+        return True
+
+    def stale_buckets(self, now: float = None) -> List[Bucket]:
+        """
+        :return: buckets that need a refresh, least recently changed first
+        """
+        return sorted((bucket for bucket in self.buckets if bucket.stale(now)), key=attrgetter('last_changed'))
+
     def __repr__(self):
         return "<RoutingTable: %s>" % ','.join(str(len(bucket)) for bucket in self.buckets)
@@ -0,0 +1,75 @@
+"""
+Round trip time estimation as TCP does it (RFC 6298): a smoothed RTT and its variance, from which query timeouts
+are derived.
+"""
+from typing import Optional, Tuple
+
+ALPHA = 1 / 8  # gain of SRTT
+BETA = 1 / 4  # gain of RTTVAR
+K = 4
+MIN_TIMEOUT = 0.2
+MAX_TIMEOUT = 2
+
+
+def update(srtt: Optional[float], rttvar: Optional[float], rtt: float) -> Tuple[float, float]:
+    """
+    >>> update(None, None, 0.5)
+    (0.5, 0.25)
+    >>> update(1.0, 0.5, 3.0)
+    (1.25, 0.875)
+
+    :param srtt: current smoothed rtt, None if there were no samples yet
+    :param rttvar: current rtt variance
+    :param rtt: new sample, seconds
+    :return: (srtt, rttvar)
+    """
+    if srtt is None:
+        return rtt, rtt / 2
+    return (1 - ALPHA) * srtt + ALPHA * rtt, (1 - BETA) * rttvar + BETA * abs(srtt - rtt)
+
+
+def timeout(srtt: float, rttvar: float, backoff: int = 0) -> float:
+    """
+    >>> timeout(0.25, 0.0625)
+    0.5
+    >>> timeout(0.25, 0.0625, backoff=1)
+    1.0
+    >>> timeout(0.01, 0.001)
+    0.2
+    >>> timeout(0.25, 0.0625, backoff=10)
+    2
+
+    :param srtt:
+    :param rttvar:
+    :param backoff: number of timeouts in a row, each one doubles the timeout
+    :return: seconds, clamped to [MIN_TIMEOUT, MAX_TIMEOUT]
+    """
+    return min(max(srtt + K * rttvar, MIN_TIMEOUT) * 2 ** backoff, MAX_TIMEOUT)
+
+
+class RTTEstimator:
+    """
+    Estimator across all nodes, used for nodes we have no samples for yet.
+
+    >>> e = RTTEstimator(initial_timeout=1)
+    >>> e.timeout
+    1
+    >>> e.record(0.25)
+    >>> e.timeout
+    0.75
+    """
+    __slots__ = ['srtt', 'rttvar', 'initial_timeout']
+
+    def __init__(self, initial_timeout: float = 1):
+        self.srtt = None
+        self.rttvar = None
+        self.initial_timeout = initial_timeout
+
+    def record(self, rtt: float):
+        self.srtt, self.rttvar = update(self.srtt, self.rttvar, rtt)
+
+    @property
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return self.initial_timeout
+        return timeout(self.srtt, self.rttvar)
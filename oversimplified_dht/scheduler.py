@@ -0,0 +1,65 @@
+"""
+Query slots shared by many lookups running at once, handed out round robin so that no lookup starves the others.
+"""
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+
+class QueryScheduler:
+    """
+    Keeps at most max_in_flight queries in flight across all the lookups it schedules. When slots are short, a freed
+    slot goes to the lookup that has waited longest for its turn, one query per turn.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.turns = deque()  # queues of waiters of the lookups that are waiting, in turn order
+
+    def share(self, rpc: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        """
+        :param rpc: e.g. Router.call_find_peers
+        :return: rpc that waits for a slot first. Every call to share makes a lookup of its own.
+        """
+        waiters = deque()
+
+        async def scheduled(*args):
+            await self.acquire(waiters)
+            try:
+                return await rpc(*args)
+            finally:
+                self.release()
+
+        return scheduled
+
+    async def acquire(self, waiters: deque):
+        if self.in_flight < self.max_in_flight and not self.turns:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        if not waiters:
+            self.turns.append(waiters)
+        waiters.append(waiter)
+        try:
+            await waiter  # release hands its slot over
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            elif waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    self.turns.remove(waiters)
+            raise
+
+    def release(self):
+        while self.turns:
+            waiters = self.turns.popleft()
+            waiter = waiters.popleft()
+            if waiters:
+                self.turns.append(waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
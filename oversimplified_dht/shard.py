@@ -0,0 +1,224 @@
+"""
+Several Routers in as many processes, so that one machine can use more than one core and run more than one
+identity. Each worker process has its own Router, node id and UDP port, the ids splitting the keyspace evenly.
+A ShardedRouter in the parent process forwards every call to the worker whose id is closest to its target, over a
+Unix socket pair per worker.
+
+The workers don't share a port with SO_REUSEPORT: the kernel would spread incoming datagrams among them by address,
+and responses would reach workers that aren't waiting for them.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+from typing import List, Sequence, Type
+
+from . import metrics
+from .dht import Router
+from .node_id import NodeId
+
+HEADER = struct.Struct('!I')  # length of the pickled message that follows
+
+
+async def read_message(reader: asyncio.StreamReader):
+    length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(length))
+
+
+def write_message(writer: asyncio.StreamWriter, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+def shard_ids(shards: int) -> List[NodeId]:
+    """
+    :return: one random id in each of shards equal slices of the keyspace
+    """
+    size = 2 ** 160 // shards
+    return [NodeId.from_int(i * size + int.from_bytes(os.urandom(20), 'big') % size) for i in range(shards)]
+
+
+def run_worker(sock: socket.socket, router_class: Type[Router], node_id: NodeId, port: int, bootstrap_nodes):
+    """
+    Entry point of worker processes.
+    """
+    asyncio.run(serve_worker(sock, router_class, node_id, port, bootstrap_nodes))
+
+
+async def serve_worker(sock: socket.socket, router_class: Type[Router], node_id: NodeId, port: int,
+                       bootstrap_nodes):
+    """
+    Runs calls coming from the ShardedRouter on a Router of its own until the socket is closed.
+    Calls are (call id, method name, args) and get (call id, succeeded, result or exception) back.
+    """
+    router = await router_class.create(node_id=node_id, port=port, bootstrap_nodes=bootstrap_nodes)
+    reader, writer = await asyncio.open_unix_connection(sock=sock)
+    calls = set()
+
+    async def call(call_id, method, args):
+        try:
+            if method == 'dump_metrics':
+                result = router.metrics.dump()
+            else:
+                result = await getattr(router, method)(*args)
+        except Exception as e:
+            reply = (call_id, False, e)
+        else:
+            reply = (call_id, True, result)
+        try:
+            write_message(writer, reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            write_message(writer, (call_id, False, RuntimeError("Can't send back the result of %s: %r" % (method, e))))
+
+    try:
+        while True:
+            try:
+                call_id, method, args = await read_message(reader)
+            except asyncio.IncompleteReadError:
+                return
+            task = asyncio.ensure_future(call(call_id, method, args))
+            calls.add(task)
+            task.add_done_callback(calls.discard)
+    finally:
+        for task in calls:
+            task.cancel()
+        writer.close()
+        router.transport.close()
+
+
+class Worker:
+    def __init__(self, node_id: NodeId, port: int, process: multiprocessing.Process,
+                 reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.node_id = node_id
+        self.port = port
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+        self.calls = {}  # call id -> future of its result
+        self.call_ids = itertools.count()
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    async def call(self, method: str, *args):
+        call_id = next(self.call_ids)
+        future = self.calls[call_id] = asyncio.get_event_loop().create_future()
+        try:
+            write_message(self.writer, (call_id, method, args))
+            await self.writer.drain()
+            return await future
+        finally:
+            self.calls.pop(call_id, None)
+
+    async def receive(self):
+        try:
+            while True:
+                call_id, succeeded, result = await read_message(self.reader)
+                future = self.calls.get(call_id)
+                if future is None or future.done():
+                    continue
+                if succeeded:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        except asyncio.IncompleteReadError:
+            error = ConnectionError('Worker on port %i exited' % self.port)
+            for future in self.calls.values():
+                if not future.done():
+                    future.set_exception(error)
+
+
+class ShardedRouter:
+    """
+    Looks like a Router to the caller for get_peers, find_peers and bootstrap, which the worker closest to the
+    target runs. Any other Router method can be forwarded with call.
+    """
+
+    @classmethod
+    async def create(cls, workers: int = None, base_port=49001, bootstrap_nodes=Router.DEFAULT_BOOTSTRAP_NODES,
+                     router_class: Type[Router] = Router) -> 'ShardedRouter':
+        """
+        :param workers: os.cpu_count() by default
+        :param base_port: workers listen on base_port, base_port + 1, ...
+        :param router_class: importable by the worker processes
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        # Workers are spawned rather than forked, a fork would inherit the parent's event loop
+        context = multiprocessing.get_context('spawn')
+        started = []
+        try:
+            for i, node_id in enumerate(shard_ids(workers)):
+                started.append(await cls.start_worker(context, router_class, node_id, base_port + i, bootstrap_nodes))
+        except BaseException:
+            sharded = cls(started)
+            sharded.close()
+            await sharded.wait_closed()
+            raise
+        return cls(started)
+
+    @staticmethod
+    async def start_worker(context, router_class: Type[Router], node_id: NodeId, port: int,
+                           bootstrap_nodes) -> Worker:
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(child_sock, router_class, node_id, port, bootstrap_nodes))
+            process.start()
+        except BaseException:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        try:
+            reader, writer = await asyncio.open_unix_connection(sock=parent_sock)
+        except BaseException:
+            parent_sock.close()
+            process.terminate()
+            raise
+        return Worker(node_id, port, process, reader, writer)
+
+    def __init__(self, workers: Sequence[Worker]):
+        self.workers = list(workers)
+
+    def worker_for(self, target: NodeId) -> Worker:
+        """
+        :return: the worker whose id is closest to target
+        """
+        return min(self.workers, key=lambda worker: worker.node_id ^ target)
+
+    async def call(self, target: NodeId, method: str, *args):
+        """
+        Calls method of the Router of the worker closest to target with args, which must be picklable.
+        """
+        return await self.worker_for(target).call(method, *args)
+
+    async def bootstrap(self):
+        await asyncio.gather(*(worker.call('bootstrap') for worker in self.workers))
+
+    async def get_peers(self, info_hash: bytes):
+        return await self.call(NodeId.from_bytes(info_hash), 'get_peers', info_hash)
+
+    async def find_peers(self, target: NodeId):
+        return await self.call(target, 'find_peers', target)
+
+    async def stats(self) -> str:
+        """
+        :return: the metrics of all workers added up, in the Prometheus text exposition format
+        """
+        dumps = await asyncio.gather(*(worker.call('dump_metrics') for worker in self.workers))
+        return metrics.format_dump(metrics.combine(dumps))
+
+    def close(self):
+        """
+        Closes the sockets to the workers, upon which they shut their Routers down and exit.
+        """
+        for worker in self.workers:
+            worker.writer.close()
+            worker.receiver.cancel()
+
+    async def wait_closed(self, timeout: float = 5):
+        loop = asyncio.get_event_loop()
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.process.join, timeout)
@@ -1,24 +1,67 @@
-from hashlib import sha256
+import hmac
+import time
+from hashlib import sha1
 from os import urandom
 
 
 class TokenManager:
+    """
+    Stateless announce tokens as BEP5 describes them: a hash of the requester's IP and a secret that changes
+    every ROTATION_INTERVAL seconds. Tokens made with the previous secret are still accepted, so a token stays
+    valid for at least ROTATION_INTERVAL seconds and at most twice that, whatever the number of requesters.
+
+    >>> t = TokenManager()
+    >>> t.verify_token('127.0.0.1', t.issue_token('127.0.0.1'))
+    True
+    >>> t.verify_token('127.0.0.2', t.issue_token('127.0.0.1'))
+    False
+    """
+    ROTATION_INTERVAL = 5 * 60
+    TOKEN_LENGTH = 8
+
     def __init__(self):
-        self.tokens = {}
         self.token_key = self.generate_token_key()
-        self.issued_tokens = {}
+        self.previous_token_key = self.token_key
+        self.rotated_at = time.monotonic()
 
-    def generate_token(self, host: bytes):
-        return sha256(host + self.token_key).digest()
+    def generate_token(self, host: bytes, token_key: bytes = None):
+        return sha1(host + (self.token_key if token_key is None else token_key)).digest()[:self.TOKEN_LENGTH]
 
     @staticmethod
     def generate_token_key():
         return urandom(20)
 
-    def issue_token(self, node_id):
-        token = self.generate_token_key()
-        self.issued_tokens[node_id] = token
-        return token
+    def rotate(self):
+        """
+        Replaces the secret if ROTATION_INTERVAL has passed since it was made. Called on every issue and check.
+        """
+        now = time.monotonic()
+        elapsed = now - self.rotated_at
+        if elapsed < self.ROTATION_INTERVAL:
+            return
+        # After two intervals or more, tokens made with the current secret have expired as well
+        self.previous_token_key = self.token_key if elapsed < 2 * self.ROTATION_INTERVAL \
+            else self.generate_token_key()
+        self.token_key = self.generate_token_key()
+        self.rotated_at = now - elapsed % self.ROTATION_INTERVAL
+
+    def issue_token(self, host: str) -> bytes:
+        """
+        :param host: ip of the node the token is for
+        :return:
+        """
+        self.rotate()
+        return self.generate_token(host.encode())
 
-    def verify_token(self, node_id, token):
-        return self.issued_tokens[node_id] == token
+    def verify_token(self, host: str, token: bytes) -> bool:
+        """
+        :param host: ip of the node presenting the token
+        :param token:
+        :return: True if token was issued to host within the last one or two rotation intervals
+        """
+        if not isinstance(token, bytes):
+            return False
+        self.rotate()
+        host = host.encode()
+        return (hmac.compare_digest(token, self.generate_token(host)) or
+                hmac.compare_digest(token, self.generate_token(host, self.previous_token_key)))
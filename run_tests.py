@@ -1,12 +1,22 @@
 import doctest
 import unittest
 
-from oversimplified_dht import node, node_id
+from oversimplified_dht import (distance, metrics, node, node_cache, node_id, peer_storage, ratelimit, rtt,
+                                token_manager)
 
-doctest.testmod(node)
-doctest.testmod(node_id)
+# Shard workers are spawned, and re-import __main__: they mustn't run the tests again
+if __name__ == '__main__':
+    doctest.testmod(distance)
+    doctest.testmod(metrics)
+    doctest.testmod(node)
+    doctest.testmod(node_cache)
+    doctest.testmod(node_id)
+    doctest.testmod(peer_storage)
+    doctest.testmod(ratelimit)
+    doctest.testmod(rtt)
+    doctest.testmod(token_manager)
 
-loader = unittest.TestLoader()
-tests = loader.discover('.')
-testRunner = unittest.TextTestRunner()
-testRunner.run(tests)
+    loader = unittest.TestLoader()
+    tests = loader.discover('.')
+    testRunner = unittest.TextTestRunner()
+    testRunner.run(tests)
@@ -0,0 +1,35 @@
+import asyncio
+from typing import List
+
+from oversimplified_dht import Router
+
+
+class DelayedRouter(Router):
+    """Router that answers queries after DELAY seconds, to simulate network latency on loopback"""
+    DELAY = 0.02
+
+    def handle_query(self, decoded, address):
+        asyncio.get_event_loop().call_later(self.DELAY, super().handle_query, decoded, address)
+
+
+async def create_network(size: int, base_port=49300, bootstrap=True, router_class=Router) -> List[Router]:
+    """
+    Starts size routers on loopback, all bootstrapping from the first one.
+    :param size:
+    :param base_port: routers listen on base_port, base_port + 1, ...
+    :param bootstrap: whether to bootstrap every router but the first one
+    :param router_class: e.g. DelayedRouter
+    :return:
+    """
+    bootstrap_nodes = (('127.0.0.1', base_port),)
+    routers = [await router_class.create(port=base_port + i, bootstrap_nodes=bootstrap_nodes) for i in range(size)]
+    if bootstrap:
+        for router in routers[1:]:
+            await router.bootstrap()
+        await asyncio.sleep(0.01)  # let the routing table inserts bootstrap scheduled run
+    return routers
+
+
+def close_network(routers: List[Router]):
+    for router in routers:
+        router.transport.close()
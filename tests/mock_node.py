@@ -1,4 +1,4 @@
-import datetime
+import time
 
 from asynctest.mock import MagicMock
 
@@ -6,10 +6,14 @@ from oversimplified_dht import NodeId
 from oversimplified_dht.node import Node, NodeInfo
 
 
+class MockNode(Node):
+    """Node has __slots__; this one has a __dict__ so its methods can be mocked"""
+
+
 def mock_node(id_, state=Node.State.GOOD):
     if isinstance(id_, int):
         id_ = NodeId.from_int(id_)
-    n = Node(NodeInfo('127.0.0.1', 666, id_))
-    n.last_interaction = datetime.datetime.now()
+    n = MockNode(NodeInfo('127.0.0.1', 666, id_))
+    n.last_interaction = time.monotonic()
     n.get_status = MagicMock(return_value=state)
     return n
@@ -0,0 +1,80 @@
+import asyncio
+import socket
+
+import asynctest
+
+from oversimplified_dht.batch import create_batch_endpoint
+from oversimplified_dht.krpc import KRPCProtocol
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.batches = []
+        self.lost = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagrams_received(self, datagrams):
+        self.batches.append(datagrams)
+        for data, addr in datagrams:
+            self.transport.sendto(data.upper(), addr)
+
+    def connection_lost(self, exc):
+        self.lost = True
+
+
+class BatchedKRPCProtocol(KRPCProtocol):
+    BATCHED = True
+
+
+class BatchDatagramTransportTestCase(asynctest.TestCase):
+    async def setUp(self):
+        self.transport, self.protocol = await create_batch_endpoint(EchoProtocol, ('127.0.0.1', 49230), batch=16)
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(('127.0.0.1', 0))
+        self.client.settimeout(1)
+
+    def tearDown(self):
+        self.transport.close()
+        self.client.close()
+
+    async def test_batches(self):
+        for i in range(40):
+            self.client.sendto(b'datagram %i' % i, ('127.0.0.1', 49230))
+        await asyncio.sleep(0.05)
+        datagrams = [data for batch in self.protocol.batches for data, _ in batch]
+        self.assertEqual(datagrams, [b'datagram %i' % i for i in range(40)])
+        self.assertLess(len(self.protocol.batches), 40)
+        self.assertLessEqual(max(len(batch) for batch in self.protocol.batches), 16)
+
+        # replies were held until the end of each batch, then all sent
+        self.assertEqual([self.client.recvfrom(100)[0] for _ in range(40)], [b'DATAGRAM %i' % i for i in range(40)])
+        self.assertFalse(self.transport.held)
+
+    async def test_close(self):
+        self.transport.close()
+        await asyncio.sleep(0)
+        self.assertTrue(self.protocol.lost)
+        self.assertTrue(self.transport.sock._closed)
+
+
+class BatchedKRPCTestCase(asynctest.TestCase):
+    async def test_rpc(self):
+        batched = await BatchedKRPCProtocol.create(port=49231)
+        plain = await KRPCProtocol.create(port=49232)
+        for krpc in (batched, plain):
+            krpc.krpc_handle_test = lambda request, address, krpc=krpc: krpc.response(request, {b'ok': 1})
+        try:
+            response = await plain.send_query(('127.0.0.1', 49231), b'test', {}, timeout=1)
+            self.assertEqual(response[b'r'], {b'ok': 1})
+            response = await batched.send_query(('127.0.0.1', 49232), b'test', {}, timeout=1)
+            self.assertEqual(response[b'r'], {b'ok': 1})
+            self.assertEqual(batched.transport.get_extra_info('sockname')[1], 49231)
+        finally:
+            batched.transport.close()
+            plain.transport.close()
+
+
+if __name__ == '__main__':
+    asynctest.main()
@@ -0,0 +1,112 @@
+import random
+import unittest
+from os import urandom
+
+import bencode as b
+
+from oversimplified_dht import codec
+
+
+def canonical(value):
+    """value with dict keys sorted, as codec encodes them"""
+    if isinstance(value, dict):
+        return {k: canonical(value[k]) for k in sorted(value)}
+    if isinstance(value, list):
+        return [canonical(v) for v in value]
+    return value
+
+
+def random_args(rng):
+    args = {b'id': urandom(20)}
+    for key, make in ((b'target', lambda: urandom(20)),
+                      (b'info_hash', lambda: urandom(20)),
+                      (b'nodes', lambda: urandom(26 * rng.randint(0, 8))),
+                      (b'token', lambda: urandom(rng.randint(0, 20))),
+                      (b'values', lambda: [urandom(6) for _ in range(rng.randint(0, 10))]),
+                      (b'port', lambda: rng.randint(0, 65535)),
+                      (b'implied_port', lambda: rng.randint(0, 1)),
+                      (b'want', lambda: [b'n4', b'n6'])):
+        if rng.random() < 0.3:
+            args[key] = make()
+    return args
+
+
+def random_message(rng):
+    transaction_id = urandom(rng.choice((1, 2, 4)))
+    kind = rng.random()
+    if kind < 0.4:
+        method = rng.choice((b'ping', b'find_node', b'get_peers', b'announce_peer', b'vote'))
+        args = {b'id': urandom(20)}
+        if method == b'find_node' and rng.random() < 0.9:
+            args[b'target'] = urandom(20)
+        elif method == b'get_peers' and rng.random() < 0.9:
+            args[b'info_hash'] = urandom(20)
+        else:
+            args.update(random_args(rng))
+        message = {b't': transaction_id, b'y': b'q', b'q': method, b'a': args}
+        if rng.random() < 0.3:
+            message[b'v'] = urandom(4)
+        return message
+    if kind < 0.9:
+        message = {b't': transaction_id, b'y': b'r', b'r': random_args(rng)}
+        if rng.random() < 0.2:
+            message[b'ip'] = urandom(6)
+        return message
+    return {b't': transaction_id, b'y': b'e', b'e': [rng.choice((201, 202, 203, 204)), b'Server Error']}
+
+
+def mutate(rng, data):
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 3)):
+        operation = rng.random()
+        position = rng.randrange(len(data) + 1)
+        if operation < 0.3:
+            del data[position:]
+        elif operation < 0.6 and position < len(data):
+            data[position] = rng.choice(b'deil:0123456789-xq' + bytes([rng.randrange(256)]))
+        elif operation < 0.8:
+            data[position:position] = rng.choice((b'e', b'i', b'0', b':', b'l', b'd', b'5:', b'i1e'))
+        else:
+            del data[position:position + rng.randint(1, 4)]
+    return bytes(data)
+
+
+class CodecTestCase(unittest.TestCase):
+    def test_encode_matches_bencode(self):
+        rng = random.Random(0)
+        for _ in range(3000):
+            message = random_message(rng)
+            if message[b'y'] == b'q' and b'v' not in message:
+                encoded = codec.encode_query(message[b't'], message[b'q'], message[b'a'])
+            elif message[b'y'] == b'r' and b'ip' not in message:
+                encoded = codec.encode_response(message[b't'], message[b'r'])
+            else:
+                continue
+            self.assertEqual(encoded, b.encode(canonical(message)))
+
+    def test_decode_matches_bencode(self):
+        rng = random.Random(1)
+        for _ in range(3000):
+            data = b.encode(canonical(random_message(rng)))
+            self.assertEqual(codec.decode(data), b.decode(data))
+
+    def test_decode_fuzz(self):
+        """on malformed input codec.decode must give what bencode gives, or raise InvalidBencode where it fails"""
+        rng = random.Random(2)
+        for _ in range(20000):
+            data = mutate(rng, b.encode(canonical(random_message(rng))))
+            try:
+                expected = b.decode(data)
+            except Exception:
+                with self.assertRaises(b.InvalidBencode, msg=data):
+                    codec.decode(data)
+            else:
+                self.assertEqual(codec.decode(data), expected, msg=data)
+
+    def test_decode_deep_nesting(self):
+        with self.assertRaises(b.InvalidBencode):
+            codec.decode(b'l' * 100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import asyncio
+import random
+
+import asynctest
+
+from oversimplified_dht.crawl import InvalidResponse, NodeCrawler, ValueCrawler, StreamingValueCrawler
+from oversimplified_dht.node import Node, NodeInfo, NodeId, CompactNodeList, pack_compact_nodes
+
+
+class SimulatedNetwork:
+    """Nodes with Kademlia-like knowledge: a few random nodes at every distance plus their closest neighbours"""
+
+    def __init__(self, size=300, k=8, seed=0):
+        self.rng = random.Random(seed)
+        self.k = k
+        self.infos = [NodeInfo('127.0.0.1', port, NodeId.from_int(self.rng.getrandbits(160)))
+                      for port in range(1000, 1000 + size)]
+        self.known = {info.id: self._table_of(info) for info in self.infos}
+        self.delays = {}
+        self.failing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queries = 0
+
+    def _table_of(self, own):
+        buckets = {}
+        for info in self.infos:
+            if info.id != own.id:
+                buckets.setdefault((own.id ^ info.id).bit_length(), []).append(info)
+        known = {info.id: info for bucket in buckets.values()
+                 for info in self.rng.sample(bucket, min(len(bucket), self.k))}
+        known.update((info.id, info) for info in self.closest(own.id)[1:self.k + 1])
+        return list(known.values())
+
+    def closest(self, target, infos=None):
+        return sorted(self.infos if infos is None else infos, key=lambda i: target ^ i.id)
+
+    async def rpc_find(self, node, target):
+        self.queries += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(node.id, 0.001))
+            if node.id in self.failing:
+                raise asyncio.TimeoutError
+            return self.closest(target, self.known[node.id])[:self.k], [(node.info.host, node.info.port)]
+        finally:
+            self.in_flight -= 1
+
+    def seeds(self, number=3):
+        return [Node(info) for info in self.rng.sample(self.infos, number)]
+
+
+class NodeCrawlerTestCase(asynctest.TestCase):
+    async def test_finds_closest(self):
+        network = SimulatedNetwork()
+        for _ in range(10):
+            target = NodeId.from_int(network.rng.getrandbits(160))
+            crawler = NodeCrawler(network.rpc_find, network.seeds(), target, add_node=lambda n: None)
+            await crawler.run()
+            self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[:8]])
+
+    async def test_many_seeds(self):
+        """seeds are ranked as one large batch"""
+        network = SimulatedNetwork()
+        target = NodeId.from_int(network.rng.getrandbits(160))
+        crawler = NodeCrawler(network.rpc_find, network.seeds(200), target, lambda n: None)
+        self.assertEqual([n.id for _, n in crawler.shortlist], [n.id for n in network.closest(target)
+                                                                 if bytes(n.id) in crawler.seen])
+        await crawler.run()
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[:8]])
+
+    async def test_concurrency_bounded_by_alpha(self):
+        network = SimulatedNetwork()
+        crawler = NodeCrawler(network.rpc_find, network.seeds(10), NodeId.from_int(1), lambda n: None, alpha=2)
+        await crawler.run()
+        self.assertEqual(network.max_in_flight, 2)
+        self.assertEqual(len(crawler.queried), network.queries)
+
+    async def test_failed_nodes_skipped(self):
+        network = SimulatedNetwork()
+        target = NodeId.from_int(network.rng.getrandbits(160))
+        network.failing = {info.id for info in network.closest(target)[:3]}
+        added = []
+        crawler = NodeCrawler(network.rpc_find, network.seeds(), target, added.append)
+        await crawler.run()
+
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[3:11]])
+        self.assertEqual(network.failing, crawler.failed)
+        self.assertFalse(crawler.failed & crawler.responded)
+        self.assertEqual({n.id for n in added}, crawler.responded)
+
+    async def test_invalid_responses_failed(self):
+        network = SimulatedNetwork()
+        target = NodeId.from_int(network.rng.getrandbits(160))
+        invalid = {info.id for info in network.closest(target)[:3]}
+
+        async def rpc_find(node, target_):
+            if node.id in invalid:
+                raise InvalidResponse({b'r': {b'nodes': 5}})
+            return await network.rpc_find(node, target_)
+
+        crawler = NodeCrawler(rpc_find, network.seeds(), target, lambda n: None)
+        await crawler.run()
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[3:11]])
+        self.assertEqual(invalid, crawler.failed)
+
+    async def test_own_id_not_queried(self):
+        """the nodes closest to us return us as one of our closest nodes, we mustn't query ourselves"""
+        network = SimulatedNetwork()
+        own = network.infos[0]
+        queried = []
+
+        async def rpc_find(node, target):
+            queried.append(node.id)
+            return await network.rpc_find(node, target)
+
+        crawler = NodeCrawler(rpc_find, network.seeds() + [Node(own)], own.id, lambda n: None, own_id=own.id)
+        await crawler.run()
+        self.assertNotIn(own.id, queried)
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(own.id)[1:9]])
+
+    async def test_slow_node_does_not_hold_lookup(self):
+        """a slow node that isn't among the closest must not delay the end of the lookup"""
+        network = SimulatedNetwork()
+        target = NodeId.from_int(network.rng.getrandbits(160))
+        seeds = network.seeds()
+        slow = max(seeds, key=lambda n: target ^ n.id)
+        network.delays[slow.id] = 5
+        crawler = NodeCrawler(network.rpc_find, seeds, target, lambda n: None)
+
+        await asyncio.wait_for(crawler.run(), 1)
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[:8]])
+        await asyncio.sleep(0)
+        self.assertEqual(network.in_flight, 0)  # outstanding queries are cancelled
+
+    async def test_compact_node_lists(self):
+        network = SimulatedNetwork()
+        target = NodeId.from_int(network.rng.getrandbits(160))
+
+        async def rpc_find(node, target_):
+            infos, peers = await network.rpc_find(node, target_)
+            return CompactNodeList(pack_compact_nodes(infos)), peers
+
+        crawler = NodeCrawler(rpc_find, network.seeds(), target, lambda n: None)
+        await crawler.run()
+        self.assertEqual([n.id for n in crawler.closest()], [i.id for i in network.closest(target)[:8]])
+
+    async def test_value_crawler_collects_peers(self):
+        network = SimulatedNetwork()
+        crawler = ValueCrawler(network.rpc_find, network.seeds(), NodeId.from_int(1), lambda n: None)
+        await crawler.run()
+        self.assertEqual(len(crawler.peers), len(crawler.responded))
+
+    async def test_streaming_value_crawler_deduplicates_peers(self):
+        network = SimulatedNetwork()
+
+        async def rpc_find(node, target):
+            infos, peers = await network.rpc_find(node, target)
+            return infos, peers + [('10.0.0.1', 6881)]
+
+        crawler = StreamingValueCrawler(rpc_find, network.seeds(), NodeId.from_int(1), lambda n: None)
+        await crawler.run()
+        peers = [crawler.peers.get_nowait() for _ in range(crawler.peers.qsize())]
+        self.assertEqual(len(peers), len(crawler.responded) + 1)
+        self.assertEqual(len(set(peers)), len(peers))
+        self.assertEqual(peers[1], ('10.0.0.1', 6881))
+
+
+if __name__ == '__main__':
+    asynctest.main()
@@ -0,0 +1,393 @@
+import asyncio
+import os
+import tempfile
+
+import asynctest
+from bencode.misc import pack_compact_peer
+
+from oversimplified_dht import NodeId, Router
+from oversimplified_dht.crawl import InvalidResponse
+from oversimplified_dht.node import Node, NodeInfo, parse_compact_nodes
+from oversimplified_dht.routing_table import snapshot
+from .local_network import create_network, close_network
+from .test_routing_table.test_snapshot import without_dump_time
+
+
+def delayed_response(delay):
+    async def send_query_timed(addr, method, args, timeout=None):
+        await asyncio.wait_for(asyncio.sleep(delay), timeout)
+        return {b't': b'\x00\x00', b'y': b'r', b'r': {b'id': bytes(NodeId.from_int(2))}}, delay
+
+    return send_query_timed
+
+
+class RouterRTTTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.router = Router(NodeId.from_int(1))
+        self.node = Node(NodeInfo('127.0.0.1', 666, NodeId.from_int(2)))
+
+    async def test_records_rtt(self):
+        self.router.send_query_timed = delayed_response(0.05)
+        await self.router.ping(self.node)
+        self.assertAlmostEqual(self.node.srtt, 0.05, delta=0.02)
+        self.assertEqual(self.node.rttvar, self.node.srtt / 2)
+        self.assertEqual(self.router.rtt_estimator.srtt, self.node.srtt)
+
+    async def test_unknown_node_uses_global_estimate(self):
+        self.router.rtt_estimator.record(0.01)
+        self.router.send_query_timed = delayed_response(0.5)
+        started = self.loop.time()
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.router.ping(self.node)
+        self.assertLess(self.loop.time() - started, self.router.TIMEOUT)
+        self.assertEqual(self.node.queries_not_responded, 1)
+
+    async def test_fast_node_times_out_early(self):
+        self.node.record_responded(rtt=0.01)
+        self.router.send_query_timed = delayed_response(0.5)
+        started = self.loop.time()
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.router.ping(self.node)
+        self.assertLess(self.loop.time() - started, 0.5)
+        self.assertGreater(self.node.timeout(), 0.2)  # backed off after the timeout
+
+    async def test_bad_node_replaced_on_timeout(self):
+        self.router.routing_table.add_node(self.node)  # never responded, so BAD once a query to it fails
+        replacement = Node(NodeInfo('127.0.0.1', 667, NodeId.from_int(3)))
+        bucket = self.router.routing_table.buckets[0]
+        bucket.add_replacement(replacement)
+        self.router.rtt_estimator.record(0.01)
+        self.router.send_query_timed = delayed_response(0.5)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.router.ping(self.node)
+        self.assertNotIn(self.node.id, bucket)
+        self.assertIs(bucket.get(replacement.id), replacement)
+
+
+class RouterCoalescingTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.router = Router(NodeId.from_int(1))
+        self.node = Node(NodeInfo('127.0.0.1', 666, NodeId.from_int(2)))
+        self.sent = []
+        self.router.send_query_timed = self.send_query_timed
+
+    async def send_query_timed(self, addr, method, args, timeout=None):
+        self.sent.append((method, args))
+        await asyncio.sleep(0.01)
+        if addr[1] == 667:
+            raise asyncio.TimeoutError
+        return {b'r': {b'id': bytes(NodeId.from_int(2)), b'nodes': b''}}, 0.01
+
+    async def test_in_flight_queries_coalesce(self):
+        target = os.urandom(20)
+        responses = await asyncio.gather(*(self.router.call_find_node(self.node, target) for _ in range(3)),
+                                         self.router.call_find_peers(self.node, target))
+        self.assertEqual(len(self.sent), 2)  # one find_node, one get_peers
+        self.assertEqual(len(responses), 4)
+        self.assertFalse(self.router.queries_in_flight)
+
+    async def test_different_targets_not_coalesced(self):
+        await asyncio.gather(self.router.call_find_node(self.node, os.urandom(20)),
+                             self.router.call_find_node(self.node, os.urandom(20)))
+        self.assertEqual(len(self.sent), 2)
+
+    async def test_results_cached(self):
+        target = os.urandom(20)
+        await self.router.call_find_node(self.node, target)
+        await self.router.call_find_node(self.node, target)
+        self.assertEqual(len(self.sent), 1)
+        self.router.RESULT_TTL = 0
+        self.router.query_results.clear()
+        await self.router.call_find_node(self.node, target)
+        await self.router.call_find_node(self.node, target)
+        self.assertEqual(len(self.sent), 3)
+
+    async def test_malformed_responses_invalid(self):
+        for r in ({b'id': bytes(NodeId.from_int(2)), b'nodes': 5}, [b'nodes']):
+            async def send_query_timed(addr, method, args, timeout=None):
+                return {b'r': r}, 0.01
+
+            self.router.send_query_timed = send_query_timed
+            self.router.query_results.clear()
+            with self.assertRaises(InvalidResponse):
+                await self.router.call_find_peers(self.node, os.urandom(20))
+
+    async def test_timeouts_shared_not_cached(self):
+        node = Node(NodeInfo('127.0.0.1', 667, NodeId.from_int(3)))
+        target = os.urandom(20)
+        results = await asyncio.gather(self.router.call_find_node(node, target),
+                                       self.router.call_find_node(node, target), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, asyncio.TimeoutError) for result in results))
+        self.assertEqual(len(self.sent), 1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.router.call_find_node(node, target)
+        self.assertEqual(len(self.sent), 2)
+
+    async def test_every_caller_node_recorded(self):
+        """copies of a node, e.g. from different lookups, all learn of the response the query they shared got"""
+        target = os.urandom(20)
+        copies = [Node(NodeInfo('127.0.0.1', 666, NodeId.from_int(2))) for _ in range(3)]
+        await asyncio.gather(*(self.router.call_find_node(copy, target) for copy in copies[:2]))
+        await self.router.call_find_node(copies[2], target)  # from the cache
+        self.assertEqual(len(self.sent), 1)
+        self.assertTrue(all(copy.get_status() == Node.State.GOOD for copy in copies))
+        self.assertEqual([copy.srtt for copy in copies], [0.01, 0.01, None])
+
+    async def test_every_caller_node_records_timeout(self):
+        target = os.urandom(20)
+        copies = [Node(NodeInfo('127.0.0.1', 667, NodeId.from_int(3))) for _ in range(2)]
+        await asyncio.gather(*(self.router.call_find_node(copy, target) for copy in copies), return_exceptions=True)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual([copy.queries_not_responded for copy in copies], [1, 1])
+
+    async def test_query_cancelled_with_last_caller(self):
+        target = os.urandom(20)
+        callers = [asyncio.ensure_future(self.router.call_find_node(self.node, target)) for _ in range(2)]
+        await asyncio.sleep(0)
+        query = self.router.queries_in_flight[(self.node.info.address, b'find_node', target)][0]
+        callers[0].cancel()
+        await asyncio.sleep(0)
+        self.assertFalse(query.done())
+        callers[1].cancel()
+        await asyncio.sleep(0.005)
+        self.assertTrue(query.cancelled())
+        self.assertFalse(self.router.queries_in_flight)
+        self.assertFalse(self.router.query_results)
+
+
+class RouterBackgroundTasksTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.router = Router(NodeId.from_int(1))
+        self.calls = 0
+
+    async def test_refresh_survives_errors(self):
+        async def refresh_stale_buckets():
+            self.calls += 1
+            raise ValueError('malformed')
+
+        self.router.REFRESH_INTERVAL = 0.01
+        self.router.refresh_stale_buckets = refresh_stale_buckets
+        task = asyncio.ensure_future(self.router.refresh_buckets_periodically())
+        await asyncio.sleep(0.05)
+        self.assertGreater(self.calls, 1)
+        self.assertFalse(task.done())
+        task.cancel()
+
+    async def test_snapshot_survives_errors(self):
+        self.router.SNAPSHOT_INTERVAL = 0.01
+        self.router.routing_table_path = os.path.join(tempfile.gettempdir(), 'missing', 'directory', 'table')
+        task = asyncio.ensure_future(self.router.save_routing_table_periodically())
+        await asyncio.sleep(0.05)
+        self.assertFalse(task.done())
+        task.cancel()
+
+
+class RouterHandlersTestCase(asynctest.TestCase):
+    async def setUp(self):
+        self.routers = await create_network(8)
+        self.server, self.client = self.routers[0], self.routers[-1]
+        self.server_address = ('127.0.0.1', self.server.transport.get_extra_info('sockname')[1])
+
+    def tearDown(self):
+        close_network(self.routers)
+
+    async def query(self, method, **args):
+        args = {key.encode(): value for key, value in args.items()}
+        args.setdefault(b'id', bytes(self.client.node_id))
+        return await self.client.send_query(self.server_address, method, args, timeout=1)
+
+    async def test_find_node(self):
+        target = NodeId.from_bytes(os.urandom(20))
+        response = await self.query(b'find_node', target=bytes(target))
+        self.assertEqual(response[b'r'][b'id'], bytes(self.server.node_id))
+        self.assertEqual([info.id for info in parse_compact_nodes(response[b'r'][b'nodes'])],
+                         [node.id for node in self.server.routing_table.get_neighbours(target)])
+        self.assertTrue(response[b'r'][b'nodes'])
+
+    async def test_get_peers_without_peers(self):
+        response = await self.query(b'get_peers', info_hash=os.urandom(20))
+        self.assertIn(b'token', response[b'r'])
+        self.assertIn(b'nodes', response[b'r'])
+        self.assertNotIn(b'values', response[b'r'])
+
+    async def test_announce_peer(self):
+        info_hash = os.urandom(20)
+        token = (await self.query(b'get_peers', info_hash=info_hash))[b'r'][b'token']
+
+        response = await self.query(b'announce_peer', info_hash=info_hash, port=6881, token=token)
+        self.assertEqual(response[b'y'], b'r')
+        response = await self.query(b'announce_peer', info_hash=info_hash, port=1, implied_port=1, token=token)
+        self.assertEqual(response[b'y'], b'r')
+
+        response = await self.query(b'get_peers', info_hash=info_hash)
+        client_port = self.client.transport.get_extra_info('sockname')[1]
+        self.assertEqual(sorted(response[b'r'][b'values']),
+                         sorted([pack_compact_peer('127.0.0.1', 6881), pack_compact_peer('127.0.0.1', client_port)]))
+
+    async def test_announce_peer_invalid_token(self):
+        info_hash = os.urandom(20)
+        response = await self.query(b'announce_peer', info_hash=info_hash, port=6881, token=b'forged')
+        self.assertEqual(response[b'y'], b'e')
+        self.assertEqual(response[b'e'][0], 203)
+        self.assertNotIn(info_hash, self.server.peer_storage)
+
+    async def test_invalid_arguments(self):
+        for method, args in ((b'find_node', {}), (b'find_node', {'target': b'short'}),
+                             (b'get_peers', {}), (b'announce_peer', {'info_hash': os.urandom(20)})):
+            response = await self.query(method, **args)
+            self.assertEqual(response[b'y'], b'e', (method, args))
+            self.assertEqual(response[b'e'][0], 203)
+
+    async def test_lookups_shared(self):
+        info_hash = os.urandom(20)
+        with asynctest.patch.object(self.client, 'find_peers', wraps=self.client.find_peers) as find_peers:
+            first, second = await asyncio.gather(self.client.get_peers(info_hash), self.client.get_peers(info_hash))
+        self.assertEqual(find_peers.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertFalse(self.client.lookups)
+
+    async def test_cancelled_caller_does_not_cancel_shared_lookup(self):
+        info_hash = os.urandom(20)
+        first = asyncio.ensure_future(self.client.get_peers(info_hash))
+        second = asyncio.ensure_future(self.client.get_peers(info_hash))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertIsInstance(await second, list)
+
+    async def test_lookups_fill_node_cache(self):
+        await self.client.get_peers(os.urandom(20))
+        self.assertTrue(self.client.node_cache)
+        self.assertLessEqual(set(self.client.node_cache.ids), {int(router.node_id) for router in self.routers})
+
+    async def test_lookup_finds_announced_peer(self):
+        """a peer announced to the nodes closest to an info_hash is found by a lookup from another node"""
+        info_hash = os.urandom(20)
+        for router in self.routers[:-1]:
+            router.peer_storage.store_peer(info_hash, '10.0.0.1', 6881)
+        peers = await self.client.get_peers(info_hash)
+        self.assertIn(('10.0.0.1', 6881), [peer for response in peers for peer in response])
+
+    async def test_iter_peers(self):
+        info_hash = os.urandom(20)
+        for port, router in enumerate(self.routers[:-1], 6881):
+            router.peer_storage.store_peer(info_hash, '10.0.0.1', port)
+        peers = [peer async for peer in self.client.iter_peers(info_hash)]
+        self.assertEqual(len(peers), len(set(peers)))
+        self.assertTrue(peers)
+        self.assertLessEqual(set(peers), {('10.0.0.1', port) for port in range(6881, 6881 + len(self.routers) - 1)})
+
+    async def test_iter_peers_stops_early(self):
+        info_hash = os.urandom(20)
+        for port, router in enumerate(self.routers[:-1], 6881):
+            router.peer_storage.store_peer(info_hash, '10.0.0.1', port)
+        peers = self.client.iter_peers(info_hash, max_peers=1)
+        self.assertEqual(len([peer async for peer in peers]), 1)
+        await asyncio.sleep(0.01)
+        self.assertFalse(self.client.transactions)  # outstanding queries are cancelled
+
+    async def test_metrics(self):
+        lookups, rtts = self.client.lookup_queries.count, self.client.rtt_histogram.count
+        await self.client.get_peers(os.urandom(20))
+        self.assertEqual(self.client.lookup_queries.count, lookups + 1)
+        queries = self.client.packets_sent.get(b'q', b'get_peers')
+        self.assertGreater(queries, 0)
+        self.assertEqual(self.client.rtt_histogram.count - rtts, queries)
+        # The bootstrap node is only known by address and never queried, the others may be
+        received = sum(router.packets_received.get(b'q', b'get_peers') for router in self.routers)
+        self.assertEqual(received, queries)
+        self.assertEqual(sum(router.packets_sent.get(b'r', b'get_peers') for router in self.routers), received)
+        exposed = self.client.metrics.expose()
+        self.assertIn('dht_lookup_queries_count %i\n' % (lookups + 1), exposed)
+        self.assertIn('dht_routing_table_bucket_nodes{bucket="0"}', exposed)
+
+    async def test_refresh_stale_buckets(self):
+        await self.client.bootstrap()
+        await asyncio.sleep(0.01)
+        for bucket in self.client.routing_table.buckets:  # as if nothing had happened for a while
+            bucket.last_changed -= 2 * Node.INACTIVE_TIMEOUT
+            for node in bucket:
+                node.last_response = None
+        stale = self.client.routing_table.stale_buckets()
+        self.assertTrue(stale)
+        queries = self.client.packets_sent.get(b'q', b'find_node')
+        await self.client.refresh_stale_buckets()
+        refreshed = self.client.bucket_refreshes.get()
+        self.assertEqual(refreshed, min(len(stale), self.client.MAX_REFRESHES))
+        self.assertGreater(self.client.packets_sent.get(b'q', b'find_node'), queries)
+        self.assertTrue(all(not bucket.stale() for bucket in stale[:refreshed]))
+
+    async def test_get_peers_many(self):
+        info_hashes = [os.urandom(20) for _ in range(5)]
+        for info_hash in info_hashes[:3]:
+            for router in self.routers[:-1]:
+                router.peer_storage.store_peer(info_hash, '10.0.0.1', 6881)
+        results = {info_hash: peers async for info_hash, peers in self.client.get_peers_many(info_hashes, 2, 3)}
+        self.assertEqual(set(results), set(info_hashes))
+        for info_hash in info_hashes[:3]:
+            self.assertIn(('10.0.0.1', 6881), [peer for response in results[info_hash] for peer in response])
+        for info_hash in info_hashes[3:]:
+            self.assertEqual(results[info_hash], [])
+
+    async def test_get_peers_many_failed_lookup(self):
+        """a lookup that fails yields no peers, and doesn't stop the others"""
+        info_hashes = [os.urandom(20) for _ in range(4)]
+        for router in self.routers[:-1]:
+            router.peer_storage.store_peer(info_hashes[0], '10.0.0.1', 6881)
+        find_peers = self.client.find_peers
+
+        async def failing_find_peers(target, rpc_find=None):
+            if bytes(target) == info_hashes[1]:
+                raise TypeError('malformed response')
+            return await find_peers(target, rpc_find)
+
+        self.client.find_peers = failing_find_peers
+        results = {info_hash: peers async for info_hash, peers in self.client.get_peers_many(info_hashes, 2, 3)}
+        self.assertEqual(set(results), set(info_hashes))
+        self.assertEqual(results[info_hashes[1]], [])
+        self.assertIn(('10.0.0.1', 6881), [peer for response in results[info_hashes[0]] for peer in response])
+
+
+class RouterWarmStartTestCase(asynctest.TestCase):
+    async def setUp(self):
+        self.routers = await create_network(8, base_port=49320)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'table')
+
+    async def tearDown(self):
+        close_network(self.routers)
+        await asyncio.sleep(0)
+        self.directory.cleanup()
+
+    async def test_restart(self):
+        router = await Router.create(port=49340, bootstrap_nodes=(('127.0.0.1', 49320),), routing_table_path=self.path)
+        await router.bootstrap()
+        await asyncio.sleep(0.01)
+        known = {node.id for bucket in router.routing_table.buckets for node in bucket}
+        self.assertTrue(known)
+        router.transport.close()
+        await asyncio.sleep(0)
+        self.assertTrue(os.path.exists(self.path))
+
+        # Bootstrap nodes are unreachable now: a warm start mustn't need them
+        restarted = await Router.create(port=49340, bootstrap_nodes=(('127.0.0.1', 1),), routing_table_path=self.path)
+        self.routers.append(restarted)
+        self.assertEqual(restarted.node_id, router.node_id)
+        self.assertEqual({node.id for bucket in restarted.routing_table.buckets for node in bucket}, known)
+
+        await asyncio.wait_for(restarted.bootstrap(), 1)
+        await restarted.background_tasks[0]  # liveness check
+        self.assertTrue(all(node.get_status() == Node.State.GOOD
+                            for bucket in restarted.routing_table.buckets for node in bucket))
+
+    async def test_periodic_snapshot(self):
+        router = await Router.create(port=49341, bootstrap_nodes=(('127.0.0.1', 49320),), routing_table_path=self.path)
+        self.routers.append(router)
+        router.SNAPSHOT_INTERVAL = 0.01
+        await router.bootstrap()
+        await asyncio.sleep(0.05)
+        self.assertEqual(without_dump_time(snapshot.dump(snapshot.read(self.path))),
+                         without_dump_time(snapshot.dump(router.routing_table)))
+
+
+if __name__ == '__main__':
+    asynctest.main()
@@ -0,0 +1,59 @@
+import random
+import unittest
+from operator import attrgetter
+from unittest import mock
+
+from oversimplified_dht import distance
+from oversimplified_dht.node import Node, NodeInfo, NodeId
+
+
+def brute_force(target, ids, k):
+    return sorted(ids, key=lambda node_id: int(target) ^ int(node_id))[:k]
+
+
+class ClosestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def random_id(self):
+        return NodeId.from_int(self.rng.getrandbits(160))
+
+    def test_matches_brute_force(self):
+        for size in (1, distance.BATCH_THRESHOLD - 1, distance.BATCH_THRESHOLD, 1000):
+            ids = [self.random_id() for _ in range(size)]
+            for k in (1, 8, size, size + 5):
+                target = self.random_id()
+                self.assertEqual(distance.closest(target, ids, k), brute_force(target, ids, k))
+
+    def test_shared_prefixes(self):
+        """ids whose first lanes all tie with the target's must still be ranked on the later lanes"""
+        target = self.random_id()
+        prefix = int(target) >> 64 << 64
+        ids = [NodeId.from_int(prefix | self.rng.getrandbits(64)) for _ in range(500)]
+        ids += [self.random_id() for _ in range(500)]
+        self.assertEqual(distance.closest(target, ids, 20), brute_force(target, ids, 20))
+
+    def test_key(self):
+        nodes = [Node(NodeInfo('127.0.0.1', 1, self.random_id())) for _ in range(200)]
+        target = self.random_id()
+        self.assertEqual([n.id for n in distance.closest(target, nodes, 8, key=attrgetter('id'))],
+                         brute_force(target, [n.id for n in nodes], 8))
+
+    def test_without_numpy(self):
+        ids = [self.random_id() for _ in range(200)]
+        target = self.random_id()
+        with mock.patch.object(distance, 'numpy', None):
+            self.assertEqual(distance.closest(target, ids, 8), brute_force(target, ids, 8))
+
+
+
+@unittest.skipIf(distance.numpy is None, 'NumPy is not installed')
+class NumpyTestCase(unittest.TestCase):
+    def test_top_k(self):
+        ids = [NodeId.from_int(i) for i in (5, 1, 2 ** 159, 7)]
+        distances = distance.xor_distances(bytes(NodeId.from_int(4)), distance.id_array(b''.join(map(bytes, ids))))
+        self.assertEqual(distance.top_k(distances, 3).tolist(), [0, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ import asynctest
 import bencode as b
 
 from oversimplified_dht.krpc import KRPCProtocol
+from oversimplified_dht.ratelimit import QueryLimiter, SendPacer
 
 
 class MockServerProtocol(asyncio.DatagramProtocol):
@@ -43,6 +44,9 @@ class KRPCTestCase(asynctest.TestCase):
         # noinspection PyAttributeOutsideInit
         self.krpc = await KRPCProtocol.create()
 
+    def tearDown(self):
+        self.krpc.transport.close()
+
     async def test_rpc(self):
         krpc2 = await KRPCProtocol.create(port=49003)
         krpc2.krpc_handle_test = MagicMock(return_value=b.encode({b't': b'\x00\x00', b'y': b'r'}))
@@ -66,6 +70,136 @@ class KRPCTestCase(asynctest.TestCase):
             await asyncio.wait_for(node1.send_query(mock_server.address, b'test', {}), 1)
         self.assertFalse(node1.transactions)
 
+    async def test_deadline(self):
+        mock_server: MockServerProtocol = await MockServerProtocol.create(1, 0, port=9998)
+        started = self.loop.time()
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.krpc.send_query(mock_server.address, b'test', {}, timeout=0.1)
+        self.assertLess(self.loop.time() - started, 0.1 + 2 * KRPCProtocol.TIMER_RESOLUTION)
+        self.assertFalse(self.krpc.transactions)
+        self.assertEqual(self.krpc.timeouts.get(), 1)
+        mock_server.transport.close()
+
+    async def test_deadlines_expire_in_bulk(self):
+        mock_server: MockServerProtocol = await MockServerProtocol.create(0, 0, port=9997)
+        silent_address = ('127.0.0.1', 9996)
+        results = await asyncio.gather(
+            *(self.krpc.send_query(silent_address, b'test', {}, timeout=0.1 + i / 1000) for i in range(100)),
+            self.krpc.send_query(mock_server.address, b'test', {}, timeout=0.5),
+            return_exceptions=True)
+
+        self.assertTrue(all(isinstance(r, asyncio.TimeoutError) for r in results[:-1]))
+        self.assertEqual(results[-1][b'y'], b'r')
+        self.assertFalse(self.krpc.transactions)
+        await asyncio.sleep(0.6)
+        self.assertFalse(self.krpc.deadlines)
+        self.assertIsNone(self.krpc.deadline_timer)
+        mock_server.transport.close()
+
+    async def test_paced_queries_do_not_time_out(self):
+        """time spent queued by the send pacer doesn't count towards the timeout"""
+        mock_server: MockServerProtocol = await MockServerProtocol.create(0, 0, port=9995)
+        self.krpc.pacer = SendPacer(self.krpc.sendto, packets_per_second=20)
+        started = self.loop.time()
+        results = await asyncio.gather(
+            *(self.krpc.send_query(mock_server.address, b'test', {}, timeout=0.2) for _ in range(30)))
+        self.assertTrue(all(r[b'y'] == b'r' for r in results))
+        self.assertGreater(self.loop.time() - started, 0.4)
+        self.assertEqual(self.krpc.pacer.throttled, 10)
+        mock_server.transport.close()
+
+    async def test_rtt_excludes_pacing(self):
+        mock_server: MockServerProtocol = await MockServerProtocol.create(0, 0, port=9994)
+        self.krpc.pacer = SendPacer(self.krpc.sendto, packets_per_second=20)
+        results = await asyncio.gather(
+            *(self.krpc.send_query_timed(mock_server.address, b'test', {}, timeout=0.2) for _ in range(30)))
+        self.assertTrue(all(rtt < 0.1 for _, rtt in results))  # the last ones waited 0.5s for the pacer
+        mock_server.transport.close()
+
+    async def test_query_limit(self):
+        krpc2 = await KRPCProtocol.create(port=49004)
+        krpc2.krpc_handle_test = lambda request, address: krpc2.response(request, {})
+        krpc2.query_limiter = QueryLimiter(queries_per_second=1, burst=3)
+        results = await asyncio.gather(
+            *(self.krpc.send_query(('127.0.0.1', 49004), b'test', {}, timeout=0.2) for _ in range(5)),
+            return_exceptions=True)
+        self.assertEqual([r[b'y'] for r in results if not isinstance(r, asyncio.TimeoutError)], [b'r'] * 3)
+        self.assertEqual(krpc2.query_limiter.dropped, 2)
+
+        # responses to its own queries aren't limited
+        self.krpc.krpc_handle_test = lambda request, address: self.krpc.response(request, {})
+        response = await krpc2.send_query(('127.0.0.1', self.krpc.transport.get_extra_info('sockname')[1]),
+                                          b'test', {}, timeout=0.2)
+        self.assertEqual(response[b'y'], b'r')
+        krpc2.transport.close()
+
+    async def test_query_limit_not_bypassed(self):
+        """queries the decoder accepts but that lack QUERY_MARKER are limited too"""
+        handled = []
+        self.krpc.krpc_handle_ping = lambda request, address: handled.append(request)
+        self.krpc.query_limiter = QueryLimiter(queries_per_second=1, burst=3)
+        non_canonical = b'd1:ad2:id20:abcdefghij0123456789e1:q4:ping1:t2:aa1:y01:qe'
+        self.assertNotIn(KRPCProtocol.QUERY_MARKER, non_canonical)
+        for _ in range(10):
+            self.krpc.datagram_received(non_canonical, ('127.0.0.1', 1))
+        self.assertEqual(handled, [])
+        self.assertEqual(self.krpc.query_limiter.dropped, 10)
+
+
+class TransactionTestCase(asynctest.TestCase):
+    silent_address = ('127.0.0.1', 9996)
+
+    async def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.krpc = await KRPCProtocol.create()
+
+    def tearDown(self):
+        self.krpc.transport.close()
+
+    async def test_id_not_reused_while_in_flight(self):
+        self.krpc.last_transaction_id = KRPCProtocol.TRANSACTION_IDS - 1
+        live = self.krpc.transactions[b'\x00\x00'] = self.loop.create_future()
+
+        self.assertEqual(self.krpc.allocate_transaction_id(), b'\xff\xff')
+        self.assertEqual(self.krpc.allocate_transaction_id(), b'\x00\x01')
+        self.assertIs(self.krpc.transactions[b'\x00\x00'], live)
+
+    async def test_wrapped_ids_unique(self):
+        self.krpc.last_transaction_id = KRPCProtocol.TRANSACTION_IDS - 5
+        queries = [asyncio.ensure_future(self.krpc.send_query(self.silent_address, b'test', {}, timeout=0.1))
+                   for _ in range(10)]
+        await asyncio.sleep(0)
+        self.assertEqual(len(self.krpc.transactions), 10)
+        await asyncio.gather(*queries, return_exceptions=True)
+        self.assertFalse(self.krpc.transactions)
+
+    async def test_in_flight_limit(self):
+        self.krpc.max_transactions = 2
+        queries = [asyncio.ensure_future(self.krpc.send_query(self.silent_address, b'test', {}, timeout=0.1))
+                   for _ in range(5)]
+        await asyncio.sleep(0)
+        self.assertEqual(len(self.krpc.transactions), 2)
+        self.assertEqual(len(self.krpc.slot_waiters), 3)
+
+        results = await asyncio.gather(*queries, return_exceptions=True)
+        self.assertTrue(all(isinstance(r, asyncio.TimeoutError) for r in results))
+        self.assertEqual(self.krpc.slots_taken, 0)
+        self.assertFalse(self.krpc.slot_waiters)
+
+    async def test_cancelled_waiter_gives_up_slot(self):
+        self.krpc.max_transactions = 1
+        first = asyncio.ensure_future(self.krpc.send_query(self.silent_address, b'test', {}, timeout=0.1))
+        second = asyncio.ensure_future(self.krpc.send_query(self.silent_address, b'test', {}, timeout=0.1))
+        await asyncio.sleep(0)
+        second.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        self.assertFalse(self.krpc.slot_waiters)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await first
+        self.assertEqual(self.krpc.slots_taken, 0)
+
 
 if __name__ == '__main__':
     asynctest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+import asynctest
+
+from oversimplified_dht.metrics import Registry, serve
+
+
+class RegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_labels(self):
+        counter = self.registry.counter('sent_total', 'Sent', ('type', 'method'))
+        counter.inc(b'q', b'get_peers')
+        counter.inc(b'q', b'get_peers', amount=2)
+        counter.inc(b'r', b'say "hi"\\')
+        self.assertEqual(counter.get(b'q', b'get_peers'), 3)
+        self.assertIn('sent_total{type="q",method="get_peers"} 3\n', self.registry.expose())
+        self.assertIn(r'sent_total{type="r",method="say \"hi\"\\"} 1', self.registry.expose())
+
+    def test_gauges_read_when_exposed(self):
+        sizes = {'a': 1}
+        self.registry.gauge('size', 'Size', lambda: len(sizes))
+        self.registry.gauge('fill', 'Fill', lambda: {(key,): value for key, value in sizes.items()}, ('key',))
+        self.registry.counter('kept_elsewhere_total', 'Elsewhere', function=lambda: 7)
+        sizes['b'] = 2
+        exposed = self.registry.expose()
+        self.assertIn('size 2\n', exposed)
+        self.assertIn('fill{key="b"} 2\n', exposed)
+        self.assertIn('# TYPE kept_elsewhere_total counter\nkept_elsewhere_total 7\n', exposed)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('rtt_seconds', 'RTT', (0.1, 1))
+        for value in (0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertIn('rtt_seconds_bucket{le="0.1"} 1\nrtt_seconds_bucket{le="1"} 2\n'
+                      'rtt_seconds_bucket{le="+Inf"} 3\nrtt_seconds_sum 5.6\nrtt_seconds_count 3\n',
+                      self.registry.expose())
+
+    def test_duplicate_name(self):
+        self.registry.counter('sent_total', 'Sent')
+        with self.assertRaises(ValueError):
+            self.registry.gauge('sent_total', 'Sent')
+
+
+class ServeTestCase(asynctest.TestCase):
+    async def test_serve(self):
+        registry = Registry()
+        registry.counter('sent_total', 'Sent').inc()
+        server = await serve(registry, port=49250)
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', 49250)
+            writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+        self.assertTrue(response.startswith(b'HTTP/1.0 200 OK\r\n'))
+        self.assertTrue(response.endswith(registry.expose().encode()))
+
+
+if __name__ == '__main__':
+    asynctest.main()
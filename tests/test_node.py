@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from oversimplified_dht.node import *
@@ -19,3 +20,33 @@ class CompactNodeTestCase(unittest.TestCase):
 
     def test_pack(self):
         self.assertEqual(pack_compact_nodes(parsed), raw)
+
+
+class CompactNodeListTestCase(unittest.TestCase):
+    def test_sequence(self):
+        nodes = CompactNodeList(raw)
+        self.assertEqual(len(nodes), len(parsed))
+        self.assertEqual(list(nodes), parsed)
+        self.assertEqual(nodes[-1], parsed[-1])
+        self.assertEqual(nodes[1:], parsed[1:])
+        self.assertEqual(bytes(nodes), raw)
+        with self.assertRaises(IndexError):
+            nodes[len(parsed)]
+
+    def test_trailing_bytes_ignored(self):
+        self.assertEqual(list(CompactNodeList(raw + b'\x00' * 25)), parsed)
+
+    def test_ids(self):
+        nodes = CompactNodeList(raw)
+        self.assertEqual([nodes.id(i) for i in range(len(nodes))], [bytes(info.id) for info in parsed])
+        self.assertEqual(nodes.node_infos(skip={bytes(parsed[1].id)}), [parsed[0], parsed[2]])
+
+    def test_closest(self):
+        rng = random.Random(0)
+        for size in (3, 500):
+            infos = [NodeInfo('10.0.0.1', i, NodeId.from_int(rng.getrandbits(160))) for i in range(size)]
+            nodes = CompactNodeList(pack_compact_nodes(infos))
+            target = NodeId.from_int(rng.getrandbits(160))
+            expected = sorted(infos, key=lambda info: target ^ info.id)
+            self.assertEqual(nodes.closest(target), expected)
+            self.assertEqual(nodes.closest(target, 8), expected[:8])
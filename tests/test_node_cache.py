@@ -0,0 +1,76 @@
+import random
+import unittest
+from unittest.mock import patch
+
+from oversimplified_dht.node import Node, NodeInfo, NodeId
+from oversimplified_dht.node_cache import NodeCache
+
+
+def make_node(node_id: int) -> Node:
+    return Node(NodeInfo('127.0.0.1', 1, NodeId.from_int(node_id)))
+
+
+class NodeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('oversimplified_dht.node_cache.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rng = random.Random(0)
+
+    def test_closest(self):
+        cache = NodeCache()
+        ids = [self.rng.getrandbits(160) for _ in range(2000)]
+        # a cluster sharing a long prefix, where the first bisection steps find few nodes
+        ids += [(ids[0] >> 40 << 40) | self.rng.getrandbits(40) for _ in range(20)]
+        for node_id in ids:
+            cache.add(make_node(node_id))
+        for target in [self.rng.getrandbits(160) for _ in range(50)] + [ids[0], ids[0] ^ 1, 0, 2 ** 160 - 1]:
+            for k in (1, 8, 30):
+                expected = sorted(ids, key=lambda node_id: node_id ^ target)[:k]
+                self.assertEqual([int(n.id) for n in cache.closest(NodeId.from_int(target), k)], expected)
+
+    def test_few_nodes(self):
+        cache = NodeCache()
+        self.assertEqual(cache.closest(NodeId.from_int(1)), [])
+        cache.add(make_node(3))
+        self.assertEqual([int(n.id) for n in cache.closest(NodeId.from_int(1))], [3])
+
+    def test_expiry(self):
+        cache = NodeCache(ttl=10)
+        cache.add(make_node(1))
+        self.now += 5
+        cache.add(make_node(2))
+        self.now += 6
+        self.assertEqual([int(n.id) for n in cache.closest(NodeId.from_int(0))], [2])
+        self.assertNotIn(NodeId.from_int(1), cache)
+        self.assertEqual(cache.ids, [2])
+
+    def test_refresh(self):
+        cache = NodeCache(ttl=10)
+        cache.add(make_node(1))
+        self.now += 5
+        cache.add(make_node(1))
+        self.now += 6
+        self.assertIn(NodeId.from_int(1), cache)
+        cache.expire()
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_responsive(self):
+        cache = NodeCache(max_nodes=2)
+        for node_id in (1, 2, 3):
+            cache.add(make_node(node_id))
+        cache.add(make_node(2))
+        cache.add(make_node(4))
+        self.assertEqual(cache.ids, [2, 4])
+
+    def test_discard(self):
+        cache = NodeCache()
+        cache.add(make_node(1))
+        cache.discard(NodeId.from_int(1))
+        cache.discard(NodeId.from_int(5))
+        self.assertEqual((len(cache), cache.ids), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest.mock import patch
+
+from bencode.misc import pack_compact_peer
+
+from oversimplified_dht.peer_storage import LocalPeerStorage
+
+
+class LocalPeerStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('oversimplified_dht.peer_storage.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dedup(self):
+        s = LocalPeerStorage()
+        for _ in range(3):
+            s.store_peer(b'a', '10.0.0.1', 1)
+        s.store_peer(b'a', '10.0.0.1', 2)
+        self.assertEqual(sorted(s.get_peers(b'a')), [pack_compact_peer('10.0.0.1', 1), pack_compact_peer('10.0.0.1', 2)])
+        self.assertEqual(len(s), 2)
+
+    def test_expiry(self):
+        s = LocalPeerStorage(peer_ttl=10)
+        s.store_peer(b'a', '10.0.0.1', 1)
+        self.now += 5
+        s.store_peer(b'a', '10.0.0.1', 2)
+        self.now += 6
+        self.assertEqual(s.get_peers(b'a'), [pack_compact_peer('10.0.0.1', 2)])
+        self.assertEqual(len(s), 1)
+
+        s.store_peer(b'a', '10.0.0.1', 2)  # re-announce renews
+        self.now += 9
+        self.assertIn(b'a', s)
+        self.now += 1
+        self.assertNotIn(b'a', s)
+        self.assertEqual(len(s), 0)
+        self.assertFalse(s.info_hashes)
+
+    def test_expire_all(self):
+        s = LocalPeerStorage(peer_ttl=10)
+        for i in range(10):
+            s.store_peer(bytes([i]), '10.0.0.1', 1)
+        self.now += 10
+        s.expire()
+        self.assertEqual(len(s), 0)
+        self.assertFalse(s.info_hashes)
+
+    def test_lru_eviction(self):
+        s = LocalPeerStorage(max_peers=4)
+        s.store_peer(b'a', '10.0.0.1', 1)
+        s.store_peer(b'b', '10.0.0.1', 1)
+        s.store_peer(b'b', '10.0.0.1', 2)
+        s.store_peer(b'c', '10.0.0.1', 1)
+        s.get_peers(b'a')  # b is now the least recently used
+        s.store_peer(b'd', '10.0.0.1', 1)
+
+        self.assertNotIn(b'b', s)
+        self.assertEqual([b'c', b'a', b'd'], list(s.info_hashes))
+        self.assertEqual(len(s), 3)
+
+    def test_sample(self):
+        s = LocalPeerStorage()
+        for port in range(1, 201):
+            s.store_peer(b'a', '10.0.0.1', port)
+        peers = s.get_peers(b'a')
+        self.assertEqual(len(peers), LocalPeerStorage.MAX_VALUES)
+        self.assertEqual(len(set(peers)), len(peers))
+        self.assertEqual(len(s.get_peers(b'a', number=300)), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
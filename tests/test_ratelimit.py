@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+import asynctest
+
+from oversimplified_dht.ratelimit import QueryLimiter, SendPacer
+
+
+class SendPacerTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def sendto(self, addr, data):
+        self.sent.append((addr, data, self.loop.time()))
+
+    async def test_unlimited_sends_right_away(self):
+        pacer = SendPacer(self.sendto)
+        for i in range(100):
+            pacer.send_nowait(('127.0.0.1', 1), b'x')
+        self.assertEqual(len(self.sent), 100)
+        self.assertEqual(pacer.throttled, 0)
+
+    async def test_global_packet_rate(self):
+        pacer = SendPacer(self.sendto, packets_per_second=100)
+        started = self.loop.time()
+        await asyncio.gather(*(pacer.send(('127.0.0.1', i), b'x') for i in range(150)))
+        self.assertEqual(len(self.sent), 150)
+        self.assertGreaterEqual(self.loop.time() - started, 0.45)  # a burst of 100, then 50 at 100 a second
+        # 50 over the burst, fewer if tokens came back while the sends were being issued
+        self.assertGreaterEqual(pacer.throttled, 40)
+        self.assertLessEqual(pacer.throttled, 50)
+        self.assertGreater(pacer.throttled_time, 0)
+        self.assertEqual(pacer.queue_depth, 0)
+
+    async def test_byte_rate(self):
+        pacer = SendPacer(self.sendto, bytes_per_second=1000)
+        for _ in range(3):
+            pacer.send_nowait(('127.0.0.1', 1), b'x' * 500)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(pacer.queue_depth, 1)
+        await asyncio.sleep(0.6)
+        self.assertEqual(len(self.sent), 3)
+
+    async def test_throttled_destination_does_not_block_others(self):
+        pacer = SendPacer(self.sendto, destination_packets_per_second=10)
+        slow, other = ('127.0.0.1', 1), ('127.0.0.1', 2)
+        for i in range(12):
+            pacer.send_nowait(slow, bytes([i]))
+        pacer.send_nowait(other, b'other')
+        self.assertEqual([data for addr, data, _ in self.sent if addr == other], [b'other'])
+        await asyncio.sleep(0.25)
+        self.assertEqual([data for addr, data, _ in self.sent if addr == slow], [bytes([i]) for i in range(12)])
+
+    async def test_cancelled_send_is_dropped(self):
+        pacer = SendPacer(self.sendto, packets_per_second=1)
+        pacer.send_nowait(('127.0.0.1', 1), b'first')
+        waiting = asyncio.ensure_future(pacer.send(('127.0.0.1', 1), b'second'))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(1.1)
+        self.assertEqual([data for _, data, _ in self.sent], [b'first'])
+        self.assertEqual(pacer.queue_depth, 0)
+        pacer.close()
+
+    async def test_responses_dropped_when_queue_full(self):
+        pacer = SendPacer(self.sendto, packets_per_second=10, max_queued=5)
+        for i in range(20):
+            pacer.send_nowait(('127.0.0.1', 1), bytes([i]))
+        self.assertEqual(len(self.sent), 10)
+        self.assertEqual(pacer.queue_depth, 5)
+        self.assertEqual(pacer.dropped, 5)
+        pacer.close()
+
+    async def test_old_responses_dropped(self):
+        pacer = SendPacer(self.sendto, packets_per_second=10, max_age=0.05)
+        for i in range(12):
+            pacer.send_nowait(('127.0.0.1', 1), bytes([i]))
+        await asyncio.sleep(0.15)  # the first queued one goes after 0.1s, too late
+        self.assertEqual(len(self.sent), 10)
+        self.assertEqual(pacer.dropped, 2)
+        self.assertEqual(pacer.queue_depth, 0)
+
+
+
+class QueryLimiterTestCase(unittest.TestCase):
+    def test_unlimited(self):
+        limiter = QueryLimiter()
+        self.assertFalse(limiter.limited)
+        self.assertTrue(all(limiter.allow('10.0.0.1', now=0) for _ in range(1000)))
+
+    def test_per_source(self):
+        limiter = QueryLimiter(queries_per_second=10)
+        allowed = [limiter.allow('10.0.0.1', now=i / 100) for i in range(100)]  # 100 a second for a second
+        self.assertEqual(sum(allowed), 10 + 9)  # the burst, then 10 a second
+        self.assertTrue(limiter.allow('10.0.0.2', now=1))
+        self.assertEqual(limiter.dropped, 100 - 19)
+
+    def test_sources_bounded(self):
+        limiter = QueryLimiter(queries_per_second=1, max_sources=10)
+        for i in range(100):
+            limiter.allow('10.0.0.%i' % i, now=0)
+        self.assertEqual(list(limiter.sources), ['10.0.0.%i' % i for i in range(90, 100)])
+
+    def test_cpu_budget(self):
+        limiter = QueryLimiter(cpu_budget=0.5)
+        now = limiter.cpu.updated
+        self.assertTrue(limiter.allow('10.0.0.1', now=now))
+        limiter.charge(0.6, now=now)  # more than the budget allows in a second
+        self.assertFalse(limiter.allow('10.0.0.2', now=now + 0.1))
+        self.assertTrue(limiter.allow('10.0.0.2', now=now + 0.3))
+        self.assertEqual(limiter.dropped_cpu, 1)
+
+
+if __name__ == '__main__':
+    asynctest.main()
@@ -0,0 +1,90 @@
+import asyncio
+
+import asynctest
+
+from oversimplified_dht.node import Node, NodeId
+from oversimplified_dht.routing_table.bucket import Bucket
+from oversimplified_dht.routing_table.maintenance import TableMaintainer
+from oversimplified_dht.routing_table.table import RoutingTable
+from ..mock_node import mock_node
+
+
+class TableMaintainerTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.table = RoutingTable(NodeId.from_int(2 ** 159))
+        self.pinged = []
+        self.maintainer = TableMaintainer(lambda: self.table, self.ping)
+
+    def tearDown(self):
+        self.maintainer.close()
+
+    async def ping(self, node):
+        self.pinged.append(node)
+        await asyncio.sleep(0.01)
+        raise asyncio.TimeoutError()
+
+    def fill_first_bucket(self, state):
+        """splits off the upper half of the keyspace, which has our id, and fills the lower half"""
+        self.table.split_bucket(0, mock_node(0))
+        self.table.buckets[0] = Bucket(self.table.buckets[0].min, self.table.buckets[0].max,
+                                       [mock_node(id_, state) for id_ in range(Bucket.MAX_NODES_NUMBER)])
+        return self.table.buckets[0]
+
+    async def test_single_task(self):
+        tasks = len(asyncio.all_tasks())
+        for id_ in range(1000):
+            self.maintainer.add(mock_node(id_ + 1))
+        self.assertEqual(len(asyncio.all_tasks()), tasks + 1)
+        for _ in range(10):  # INSERT_BATCH at a time, yielding in between
+            await asyncio.sleep(0)
+        self.assertFalse(self.maintainer.pending)
+        self.assertEqual(self.maintainer.inserted, sum(map(len, self.table.buckets)))
+
+    async def test_deduplicated(self):
+        first, second = mock_node(5), mock_node(5)
+        self.maintainer.add(first)
+        self.maintainer.add(mock_node(6))
+        self.maintainer.add(second)
+        self.assertEqual(list(self.maintainer.pending), [NodeId.from_int(6), NodeId.from_int(5)])
+        self.assertIs(self.maintainer.pending[NodeId.from_int(5)], second)
+
+    async def test_bounded(self):
+        maintainer = TableMaintainer(lambda: self.table, self.ping, max_pending=10)
+        for id_ in range(15):
+            maintainer.add(mock_node(id_ + 1))
+        self.assertEqual(len(maintainer.pending), 10)
+        self.assertEqual(maintainer.dropped, 5)
+        self.assertEqual(next(iter(maintainer.pending)), NodeId.from_int(6))  # the oldest went first
+        maintainer.close()
+
+    async def test_pings_in_parallel(self):
+        bucket = self.fill_first_bucket(Node.State.QUESTIONABLE)
+        candidates = [mock_node(id_) for id_ in range(100, 100 + Bucket.MAX_NODES_NUMBER)]
+        for node in candidates:
+            self.maintainer.add(node)
+        await asyncio.sleep(0.05)  # a single round of pings if they run in parallel
+
+        self.assertEqual(len(self.pinged), Bucket.MAX_NODES_NUMBER)
+        self.assertEqual(set(bucket.get_nodes_list()), set(candidates))
+        self.assertFalse(bucket.replacements)
+
+    async def test_good_nodes_not_pinged(self):
+        bucket = self.fill_first_bucket(Node.State.GOOD)
+        self.maintainer.add(mock_node(100))
+        await asyncio.sleep(0.01)
+
+        self.assertFalse(self.pinged)
+        self.assertIn(NodeId.from_int(100), bucket.replacements)
+
+    async def test_responding_node_kept(self):
+        async def ping(node):
+            self.pinged.append(node)
+
+        self.maintainer.ping = ping
+        bucket = self.fill_first_bucket(Node.State.QUESTIONABLE)
+        self.maintainer.add(mock_node(100))
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(len(self.pinged), 1)
+        self.assertNotIn(NodeId.from_int(100), bucket)
+        self.assertIn(NodeId.from_int(100), bucket.replacements)
@@ -1,7 +1,11 @@
+import random
+import time
+import unittest
+
 import asynctest
-from asynctest.mock import CoroutineMock, patch
+from asynctest.mock import patch
 
-from oversimplified_dht.node import Node
+from oversimplified_dht.node import Node, NodeId, NodeInfo
 from oversimplified_dht.routing_table.bucket import Bucket
 from oversimplified_dht.routing_table.table import RoutingTable
 from ..mock_node import mock_node
@@ -11,12 +15,10 @@ class RoutingTableAddNodeTestCase(asynctest.TestCase):
     @patch("oversimplified_dht.routing_table.table.RoutingTable.MAXIMUM", 16)
     async def test_not_full(self):
         """bucket isn't full, node must be added straight away"""
-        ping_function_mock = CoroutineMock()
         table = RoutingTable(1)
 
-        added = await table.add_node(mock_node(8), ping_function_mock)
+        added = table.add_node(mock_node(8))
         self.assertTrue(added)
-        ping_function_mock.assert_not_awaited()
         self.assertEqual(len(table.buckets), 1)
         self.assertEqual(len(table.buckets[0]), 1)
 
@@ -27,9 +29,8 @@ class RoutingTableAddNodeTestCase(asynctest.TestCase):
         table = RoutingTable(1)
         table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM,
                                   [mock_node(id_) for id_ in range(Bucket.MAX_NODES_NUMBER)])  # full bucket
-        ping_function_mock = CoroutineMock()
 
-        added = await table.add_node(mock_node(9), ping_function_mock)  # shall fall into the second bucket
+        added = table.add_node(mock_node(9))  # shall fall into the second bucket
         self.assertTrue(added)
         self.assertEqual(len(table.buckets), 2)
 
@@ -42,39 +43,177 @@ class RoutingTableAddNodeTestCase(asynctest.TestCase):
     @patch("oversimplified_dht.routing_table.table.RoutingTable.MAXIMUM", 16)
     @patch("oversimplified_dht.routing_table.table.Bucket.MAX_NODES_NUMBER", 4)
     async def test_full(self):
-        """bucket is full of good nodes, our node_id not within bucket's range, new node should be simply discarded"""
-        ping_function_mock = CoroutineMock()
+        """bucket is full of good nodes, our node_id not within bucket's range, new node only becomes a replacement"""
         table = RoutingTable(666)
         table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM,
                                   [mock_node(id_) for id_ in range(Bucket.MAX_NODES_NUMBER)])  # full bucket
 
-        added = await table.add_node(mock_node(id_=6), ping_function_mock)
+        added = table.add_node(mock_node(id_=6))
         self.assertFalse(added)
         self.assertEqual(len(table.buckets), 1)
-        ping_function_mock.assert_not_awaited()
+        self.assertIn(NodeId.from_int(6), table.buckets[0].replacements)
+        self.assertEqual(table.nodes_to_ping(NodeId.from_int(6)), [])  # nothing questionable to ping
 
     @patch("oversimplified_dht.routing_table.table.RoutingTable.MAXIMUM", 16)
     async def test_bad_nodes(self):
         """bucket is full but it has bad nodes, one of them should be replaced"""
-        ping_function_mock = CoroutineMock()
         table = RoutingTable(666)
         table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM,
                                   [mock_node(id_, Node.State.BAD) for id_ in
                                    range(Bucket.MAX_NODES_NUMBER)])  # full bucket
-        added = await table.add_node(mock_node(id_=10), ping_function_mock)
+        added = table.add_node(mock_node(id_=10))
         self.assertTrue(added)
         self.assertEqual(len(table.buckets), 1)
-        ping_function_mock.assert_not_awaited()
+        self.assertIn(NodeId.from_int(10), table.buckets[0])
 
     @patch("oversimplified_dht.routing_table.table.RoutingTable.MAXIMUM", 16)
     async def test_questionable_nodes(self):
-        """bucket is full but it has questionable nodes, those should be pinged until one is bad"""
-        ping_function_mock = CoroutineMock(return_value=False)
+        """bucket is full but it has questionable nodes, the least recently seen one should be pinged and replaced
+        if it doesn't respond"""
         table = RoutingTable(666)
-        table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM,
-                                  [mock_node(id_, Node.State.QUESTIONABLE) for id_ in
-                                   range(Bucket.MAX_NODES_NUMBER)])  # full bucket
-        added = await table.add_node(mock_node(id_=15), ping_function_mock)
-        self.assertTrue(added)
+        nodes = [mock_node(id_, Node.State.QUESTIONABLE) for id_ in range(Bucket.MAX_NODES_NUMBER)]
+        nodes[3].last_interaction -= 60
+        table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM, nodes)  # full bucket
+        added = table.add_node(mock_node(id_=15))
+        self.assertFalse(added)
+        to_ping = table.nodes_to_ping(NodeId.from_int(15))
+        self.assertEqual(to_ping, [nodes[3]])
+
+        table.record_ping(to_ping[0], responded=False)
         self.assertEqual(len(table.buckets), 1)
-        ping_function_mock.assert_awaited_once()
+        self.assertIn(NodeId.from_int(15), table.buckets[0])
+        self.assertNotIn(nodes[3].id, table.buckets[0])
+        self.assertFalse(table.buckets[0].replacements)
+
+
+class RoutingTableGetBucketTestCase(unittest.TestCase):
+    def test_matches_linear_scan(self):
+        """bisect lookup must agree with a linear scan of bucket ranges after every split"""
+        rng = random.Random(0)
+        table = RoutingTable(NodeId.from_int(rng.getrandbits(160)))
+        for _ in range(60):
+            index, bucket = table.get_bucket_for(table.node_id)
+            table.split_bucket(index, mock_node(rng.randrange(bucket.min, bucket.max)))
+
+            for value in [rng.getrandbits(160) for _ in range(50)] + [b.min for b in table.buckets]:
+                expected = next(i for i, b in enumerate(table.buckets) if b.has_id_in_range(NodeId.from_int(value)))
+                index, bucket = table.get_bucket_for(NodeId.from_int(value))
+                self.assertEqual(index, expected)
+                self.assertIs(bucket, table.buckets[expected])
+
+    def test_out_of_range(self):
+        table = RoutingTable(NodeId.from_int(1))
+        with self.assertRaises(ValueError):
+            table.get_bucket_for(RoutingTable.MAXIMUM)
+
+
+class RoutingTableGetNeighboursTestCase(asynctest.TestCase):
+    async def test_matches_brute_force(self):
+        """get_neighbours must return exactly the k closest nodes by XOR distance"""
+        rng = random.Random(0)
+        table = RoutingTable(NodeId.from_int(rng.getrandbits(160)))
+        for _ in range(2000):
+            # Bias towards our own id so the table grows deep
+            table.add_node(mock_node(int(table.node_id) ^ rng.getrandbits(rng.randint(1, 160))))
+        nodes = [node for bucket in table.buckets for node in bucket]
+
+        for k in (1, 8, 20, len(nodes) + 1):
+            for _ in range(50):
+                target = NodeId.from_int(rng.getrandbits(160))
+                expected = sorted(nodes, key=lambda n: target ^ n.id)[:k]
+                self.assertEqual([n.id for n in table.get_neighbours(target, k)], [n.id for n in expected])
+
+    async def test_empty(self):
+        self.assertEqual(RoutingTable(NodeId.from_int(1)).get_neighbours(NodeId.from_int(2)), [])
+
+
+class RoutingTableReplacementTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = RoutingTable(NodeId.from_int(2 ** 159))
+        self.nodes = [mock_node(id_) for id_ in range(Bucket.MAX_NODES_NUMBER)]
+        self.table.buckets[0] = Bucket(RoutingTable.MINIMUM, RoutingTable.MAXIMUM, self.nodes)
+        self.candidate = mock_node(1000)
+        self.table.add_node(self.candidate)
+
+    def test_bad_node_replaced(self):
+        self.nodes[2].get_status.return_value = Node.State.BAD
+        self.assertTrue(self.table.replace_bad_node(self.nodes[2]))
+        self.assertIs(self.table.buckets[0].get(self.candidate.id), self.candidate)
+        self.assertNotIn(self.nodes[2].id, self.table.buckets[0])
+        self.assertFalse(self.table.buckets[0].replacements)
+
+    def test_good_node_kept(self):
+        self.assertFalse(self.table.replace_bad_node(self.nodes[2]))
+        self.assertIn(self.nodes[2].id, self.table.buckets[0])
+
+    def test_other_node_with_same_id_ignored(self):
+        """a node object the table doesn't hold, e.g. one a lookup made up from a response, says nothing about ours"""
+        self.assertFalse(self.table.replace_bad_node(mock_node(2, Node.State.BAD)))
+        self.assertIn(NodeId.from_int(2), self.table.buckets[0])
+
+    def test_no_replacement(self):
+        self.table.buckets[0].replacements.clear()
+        self.nodes[2].get_status.return_value = Node.State.BAD
+        self.assertFalse(self.table.replace_bad_node(self.nodes[2]))
+        self.assertIn(self.nodes[2].id, self.table.buckets[0])
+
+    def test_replacements_bounded(self):
+        for id_ in range(2000, 2000 + 2 * Bucket.MAX_REPLACEMENTS):
+            self.table.add_node(mock_node(id_))
+        replacements = self.table.buckets[0].replacements
+        self.assertEqual(len(replacements), Bucket.MAX_REPLACEMENTS)
+        self.assertEqual(next(reversed(replacements)), NodeId.from_int(1999 + 2 * Bucket.MAX_REPLACEMENTS))
+
+
+class RoutingTableStaleBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = RoutingTable(NodeId.from_int(2 ** 159))
+        self.table.split_bucket(0, mock_node(0))
+        self.table.buckets[0].pop_node(NodeId.from_int(0))
+        self.now = time.monotonic() + 2 * Node.INACTIVE_TIMEOUT
+        self.recent = self.now - Node.INACTIVE_TIMEOUT / 2
+
+    def add(self, id_, last_response):
+        node = Node(NodeInfo('127.0.0.1', 666, NodeId.from_int(id_)))
+        if last_response is not None:
+            node.record_responded(last_response)
+        self.table.get_bucket_for(node.id)[1].add_node(node)
+
+    def test_recently_changed(self):
+        for bucket in self.table.buckets:
+            bucket.last_changed = self.recent
+        self.assertEqual(self.table.stale_buckets(self.now), [])
+
+    def test_unchanged_empty_bucket_stale(self):
+        lower, upper = self.table.buckets
+        upper.last_changed = self.recent
+        self.assertEqual(self.table.stale_buckets(self.now), [lower])
+
+    def test_responsive_nodes_not_stale(self):
+        self.add(5, self.recent)
+        self.add(6, self.recent)
+        lower, upper = self.table.buckets
+        upper.last_changed = self.recent
+        self.assertEqual(self.table.stale_buckets(self.now), [])
+
+    def test_silent_nodes_stale(self):
+        """including nodes that never responded, whose last_response is None"""
+        self.add(5, self.recent)
+        self.add(6, None)
+        self.add(2 ** 159 + 1, self.recent)
+        self.add(2 ** 159 + 2, self.now - 1.5 * Node.INACTIVE_TIMEOUT)
+        lower, upper = self.table.buckets
+        lower.last_changed = self.now - 1.1 * Node.INACTIVE_TIMEOUT
+        upper.last_changed = self.now - 1.2 * Node.INACTIVE_TIMEOUT
+        self.assertEqual(self.table.stale_buckets(self.now), [upper, lower])  # least recently changed first
+
+    def test_random_id_in_range(self):
+        for bucket in self.table.buckets:
+            self.assertTrue(all(bucket.has_id_in_range(bucket.random_id()) for _ in range(20)))
+
+
+class RoutingTableOwnIdTestCase(asynctest.TestCase):
+    async def test_own_id_rejected(self):
+        table = RoutingTable(NodeId.from_int(5))
+        self.assertFalse(table.add_node(mock_node(5)))
+        self.assertEqual(len(table.buckets[0]), 0)
@@ -0,0 +1,108 @@
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from oversimplified_dht.node import Node, NodeInfo, NodeId
+from oversimplified_dht.routing_table import snapshot
+from oversimplified_dht.routing_table.table import RoutingTable
+
+
+def filled_table(seed=0) -> RoutingTable:
+    rng = random.Random(seed)
+    table = RoutingTable(NodeId.from_int(rng.getrandbits(160)))
+    for _ in range(20):
+        index, bucket = table.get_bucket_for(table.node_id)
+        table.split_bucket(index, Node(NodeInfo('10.0.0.1', 1, NodeId.from_int(rng.randrange(bucket.min, bucket.max)))))
+    for _ in range(500):
+        node = Node(NodeInfo('10.0.%i.%i' % (rng.randrange(256), rng.randrange(256)), rng.randrange(1, 65536),
+                             NodeId.from_int(int(table.node_id) ^ rng.getrandbits(rng.randint(1, 160)))))
+        if rng.random() < 0.8:
+            node.record_responded(time.monotonic() - rng.randrange(3600))
+        node.queries_not_responded = rng.randrange(4)
+        _, bucket = table.get_bucket_for(node.id)
+        if not bucket.full() and node.id not in bucket:
+            bucket.add_node(node)
+    return table
+
+
+def without_dump_time(data: bytes) -> bytes:
+    """snapshots of the same table taken at different times only differ in the time of the dump"""
+    return data[:len(snapshot.MAGIC) + snapshot.HEADER.size - 8] + data[len(snapshot.MAGIC) + snapshot.HEADER.size:]
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        table = filled_table()
+        loaded = snapshot.load(snapshot.dump(table))
+
+        self.assertEqual(loaded.node_id, table.node_id)
+        self.assertEqual(loaded.bounds, table.bounds)
+        self.assertEqual([(b.min, b.max) for b in loaded.buckets], [(b.min, b.max) for b in table.buckets])
+        for bucket, loaded_bucket in zip(table.buckets, loaded.buckets):
+            for node, loaded_node in zip(bucket, loaded_bucket):
+                self.assertEqual(loaded_node.info, node.info)
+                self.assertEqual(loaded_node.queries_not_responded, node.queries_not_responded)
+                self.assertEqual(loaded_node.get_status(), node.get_status())
+                if node.last_response is None:
+                    self.assertIsNone(loaded_node.last_response)
+                else:
+                    self.assertAlmostEqual(loaded_node.last_response, node.last_response,
+                                           delta=2)
+
+    def test_downtime_ages_nodes(self):
+        """a node that responded just before a long downtime is questionable after it"""
+        table = RoutingTable(NodeId.from_int(1))
+        node = Node(NodeInfo('10.0.0.1', 1, NodeId.from_int(2)))
+        node.record_responded(time.monotonic() - 1)
+        table.buckets[0].add_node(node)
+        data = snapshot.dump(table)
+        self.assertEqual(snapshot.load(data).buckets[0].get_nodes_list()[0].get_status(), Node.State.GOOD)
+
+        header = snapshot.HEADER.unpack_from(data, len(snapshot.MAGIC))
+        data = (snapshot.MAGIC + snapshot.HEADER.pack(*header[:2], header[2] - Node.INACTIVE_TIMEOUT)
+                + data[len(snapshot.MAGIC) + snapshot.HEADER.size:])
+        loaded = snapshot.load(data).buckets[0].get_nodes_list()[0]
+        self.assertEqual(loaded.get_status(), Node.State.QUESTIONABLE)
+        self.assertAlmostEqual(time.monotonic() - loaded.last_response, Node.INACTIVE_TIMEOUT + 1, delta=2)
+
+    def test_compact(self):
+        table = filled_table()
+        nodes = sum(map(len, table.buckets))
+        self.assertEqual(len(snapshot.dump(table)),
+                         len(snapshot.MAGIC) + 30 + 21 * len(table.buckets) + snapshot.NODE_SIZE * nodes)
+
+    def test_invalid(self):
+        data = snapshot.dump(filled_table())
+        for invalid in (b'', b'garbage', data[:len(data) // 2], data[:-1]):
+            with self.assertRaises(ValueError):
+                snapshot.load(invalid)
+
+    def test_trailing_data(self):
+        with self.assertRaises(ValueError):
+            snapshot.load(snapshot.dump(filled_table()) + b'\x00')
+
+    def test_ranges_not_split_halves(self):
+        """sorted, unique bounds that don't halve the keyspace: [0, 3 * 2^157) and [3 * 2^157, 2^160)"""
+        table = RoutingTable(NodeId.from_int(1))
+        data = snapshot.MAGIC + snapshot.HEADER.pack(bytes(table.node_id), 2, time.time())
+        for min_ in (0, 3 * 2 ** 157):
+            data += snapshot.BUCKET.pack(NodeId.int_to_bytes(min_), 0)
+        with self.assertRaises(ValueError):
+            snapshot.load(data)
+
+    def test_save_read(self):
+        table = filled_table()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table')
+            self.assertIsNone(snapshot.read(path))
+            snapshot.save(table, path)
+            snapshot.save(table, path)
+            self.assertEqual(os.listdir(directory), ['table'])
+            self.assertEqual(without_dump_time(snapshot.dump(snapshot.read(path))),
+                             without_dump_time(snapshot.dump(table)))
+
+
+if __name__ == '__main__':
+    unittest.main()
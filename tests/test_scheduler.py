@@ -0,0 +1,51 @@
+import asyncio
+
+import asynctest
+
+from oversimplified_dht.scheduler import QueryScheduler
+
+
+class QuerySchedulerTestCase(asynctest.TestCase):
+    def setUp(self):
+        self.scheduler = QueryScheduler(max_in_flight=2)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.order = []
+
+    async def rpc(self, lookup, query):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.order.append(lookup)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        return lookup, query
+
+    async def test_in_flight_bounded(self):
+        rpc = self.scheduler.share(self.rpc)
+        results = await asyncio.gather(*(rpc('a', i) for i in range(10)))
+        self.assertEqual(results, [('a', i) for i in range(10)])
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(self.scheduler.in_flight, 0)
+
+    async def test_lookups_take_turns(self):
+        a, b = self.scheduler.share(self.rpc), self.scheduler.share(self.rpc)
+        await asyncio.gather(*[a('a', i) for i in range(6)], *[b('b', i) for i in range(2)])
+        # a took both free slots first; after that, freed slots alternate while b waits
+        self.assertEqual(self.order, ['a', 'a', 'a', 'b', 'a', 'b', 'a', 'a'])
+
+    async def test_cancelled_waiter_gives_up_turn(self):
+        a, b = self.scheduler.share(self.rpc), self.scheduler.share(self.rpc)
+        running = [asyncio.ensure_future(a('a', i)) for i in range(2)]
+        waiting = asyncio.ensure_future(b('b', 0))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(*running)
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(self.scheduler.turns)
+        self.assertEqual(self.scheduler.in_flight, 0)
+        self.assertEqual(self.order, ['a', 'a'])
+
+
+if __name__ == '__main__':
+    asynctest.main()
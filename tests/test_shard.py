@@ -0,0 +1,55 @@
+import asyncio
+import os
+import unittest
+
+import asynctest
+
+from oversimplified_dht import NodeId
+from oversimplified_dht.shard import ShardedRouter, shard_ids
+from .local_network import create_network, close_network
+
+
+class ShardIdsTestCase(unittest.TestCase):
+    def test_ids_split_keyspace(self):
+        ids = shard_ids(4)
+        self.assertEqual([int(node_id) >> 158 for node_id in ids], [0, 1, 2, 3])
+
+
+class ShardedRouterTestCase(asynctest.TestCase):
+    async def setUp(self):
+        # Cleanups rather than tearDown, so that a setUp that fails halfway still frees the ports and the workers
+        self.routers = await create_network(8, base_port=49400)
+        self.addCleanup(close_network, self.routers)
+        self.sharded = await ShardedRouter.create(workers=2, base_port=49420,
+                                                  bootstrap_nodes=(('127.0.0.1', 49400),))
+        self.addCleanup(self.close_sharded)
+        await asyncio.wait_for(self.sharded.bootstrap(), 10)
+
+    async def close_sharded(self):
+        self.sharded.close()
+        await self.sharded.wait_closed()
+
+    async def test_worker_for(self):
+        low, high = self.sharded.workers
+        self.assertIs(self.sharded.worker_for(NodeId.from_int(0)), low)
+        self.assertIs(self.sharded.worker_for(NodeId.from_int(2 ** 160 - 1)), high)
+
+    async def test_get_peers(self):
+        info_hash = os.urandom(20)
+        for router in self.routers:
+            router.peer_storage.store_peer(info_hash, '10.0.0.1', 6881)
+        peers = await self.sharded.get_peers(info_hash)
+        self.assertIn(('10.0.0.1', 6881), [peer for response in peers for peer in response])
+
+    async def test_errors_forwarded(self):
+        with self.assertRaises(AttributeError):
+            await self.sharded.call(NodeId.from_int(0), 'no_such_method')
+
+    async def test_stats_combined(self):
+        await asyncio.gather(*(self.sharded.get_peers(bytes([i]) * 20) for i in (0, 255)))
+        stats = await self.sharded.stats()
+        self.assertIn('dht_lookup_queries_count 4\n', stats)  # a bootstrap and a get_peers in each worker
+
+
+if __name__ == '__main__':
+    asynctest.main()
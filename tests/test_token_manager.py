@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch
+
+from oversimplified_dht.token_manager import TokenManager
+
+INTERVAL = TokenManager.ROTATION_INTERVAL
+
+
+class TokenManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('oversimplified_dht.token_manager.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = TokenManager()
+
+    def test_valid_for_one_to_two_intervals(self):
+        token = self.manager.issue_token('10.0.0.1')
+        self.now += INTERVAL - 0.001
+        self.assertTrue(self.manager.verify_token('10.0.0.1', token))
+        self.now += 0.001  # first rotation, token was made with what is now the previous secret
+        self.assertTrue(self.manager.verify_token('10.0.0.1', token))
+        self.now += INTERVAL - 0.001
+        self.assertTrue(self.manager.verify_token('10.0.0.1', token))
+        self.now += 0.001
+        self.assertFalse(self.manager.verify_token('10.0.0.1', token))
+
+    def test_issued_late_in_interval(self):
+        self.now += INTERVAL - 1
+        token = self.manager.issue_token('10.0.0.1')
+        self.now += INTERVAL
+        self.assertTrue(self.manager.verify_token('10.0.0.1', token))
+        self.now += 1
+        self.assertFalse(self.manager.verify_token('10.0.0.1', token))
+
+    def test_long_idle(self):
+        """after two intervals without any call, both secrets must have changed"""
+        token = self.manager.issue_token('10.0.0.1')
+        self.now += 2 * INTERVAL + 1
+        self.assertFalse(self.manager.verify_token('10.0.0.1', token))
+        self.assertNotEqual(self.manager.issue_token('10.0.0.1'), token)
+
+    def test_rotation_keeps_schedule(self):
+        self.now += INTERVAL + 10
+        self.manager.rotate()
+        self.assertEqual(self.manager.rotated_at, 1000.0 + INTERVAL)
+
+    def test_other_host(self):
+        token = self.manager.issue_token('10.0.0.1')
+        self.assertFalse(self.manager.verify_token('10.0.0.2', token))
+        self.assertFalse(self.manager.verify_token('10.0.0.1', token[:-1]))
+        self.assertFalse(self.manager.verify_token('10.0.0.1', None))
+
+    def test_constant_memory(self):
+        for i in range(1000):
+            self.manager.issue_token('10.0.%i.%i' % (i // 256, i % 256))
+        self.assertEqual(set(vars(self.manager)), {'token_key', 'previous_token_key', 'rotated_at'})
+
+
+if __name__ == '__main__':
+    unittest.main()